@@ -0,0 +1,335 @@
+"""
+Load-test harness for the AI service
+
+Drives a mix of endpoints open-loop at a target request rate and reports
+throughput, p50/p95/p99 latency, errors and the share of responses that
+were fallbacks. By default the app runs in-process against the offline
+fake Gemini backend, so no port, network or quota is involved:
+
+    python benchmark.py --rps 40 --duration 30
+    python benchmark.py --rps 20 --endpoints quiz,chat --fake-config '{"error_rate": 0.05}'
+
+Pass --url to load-test a running server instead (its own GEMINI_BACKEND
+decides whether real quota is used):
+
+    python benchmark.py --url http://localhost:8000 --rps 10 --duration 60
+"""
+
+import argparse
+import asyncio
+import json
+import math
+import os
+import random
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from urllib.parse import urlencode
+
+FALLBACK_PREFIX = "AI service temporarily unavailable"
+
+TOPICS = [
+    "Photosynthesis", "Fractions", "The French Revolution", "Newton's laws", "Cell division",
+    "Linear equations", "The water cycle", "Plate tectonics", "Probability", "World War I",
+]
+
+SAMPLE_ASSIGNMENT = {
+    "topic": "Fractions",
+    "questions": [
+        {"id": 1, "type": "multiple_choice", "question": "What is 1/2 + 1/4?",
+         "options": ["1/4", "3/4", "1", "2/6"], "correct_answer": "B"},
+        {"id": 2, "type": "short_answer", "question": "Explain how to compare 2/3 and 3/5.",
+         "correct_answer": "Use a common denominator: 10/15 and 9/15, so 2/3 is larger."},
+    ],
+}
+
+# name -> (method, path, query params factory, JSON body factory); factories take (topic, i)
+Scenario = Tuple[str, str, Optional[Callable[[str, int], Dict[str, Any]]], Optional[Callable[[str, int], Any]]]
+
+SCENARIOS: Dict[str, Scenario] = {
+    "quiz": ("POST", "/api/quiz/generate", None, lambda t, i: {"topic": t, "num_questions": 5}),
+    "assignment": ("POST", "/api/assignments/generate", None, lambda t, i: {"topic": t, "num_questions": 4}),
+    "grade_assignment": ("POST", "/api/assignments/grade", None, lambda t, i: {
+        "assignment_data": SAMPLE_ASSIGNMENT, "student_answers": {"1": "B", "2": f"Common denominators ({i})"}}),
+    "grade_submission": ("POST", "/api/grade/submission", None, lambda t, i: {
+        "question": f"Describe {t}.", "rubric": "Accuracy and clarity", "student_answer": f"{t} is ... ({i})"}),
+    "chat": ("POST", "/api/tutor/chat", None, lambda t, i: {
+        "session_id": f"bench-{i % 200}", "message": f"Can you explain {t}?", "subject": "science"}),
+    "explanation": ("POST", "/api/learning/explanation", None, lambda t, i: {"topic": t}),
+    "lesson_plan": ("POST", "/api/teacher/lesson-plan", None, lambda t, i: {"topic": t, "grade_level": "grade 8"}),
+    "performance": ("POST", "/api/analytics/performance", None, lambda t, i: {
+        "student_data": {"student": f"s{i}"}, "recent_scores": [72, 80, 77, 85], "completed_topics": [t]}),
+    "cohort": ("POST", "/api/analytics/cohort", None, lambda t, i: {"students": [
+        {"student_id": f"s{n}", "scores": [60 + (n * 7 + k * 3) % 40 for k in range(8)],
+         "topic_scores": {t: [55 + (n + k) % 45 for k in range(3)]}} for n in range(500)]}),
+    "learning_path": ("POST", "/api/analytics/learning-path", None, lambda t, i: {
+        "current_level": "beginner", "target_goals": [f"Master {t}"]}),
+    "flashcards": ("POST", "/api/study/flashcards", lambda t, i: {"topic": t, "num_cards": 8}, None),
+    "flashcards_due": ("GET", "/api/study/flashcards/due", lambda t, i: {
+        "student_id": f"bench-{i % 200}", "topic": t, "limit": 10}, None),
+    "study_guide": ("POST", "/api/study/guide", None, lambda t, i: [t, "Review"]),
+    "quiz_stream": ("POST", "/api/quiz/generate/stream", None, lambda t, i: {"topic": t, "num_questions": 5}),
+    "chat_stream": ("POST", "/api/tutor/chat/stream", None, lambda t, i: {
+        "session_id": f"bench-stream-{i % 200}", "message": f"Summarize {t}", "subject": "science"}),
+    "batch": ("POST", "/api/batch/process", None, lambda t, i: {"requests": [
+        {"type": "explanation", "params": {"topic": t}},
+        {"type": "quiz", "params": {"topic": t, "num_questions": 3}},
+    ]}),
+}
+
+
+def is_fallback_payload(payload: Any) -> bool:
+    """True when a response, or any part of it, is a canned or partial fallback"""
+    if isinstance(payload, dict):
+        if payload.get("fallback") or payload.get("partial") or "error" in payload:
+            return True
+        return any(is_fallback_payload(value) for value in payload.values())
+    if isinstance(payload, list):
+        return any(is_fallback_payload(value) for value in payload)
+    return isinstance(payload, str) and payload.startswith(FALLBACK_PREFIX)
+
+
+def is_fallback_body(body: bytes) -> bool:
+    text = body.decode("utf-8", errors="replace")
+    try:
+        return is_fallback_payload(json.loads(text))
+    except ValueError:
+        # Streamed SSE/NDJSON bodies
+        return FALLBACK_PREFIX in text or '"fallback": true' in text or '"partial": true' in text
+
+
+def percentile(sorted_values: List[float], fraction: float) -> float:
+    if not sorted_values:
+        return 0.0
+    # Nearest-rank percentile
+    index = min(len(sorted_values) - 1, max(0, math.ceil(fraction * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+class InProcessClient:
+    """Calls the ASGI app directly, including its lifespan, without a network hop"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def request(self, method: str, path: str, params: Optional[Dict[str, Any]], body: Optional[bytes],
+                      headers: Dict[str, str]) -> Tuple[int, bytes]:
+        raw_headers = [(k.lower().encode("latin-1"), v.encode("latin-1")) for k, v in headers.items()]
+        if body is not None:
+            raw_headers.append((b"content-type", b"application/json"))
+            raw_headers.append((b"content-length", str(len(body)).encode("latin-1")))
+        scope = {
+            "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": method,
+            "scheme": "http", "path": path, "raw_path": path.encode("utf-8"),
+            "query_string": urlencode(params or {}).encode("latin-1"), "root_path": "",
+            "headers": raw_headers, "client": ("127.0.0.1", 50000), "server": ("benchmark", 80),
+        }
+        sent = False
+        status = {"code": 500}
+        chunks: List[bytes] = []
+
+        async def receive():
+            nonlocal sent
+            if not sent:
+                sent = True
+                return {"type": "http.request", "body": body or b"", "more_body": False}
+            # Block like a connected client until the response is finished
+            await asyncio.Event().wait()
+
+        async def send(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+            elif message["type"] == "http.response.body":
+                chunks.append(message.get("body", b""))
+
+        await self.app(scope, receive, send)
+        return status["code"], b"".join(chunks)
+
+
+class HttpClient:
+    """Blocking ``requests`` calls run on a thread pool sized to the allowed concurrency"""
+
+    def __init__(self, base_url: str, concurrency: int, timeout: float):
+        import requests
+        self._requests = requests
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+        self._local = threading.local()
+        self._executor = ThreadPoolExecutor(max_workers=concurrency)
+
+    def _session(self):
+        session = getattr(self._local, "session", None)
+        if session is None:
+            session = self._requests.Session()
+            self._local.session = session
+        return session
+
+    def _call(self, method, path, params, body, headers) -> Tuple[int, bytes]:
+        if body is not None:
+            headers = {**headers, "Content-Type": "application/json"}
+        response = self._session().request(method, self.base_url + path, params=params, data=body,
+                                           headers=headers, timeout=self.timeout)
+        return response.status_code, response.content
+
+    async def request(self, method, path, params, body, headers) -> Tuple[int, bytes]:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, self._call, method, path, params, body, headers)
+
+    def close(self):
+        self._executor.shutdown(wait=False)
+
+
+class Results:
+    def __init__(self):
+        self.latencies: Dict[str, List[float]] = {}
+        self.counts: Dict[str, Dict[str, int]] = {}
+
+    def record(self, scenario: str, latency: float, status: int, fallback: bool) -> None:
+        self.latencies.setdefault(scenario, []).append(latency)
+        counts = self.counts.setdefault(scenario, {"requests": 0, "ok": 0, "errors": 0, "rejected": 0, "fallback": 0})
+        counts["requests"] += 1
+        if status == 429:
+            counts["rejected"] += 1
+        elif 200 <= status < 300:
+            counts["ok"] += 1
+            counts["fallback"] += int(fallback)
+        else:
+            counts["errors"] += 1
+
+    def summary(self, elapsed: float) -> Dict[str, Any]:
+        rows = {}
+        groups = {name: (self.counts[name], self.latencies[name]) for name in sorted(self.counts)}
+        if groups:
+            total = {key: sum(c[key] for c, _ in groups.values()) for key in next(iter(groups.values()))[0]}
+            groups["ALL"] = (total, [l for _, lat in groups.values() for l in lat])
+        for name, (counts, latencies) in groups.items():
+            ordered = sorted(latencies)
+            rows[name] = {
+                **counts,
+                "throughput_rps": round(counts["requests"] / elapsed, 2) if elapsed else 0.0,
+                "fallback_rate": round(counts["fallback"] / counts["ok"], 4) if counts["ok"] else 0.0,
+                "p50_ms": round(1000 * percentile(ordered, 0.50), 1),
+                "p95_ms": round(1000 * percentile(ordered, 0.95), 1),
+                "p99_ms": round(1000 * percentile(ordered, 0.99), 1),
+                "max_ms": round(1000 * (ordered[-1] if ordered else 0.0), 1),
+            }
+        return rows
+
+
+async def run_load(client, scenarios: List[str], rps: float, duration: float, topic_variety: int,
+                   headers: Dict[str, str], seed: int, max_in_flight: int) -> Tuple[Results, float, int]:
+    """Open-loop load: request i starts at i / rps regardless of how earlier ones are doing"""
+    rng = random.Random(seed)
+    results = Results()
+    in_flight = asyncio.Semaphore(max_in_flight)
+    dropped = 0
+    tasks = []
+
+    async def one(index: int, scenario: str, topic: str):
+        method, path, params_fn, body_fn = SCENARIOS[scenario]
+        params = params_fn(topic, index) if params_fn else None
+        body = json.dumps(body_fn(topic, index)).encode("utf-8") if body_fn else None
+        started = time.perf_counter()
+        try:
+            status, content = await client.request(method, path, params, body, headers)
+        except Exception:
+            status, content = 599, b""
+        finally:
+            in_flight.release()
+        results.record(scenario, time.perf_counter() - started, status, status < 300 and is_fallback_body(content))
+
+    start = time.perf_counter()
+    total = int(rps * duration)
+    for index in range(total):
+        delay = start + index / rps - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        if in_flight.locked():
+            # Client-side cap reached; count the request as dropped rather than queueing it
+            dropped += 1
+            continue
+        await in_flight.acquire()
+        k = rng.randrange(topic_variety)
+        topic = TOPICS[k % len(TOPICS)] + (f" part {k // len(TOPICS)}" if k >= len(TOPICS) else "")
+        tasks.append(asyncio.create_task(one(index, rng.choice(scenarios), topic)))
+    await asyncio.gather(*tasks)
+    return results, time.perf_counter() - start, dropped
+
+
+def print_table(rows: Dict[str, Dict[str, Any]]) -> None:
+    columns = ["requests", "ok", "errors", "rejected", "fallback_rate", "throughput_rps",
+               "p50_ms", "p95_ms", "p99_ms", "max_ms"]
+    width = max([len(name) for name in rows] + [8])
+    print(f"{'endpoint':<{width}}  " + "  ".join(f"{c:>14}" for c in columns))
+    for name, row in rows.items():
+        print(f"{name:<{width}}  " + "  ".join(f"{row[c]:>14}" for c in columns))
+
+
+async def main(args) -> Dict[str, Any]:
+    scenarios = list(SCENARIOS) if args.endpoints == "all" else args.endpoints.split(",")
+    unknown = [s for s in scenarios if s not in SCENARIOS]
+    if unknown:
+        raise SystemExit(f"Unknown endpoints {unknown}; choose from {', '.join(SCENARIOS)}")
+    headers = {"Cache-Control": "no-cache"} if args.cache_bypass else {}
+
+    if args.url:
+        client = HttpClient(args.url, args.max_in_flight, args.timeout)
+        try:
+            results, elapsed, dropped = await run_load(client, scenarios, args.rps, args.duration, args.topics,
+                                                       headers, args.seed, args.max_in_flight)
+        finally:
+            client.close()
+        metrics = None
+    else:
+        os.environ.setdefault("GEMINI_BACKEND", args.backend)
+        # Keep the report readable; set LOG_LEVEL explicitly to see service logs
+        os.environ.setdefault("LOG_LEVEL", "CRITICAL")
+        if args.fake_config:
+            os.environ["FAKE_GEMINI_CONFIG"] = args.fake_config
+        from gemini_service import app
+        async with app.router.lifespan_context(app):
+            client = InProcessClient(app)
+            results, elapsed, dropped = await run_load(client, scenarios, args.rps, args.duration, args.topics,
+                                                       headers, args.seed, args.max_in_flight)
+            _, body = await client.request("GET", "/api/pool/stats", None, None, {})
+            metrics = json.loads(body).get("fake_backend")
+
+    rows = results.summary(elapsed)
+    report = {
+        "target_rps": args.rps,
+        "duration_seconds": round(elapsed, 2),
+        "dropped": dropped,
+        "endpoints": rows,
+        "fake_backend": metrics,
+    }
+    print_table(rows)
+    print(f"\nelapsed {elapsed:.1f}s, target {args.rps} rps, dropped {dropped}"
+          + (f", fake backend {metrics}" if metrics else ""))
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+    return report
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Load-test the AI service endpoints")
+    parser.add_argument("--rps", type=float, default=20.0, help="target requests per second")
+    parser.add_argument("--duration", type=float, default=15.0, help="seconds of load")
+    parser.add_argument("--endpoints", default="all", help=f"comma-separated subset of: {', '.join(SCENARIOS)}")
+    parser.add_argument("--topics", type=int, default=50, help="distinct topics, controls response cache hit rate")
+    parser.add_argument("--cache-bypass", action="store_true", help="send Cache-Control: no-cache")
+    parser.add_argument("--max-in-flight", type=int, default=256, help="client-side concurrency cap")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--url", help="benchmark a running server instead of the in-process app")
+    parser.add_argument("--timeout", type=float, default=60.0, help="per-request timeout with --url")
+    parser.add_argument("--backend", default="fake", help="GEMINI_BACKEND for the in-process app")
+    parser.add_argument("--fake-config", help="FAKE_GEMINI_CONFIG JSON for the in-process fake backend")
+    parser.add_argument("--json", help="also write the report to this file")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    asyncio.run(main(parse_args()))
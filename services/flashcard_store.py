@@ -0,0 +1,317 @@
+"""
+Server-side flashcard decks with SM-2 spaced repetition
+
+Cards are stored per student and deck (topic) in SQLite. Only the
+scheduling state is held in memory, as growable NumPy columns indexed by
+card id: student, deck, due time, interval, ease factor, repetitions and
+lapses. That is a few dozen bytes per card instead of a dict per card, and
+card text is read from SQLite only for the cards actually returned. Each
+student has a list of (due, card id) kept sorted with bisect, so "next N
+due cards for student X" reads the head of one list however many cards
+the store holds.
+
+Several worker processes can share one file. Every insert and review
+stamps the card with the next value of a ``seq`` column, and before each
+read or review a store whose connection sees another process's commit
+(``PRAGMA data_version``) loads just the rows with a higher ``seq`` than
+it has seen, so cards created or reviewed elsewhere are never missing.
+
+Reviews are graded 0-5 and scheduled with SM-2: a grade below 3 resets the
+card to a one-day interval, otherwise the interval grows 1 -> 6 days ->
+interval x ease, and the ease factor moves with the grade (minimum 1.3).
+"""
+
+import bisect
+import sqlite3
+import threading
+import time
+from collections import defaultdict
+from typing import Any, Dict, Iterable, List, Mapping, Optional, Tuple
+
+import numpy as np
+
+from question_bank import normalize_text
+
+DAY = 86400.0
+DEFAULT_EASE = 2.5
+MIN_EASE = 1.3
+
+_COLUMNS = {
+    "student": np.int32,
+    "deck": np.int32,
+    "due": np.float64,
+    "interval": np.float32,
+    "ease": np.float32,
+    "reps": np.int16,
+    "lapses": np.int16,
+}
+
+
+def sm2(grade: int, interval: float, ease: float, reps: int) -> Tuple[float, float, int, bool]:
+    """(interval in days, ease, repetitions, lapsed) after a review graded 0-5"""
+    ease = max(MIN_EASE, ease + 0.1 - (5 - grade) * (0.08 + (5 - grade) * 0.02))
+    if grade < 3:
+        return 1.0, ease, 0, True
+    reps += 1
+    if reps == 1:
+        interval = 1.0
+    elif reps == 2:
+        interval = 6.0
+    else:
+        interval = round(interval * ease, 2)
+    return interval, ease, reps, False
+
+
+class FlashcardStore:
+    def __init__(self, path: str = "flashcards.sqlite3", initial_capacity: int = 1024):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS cards (
+                id INTEGER PRIMARY KEY,
+                student TEXT NOT NULL,
+                deck TEXT NOT NULL,
+                front TEXT NOT NULL,
+                back TEXT NOT NULL,
+                due REAL NOT NULL,
+                interval REAL NOT NULL,
+                ease REAL NOT NULL,
+                reps INTEGER NOT NULL,
+                lapses INTEGER NOT NULL,
+                created_at REAL NOT NULL,
+                seq INTEGER NOT NULL DEFAULT 0
+            )
+            """
+        )
+        if "seq" not in {row[1] for row in self._conn.execute("PRAGMA table_info(cards)")}:
+            self._conn.execute("ALTER TABLE cards ADD COLUMN seq INTEGER NOT NULL DEFAULT 0")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS cards_seq ON cards (seq)")
+        self._conn.commit()
+        # Columns are indexed by card id; ids another process used are gaps with student -1
+        self._size = 0
+        self._count = 0
+        self._columns = {name: self._column(name, max(1, initial_capacity)) for name in _COLUMNS}
+        # Interned student and deck names
+        self._student_ids: Dict[str, int] = {}
+        self._deck_ids: Dict[str, int] = {}
+        # student -> sorted [(due, card id)]
+        self._due_index: Dict[int, List[Tuple[float, int]]] = defaultdict(list)
+        # (student, deck) -> card ids, for deck sizes
+        self._decks: Dict[Tuple[int, int], List[int]] = defaultdict(list)
+        self.reviews = 0
+        self.lapses = 0
+        # Highest seq loaded, and the connection's data_version when last synced
+        self._seq = 0
+        self._data_version = None
+        self.syncs = 0
+        self._load()
+
+    def _load(self) -> None:
+        self._data_version = self._conn.execute("PRAGMA data_version").fetchone()[0]
+        rows = self._conn.execute(
+            "SELECT id, student, deck, due, interval, ease, reps, lapses, seq FROM cards ORDER BY id"
+        ).fetchall()
+        for card_id, student, deck, due, interval, ease, reps, lapses, seq in rows:
+            self._append(card_id, student, deck, due, interval, ease, reps, lapses, indexed=False)
+            self._seq = max(self._seq, seq)
+        for entries in self._due_index.values():
+            entries.sort()
+
+    def _advance(self, card_id: int) -> None:
+        """Count this process's own write as seen, unless another process wrote in between"""
+        seq = self._conn.execute("SELECT seq FROM cards WHERE id = ?", (card_id,)).fetchone()[0]
+        if seq == self._seq + 1:
+            self._seq = seq
+
+    def _sync(self) -> None:
+        """Load cards another process added or reviewed since the last call; needs the lock"""
+        data_version = self._conn.execute("PRAGMA data_version").fetchone()[0]
+        if data_version == self._data_version:
+            return
+        self._data_version = data_version
+        rows = self._conn.execute(
+            "SELECT id, student, deck, due, interval, ease, reps, lapses, seq FROM cards WHERE seq > ? ORDER BY seq",
+            (self._seq,)
+        ).fetchall()
+        columns = self._columns
+        for card_id, student, deck, due, interval, ease, reps, lapses, seq in rows:
+            self._seq = max(self._seq, seq)
+            if card_id >= self._size or columns["student"][card_id] < 0:
+                self._append(card_id, student, deck, due, interval, ease, reps, lapses)
+                continue
+            entries = self._due_index[int(columns["student"][card_id])]
+            del entries[bisect.bisect_left(entries, (float(columns["due"][card_id]), card_id))]
+            bisect.insort(entries, (due, card_id))
+            for name, value in (("due", due), ("interval", interval), ("ease", ease), ("reps", reps), ("lapses", lapses)):
+                columns[name][card_id] = value
+        if rows:
+            self.syncs += 1
+
+    @staticmethod
+    def _column(name: str, capacity: int) -> np.ndarray:
+        return np.full(capacity, -1 if name == "student" else 0, dtype=_COLUMNS[name])
+
+    @staticmethod
+    def _intern(table: Dict[str, int], name: str) -> int:
+        return table.setdefault(name, len(table))
+
+    def _append(self, card_id: int, student: str, deck: str, due: float, interval: float = 0.0,
+                ease: float = DEFAULT_EASE, reps: int = 0, lapses: int = 0, indexed: bool = True) -> None:
+        if card_id >= len(self._columns["due"]):
+            capacity = max(card_id + 1, 2 * len(self._columns["due"]))
+            for name, column in self._columns.items():
+                grown = self._column(name, capacity)
+                grown[:self._size] = column[:self._size]
+                self._columns[name] = grown
+        student_id = self._intern(self._student_ids, student)
+        deck_id = self._intern(self._deck_ids, deck)
+        values = (student_id, deck_id, due, interval, ease, reps, lapses)
+        for name, value in zip(_COLUMNS, values):
+            self._columns[name][card_id] = value
+        self._size = max(self._size, card_id + 1)
+        self._count += 1
+        if indexed:
+            bisect.insort(self._due_index[student_id], (due, card_id))
+        else:
+            # Sorted once after a bulk load
+            self._due_index[student_id].append((due, card_id))
+        self._decks[(student_id, deck_id)].append(card_id)
+
+    def add_cards(self, student: str, deck: str, cards: Iterable[Mapping[str, str]],
+                  now: Optional[float] = None) -> List[Dict[str, Any]]:
+        """Store new cards, due immediately; returns them with their card ids"""
+        now = time.time() if now is None else now
+        deck = normalize_text(deck)
+        added = []
+        with self._lock:
+            self._sync()
+            for card in cards:
+                # SQLite assigns ids, so processes sharing the file never collide
+                card_id = self._conn.execute(
+                    "INSERT INTO cards (student, deck, front, back, due, interval, ease, reps, lapses, created_at, seq) "
+                    "VALUES (?, ?, ?, ?, ?, 0, ?, 0, 0, ?, (SELECT COALESCE(MAX(seq), 0) + 1 FROM cards))",
+                    (student, deck, card["front"], card["back"], now, DEFAULT_EASE, now)
+                ).lastrowid
+                self._advance(card_id)
+                self._append(card_id, student, deck, now)
+                added.append({"card_id": card_id, "front": card["front"], "back": card["back"]})
+            self._conn.commit()
+        return added
+
+    def due_cards(self, student: str, deck: Optional[str] = None, limit: int = 20,
+                  now: Optional[float] = None) -> List[Dict[str, Any]]:
+        """Up to ``limit`` cards due by ``now``, most overdue first, optionally from one deck"""
+        now = time.time() if now is None else now
+        with self._lock:
+            self._sync()
+            student_id = self._student_ids.get(student)
+            deck_id = self._deck_ids.get(normalize_text(deck)) if deck else None
+            if student_id is None or (deck and deck_id is None):
+                return []
+            chosen = []
+            deck_column = self._columns["deck"]
+            for due, card_id in self._due_index[student_id]:
+                if due > now or len(chosen) >= limit:
+                    break
+                if deck_id is None or deck_column[card_id] == deck_id:
+                    chosen.append(card_id)
+            if not chosen:
+                return []
+            texts = dict((row[0], row[1:]) for row in self._conn.execute(
+                f"SELECT id, deck, front, back FROM cards WHERE id IN ({','.join('?' * len(chosen))})", chosen
+            ))
+            return [self._card(card_id, *texts[card_id]) for card_id in chosen]
+
+    def _card(self, card_id: int, deck: str, front: str, back: str) -> Dict[str, Any]:
+        columns = self._columns
+        return {
+            "card_id": card_id,
+            "deck": deck,
+            "front": front,
+            "back": back,
+            "due": float(columns["due"][card_id]),
+            "interval_days": float(columns["interval"][card_id]),
+            "ease": round(float(columns["ease"][card_id]), 2),
+            "repetitions": int(columns["reps"][card_id]),
+            "lapses": int(columns["lapses"][card_id]),
+        }
+
+    def review(self, student: str, card_id: int, grade: int, now: Optional[float] = None) -> Optional[Dict[str, Any]]:
+        """Apply an SM-2 review; None when the card does not belong to ``student``"""
+        now = time.time() if now is None else now
+        columns = self._columns
+        with self._lock:
+            self._sync()
+            student_id = self._student_ids.get(student)
+            if student_id is None or not 0 <= card_id < self._size or columns["student"][card_id] != student_id:
+                return None
+            old_due = float(columns["due"][card_id])
+            interval, ease, reps, lapsed = sm2(
+                grade, float(columns["interval"][card_id]), float(columns["ease"][card_id]), int(columns["reps"][card_id])
+            )
+            due = now + interval * DAY
+            columns["interval"][card_id] = interval
+            columns["ease"][card_id] = ease
+            columns["reps"][card_id] = reps
+            columns["lapses"][card_id] += int(lapsed)
+            columns["due"][card_id] = due
+
+            entries = self._due_index[student_id]
+            del entries[bisect.bisect_left(entries, (old_due, card_id))]
+            bisect.insort(entries, (due, card_id))
+            self.reviews += 1
+            self.lapses += int(lapsed)
+            self._conn.execute(
+                "UPDATE cards SET due = ?, interval = ?, ease = ?, reps = ?, lapses = ?, "
+                "seq = (SELECT COALESCE(MAX(seq), 0) + 1 FROM cards) WHERE id = ?",
+                (due, interval, float(columns["ease"][card_id]), reps, int(columns["lapses"][card_id]), card_id)
+            )
+            self._advance(card_id)
+            self._conn.commit()
+        return {
+            "card_id": card_id,
+            "grade": grade,
+            "due": due,
+            "interval_days": interval,
+            "ease": round(float(columns["ease"][card_id]), 2),
+            "repetitions": reps,
+            "lapsed": lapsed,
+        }
+
+    def deck_size(self, student: str, deck: str) -> int:
+        """Cards in a student's deck, due or not"""
+        with self._lock:
+            self._sync()
+            student_id = self._student_ids.get(student)
+            deck_id = self._deck_ids.get(normalize_text(deck))
+            return len(self._decks.get((student_id, deck_id), ()))
+
+    def fronts(self, student: str, deck: str) -> List[str]:
+        with self._lock:
+            return [row[0] for row in self._conn.execute(
+                "SELECT front FROM cards WHERE student = ? AND deck = ?", (student, normalize_text(deck))
+            )]
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            self._sync()
+            due = self._columns["due"][:self._size]
+            due_now = int(((due <= time.time()) & (self._columns["student"][:self._size] >= 0)).sum())
+            column_bytes = sum(column.itemsize * len(column) for column in self._columns.values())
+        return {
+            "cards": self._count,
+            "students": len(self._student_ids),
+            "decks": len(self._decks),
+            "due_now": due_now,
+            "reviews": self.reviews,
+            "lapses": self.lapses,
+            "syncs": self.syncs,
+            "column_bytes": column_bytes,
+        }
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
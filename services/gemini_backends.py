@@ -0,0 +1,337 @@
+"""
+Pluggable Gemini backends
+
+GeminiClientPool builds its clients through a factory selected by
+GEMINI_BACKEND. "genai" creates live google-genai clients. "fake" creates
+an offline stand-in with the async surface the service uses
+(``client.aio.models`` with ``generate_content`` and
+``generate_content_stream``) for load tests that must not spend quota.
+
+The fake recognizes which prompt template produced a prompt and answers
+with schema-valid JSON or text sized to the request. Its latency
+distribution, output token rate, error and malformed-reply rates and a
+per-model tokens-per-minute ceiling are configurable, globally or per
+model, through FAKE_GEMINI_CONFIG (inline JSON or a path to a JSON file):
+
+    {"seed": 7, "latency": {"distribution": "lognormal", "median": 0.4, "sigma": 0.5},
+     "tokens_per_second": 250, "error_rate": 0.01, "error_codes": [503, 429],
+     "models": {"gemini-2.5-flash": {"latency": {"median": 1.2}}},
+     "responses": {"generate_flashcards": "Q | A"}}
+
+Content is derived from the prompt and seed, so identical prompts always
+get identical replies; only latency and injected failures are random.
+"""
+
+import asyncio
+import hashlib
+import json
+import math
+import random
+import re
+import threading
+import time
+from collections import deque
+from typing import Any, Callable, Deque, Dict, Optional, Tuple
+
+from prompt_templates import PROMPTS
+from rate_limiter import estimate_prompt_tokens
+
+ClientFactory = Callable[[str], Any]
+
+DEFAULT_FAKE_CONFIG: Dict[str, Any] = {
+    "seed": 0,
+    "latency": {"distribution": "lognormal", "median": 0.35, "sigma": 0.4, "min": 0.02, "max": 20.0},
+    "tokens_per_second": 300.0,
+    "error_rate": 0.0,
+    "error_codes": [503, 429, 500],
+    "malformed_rate": 0.0,
+    "tpm_limit": 0,
+    "text_words": 120,
+    "models": {},
+    "responses": {},
+}
+
+_QUESTION_ID = re.compile(r'"id":\s*(\d+)')
+_REQUESTED_COUNT = re.compile(r"\b(?:Generate|Create|Provide exactly)\s+(\d+)\b")
+_PACKED_REQUEST = re.compile(r"^### Request (\d+)$", re.MULTILINE)
+_CHUNK_ITEM = re.compile(r'"question_id":\s*(\d+).*?"max_score":\s*([\d.]+)')
+_FOCUS = re.compile(r"Focus these questions on (.+?)\.$", re.MULTILINE)
+
+
+class FakeUpstreamError(Exception):
+    """Injected upstream failure carrying an HTTP status like the SDK's APIError"""
+
+    def __init__(self, code: int, message: str):
+        super().__init__(f"{code} {message}")
+        self.code = code
+
+
+class _Usage:
+    __slots__ = ("prompt_token_count", "candidates_token_count", "total_token_count")
+
+    def __init__(self, prompt_tokens: Optional[int], output_tokens: Optional[int]):
+        self.prompt_token_count = prompt_tokens
+        self.candidates_token_count = output_tokens
+        self.total_token_count = (prompt_tokens or 0) + (output_tokens or 0)
+
+
+class _Response:
+    __slots__ = ("text", "usage_metadata")
+
+    def __init__(self, text: str, usage: Optional[_Usage] = None):
+        self.text = text
+        self.usage_metadata = usage
+
+
+def sample_latency(spec: Dict[str, Any], rng: random.Random) -> float:
+    """Seconds drawn from a fixed, uniform, normal, lognormal or exponential distribution"""
+    distribution = spec.get("distribution", "lognormal")
+    median = float(spec.get("median", 0.35))
+    if distribution == "fixed":
+        value = median
+    elif distribution == "uniform":
+        value = rng.uniform(float(spec.get("low", 0.0)), float(spec.get("high", 2 * median)))
+    elif distribution == "normal":
+        value = rng.gauss(median, float(spec.get("stddev", median / 4)))
+    elif distribution == "exponential":
+        value = rng.expovariate(math.log(2) / median) if median > 0 else 0.0
+    else:
+        value = rng.lognormvariate(math.log(max(median, 1e-6)), float(spec.get("sigma", 0.4)))
+    return min(float(spec.get("max", 60.0)), max(float(spec.get("min", 0.0)), value))
+
+
+class FakeGeminiBackend:
+    """Shared state of every fake client: configuration, RNG and token-rate windows"""
+
+    def __init__(self, config: Optional[Dict[str, Any]] = None):
+        config = config or {}
+        self.config = {**DEFAULT_FAKE_CONFIG, **config}
+        self.config["latency"] = {**DEFAULT_FAKE_CONFIG["latency"], **config.get("latency", {})}
+        self.rng = random.Random(self.config["seed"])
+        self._lock = threading.Lock()
+        self._token_windows: Dict[str, Deque[Tuple[float, int]]] = {}
+        self.calls = 0
+        self.injected_errors = 0
+        self.throttled = 0
+
+    def model_config(self, model: str) -> Dict[str, Any]:
+        override = self.config["models"].get(model, {})
+        merged = {**self.config, **override}
+        merged["latency"] = {**self.config["latency"], **override.get("latency", {})}
+        return merged
+
+    def _throttle(self, model: str, tokens: int, limit: int) -> None:
+        """Raise a 429 like the real API once ``model`` exceeds ``limit`` tokens per minute"""
+        now = time.monotonic()
+        window = self._token_windows.setdefault(model, deque())
+        while window and now - window[0][0] >= 60.0:
+            window.popleft()
+        if sum(t for _, t in window) + tokens > limit:
+            self.throttled += 1
+            raise FakeUpstreamError(429, "RESOURCE_EXHAUSTED: fake tokens-per-minute limit reached")
+        window.append((now, tokens))
+
+    def plan(self, model: str, prompt: str) -> Tuple[float, float, str, Optional[FakeUpstreamError]]:
+        """(latency before the first token, output tokens per second, reply text, error to raise)"""
+        settings = self.model_config(model)
+        prompt_tokens = estimate_prompt_tokens(prompt)
+        with self._lock:
+            self.calls += 1
+            latency = sample_latency(settings["latency"], self.rng)
+            error = None
+            if self.rng.random() < float(settings["error_rate"]):
+                self.injected_errors += 1
+                error = FakeUpstreamError(self.rng.choice(settings["error_codes"]), "fake upstream failure")
+            elif settings["tpm_limit"]:
+                try:
+                    self._throttle(model, prompt_tokens, int(settings["tpm_limit"]))
+                except FakeUpstreamError as e:
+                    error = e
+            malformed = self.rng.random() < float(settings["malformed_rate"])
+        text = "" if error else self.reply(prompt, settings)
+        if malformed and text:
+            text = text[:max(1, len(text) * 2 // 3)]
+        return latency, float(settings["tokens_per_second"]), text, error
+
+    def reply(self, prompt: str, settings: Dict[str, Any]) -> str:
+        name, params = PROMPTS.identify(prompt)
+        canned = settings["responses"].get(name or "default")
+        if canned is not None:
+            return canned if isinstance(canned, str) else json.dumps(canned, ensure_ascii=False)
+        rng = random.Random(f"{settings['seed']}:{hashlib.sha256(prompt.encode('utf-8')).hexdigest()}")
+        topic = params.get("topic", "the topic")
+        requested = params.get("num_questions") or params.get("num_cards") or _REQUESTED_COUNT.search(prompt)
+        count = _int(requested.group(1) if isinstance(requested, re.Match) else requested, 5)
+        focus_match = _FOCUS.search(prompt)
+        focus = focus_match.group(1) if focus_match else "core ideas"
+        if name == "generate_quiz":
+            return json.dumps({"quiz": [_quiz_question(topic, i, rng, focus) for i in range(1, count + 1)]})
+        if name == "generate_assignment":
+            return json.dumps({"assignment": {
+                "title": f"Assignment: {topic}",
+                "topic": topic,
+                "grade_level": params.get("grade_level", ""),
+                "subject": params.get("subject", ""),
+                "questions": [_assignment_question(topic, i, rng, focus) for i in range(1, count + 1)],
+            }})
+        if name == "micro_batch":
+            sections = _PACKED_REQUEST.split(prompt)
+            return json.dumps({"responses": [
+                {"id": int(number), "response": self.reply(body.strip(), settings)}
+                for number, body in zip(sections[1::2], sections[2::2])
+            ]})
+        if name == "grade_assignment":
+            ids = [int(i) for i in _QUESTION_ID.findall(prompt)] or [1]
+            grades = [{"question_id": i, "score": rng.randint(5, 10), "max_score": 10,
+                       "feedback": f"Feedback for question {i}"} for i in ids]
+            return json.dumps({
+                "overall_score": round(100 * sum(g["score"] for g in grades) / (10 * len(grades))),
+                "feedback": f"Solid understanding of {topic}.",
+                "question_grades": grades,
+                "strengths": ["Clear reasoning"],
+                "improvements": ["Show more working"],
+            })
+        if name == "grade_assignment_chunk":
+            return json.dumps({"question_grades": [
+                {"question_id": int(i), "score": round(float(m) * rng.uniform(0.4, 1.0), 1), "max_score": float(m),
+                 "feedback": "Mostly correct, one detail missing."}
+                for i, m in _CHUNK_ITEM.findall(prompt)
+            ]})
+        if name == "extract_prerequisites":
+            topics = json.loads(params["topics"])
+            # Each topic depends on the one listed before it
+            return json.dumps({"topics": [
+                {"name": topic, "prerequisites": topics[i - 1:i], "estimated_hours": rng.randint(1, 6)}
+                for i, topic in enumerate(topics)
+            ]})
+        if name == "generate_flashcards":
+            return "\n".join(f"{_question_text(topic, 'key idea', rng)} | Key idea {i} of {topic} explained."
+                             for i in range(1, count + 1))
+        words = int(settings["text_words"])
+        vocabulary = ("students", "learn", "concept", "example", "practice", "explain", "because", "therefore",
+                      "idea", "step", str(topic))
+        return f"[{name or 'response'}] " + " ".join(rng.choice(vocabulary) for _ in range(words))
+
+    def stats(self) -> Dict[str, Any]:
+        return {"calls": self.calls, "injected_errors": self.injected_errors, "throttled": self.throttled}
+
+
+def _int(value: Any, default: int) -> int:
+    try:
+        return max(1, int(value))
+    except (TypeError, ValueError):
+        return default
+
+
+_QUESTION_STEMS = ("Which statement best describes", "What explains", "How would you apply", "Why does",
+                   "Which example illustrates", "What is the main difference in", "What would happen to",
+                   "How can you measure")
+_QUESTION_WORDS = ("energy", "structure", "pattern", "process", "balance", "change", "evidence", "system",
+                   "cycle", "force", "model", "rate", "source", "limit", "signal", "layer", "surface", "growth",
+                   "cause", "effect", "scale", "stage", "role", "variation", "boundary", "input", "output",
+                   "feedback", "sequence", "network")
+
+
+def _question_text(topic: str, focus: str, rng: random.Random) -> str:
+    words = " and ".join(rng.sample(_QUESTION_WORDS, 2))
+    detail = " ".join(rng.sample(_QUESTION_WORDS, 2))
+    return f"{rng.choice(_QUESTION_STEMS)} the {words} of {topic} ({focus}: {detail})?"
+
+
+def _quiz_question(topic: str, index: int, rng: random.Random, focus: str = "core ideas") -> Dict[str, Any]:
+    answer = rng.choice("ABCD")
+    return {
+        "question": _question_text(topic, focus, rng),
+        "options": [f"Statement {letter} about {topic}" for letter in "ABCD"],
+        "answer": answer,
+        "explanation": f"Statement {answer} reflects the core idea of {topic}.",
+    }
+
+
+def _assignment_question(topic: str, index: int, rng: random.Random, focus: str = "core ideas") -> Dict[str, Any]:
+    question = _question_text(topic, focus, rng)
+    if index % 2:
+        answer = rng.choice("ABCD")
+        return {"id": index, "type": "multiple_choice", "question": question,
+                "options": [f"Option {letter}" for letter in "ABCD"], "correct_answer": answer,
+                "explanation": f"Option {answer} is correct."}
+    return {"id": index, "type": "short_answer", "question": question,
+            "correct_answer": f"A short explanation of part {index} of {topic}.",
+            "explanation": "Key points to include."}
+
+
+class _FakeAioModels:
+    def __init__(self, backend: FakeGeminiBackend):
+        self._backend = backend
+
+    async def generate_content(self, model: str, contents: str, config: Any = None) -> _Response:
+        latency, rate, text, error = self._backend.plan(model, contents)
+        output_tokens = estimate_prompt_tokens(text) if text else 0
+        await asyncio.sleep(latency + (output_tokens / rate if rate > 0 else 0.0))
+        if error is not None:
+            raise error
+        return _Response(text, _Usage(estimate_prompt_tokens(contents), output_tokens))
+
+    async def generate_content_stream(self, model: str, contents: str, config: Any = None):
+        latency, rate, text, error = self._backend.plan(model, contents)
+        await asyncio.sleep(latency)
+        if error is not None:
+            raise error
+        return self._chunks(text, rate, estimate_prompt_tokens(contents))
+
+    @staticmethod
+    async def _chunks(text: str, rate: float, prompt_tokens: int):
+        # Roughly 16 tokens per chunk, paced at the configured output rate
+        step = 64
+        pieces = [text[i:i + step] for i in range(0, len(text), step)] or [""]
+        for i, piece in enumerate(pieces):
+            if rate > 0:
+                await asyncio.sleep(estimate_prompt_tokens(piece) / rate)
+            last = i == len(pieces) - 1
+            yield _Response(piece, _Usage(prompt_tokens, estimate_prompt_tokens(text)) if last else None)
+
+
+class _Aio:
+    def __init__(self, backend: FakeGeminiBackend):
+        self.models = _FakeAioModels(backend)
+
+    async def aclose(self) -> None:
+        pass
+
+
+class FakeGeminiClient:
+    def __init__(self, backend: FakeGeminiBackend):
+        self.aio = _Aio(backend)
+
+    def close(self) -> None:
+        pass
+
+
+def load_fake_config(value: Optional[str]) -> Dict[str, Any]:
+    """FAKE_GEMINI_CONFIG as inline JSON or a path to a JSON file"""
+    if not value:
+        return {}
+    if value.lstrip().startswith("{"):
+        return json.loads(value)
+    with open(value, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def genai_client_factory(api_key: str):
+    from google import genai
+    return genai.Client(api_key=api_key)
+
+
+def create_client_factory(backend: str = "genai", fake_config: Optional[Dict[str, Any]] = None) -> ClientFactory:
+    """Client factory for GeminiClientPool by backend name ("genai" or "fake")"""
+    if backend == "genai":
+        return genai_client_factory
+    if backend == "fake":
+        shared = FakeGeminiBackend(fake_config)
+
+        def factory(api_key: str) -> FakeGeminiClient:
+            return FakeGeminiClient(shared)
+
+        factory.backend = shared
+        return factory
+    raise ValueError(f"Unknown GEMINI_BACKEND {backend!r}; expected 'genai' or 'fake'")
@@ -3,111 +3,709 @@ FastAPI application for E-Learning Platform AI Services
 Using NEW Google Gemini API SDK (google-genai)
 """
 
-from fastapi import FastAPI, HTTPException, Depends
+from fastapi import FastAPI, HTTPException, Depends, Request, Header
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
-from typing import List, Optional, Dict, Any
-import uvicorn
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from pydantic import BaseModel, Field, ValidationError
+from typing import List, Optional, Dict, Any, Literal
+from contextlib import asynccontextmanager, contextmanager
 import os
 import json
+import logging
+import asyncio
+import functools
+import hashlib
+import inspect
+import math
+import threading
+import time
 from datetime import datetime
 from dotenv import load_dotenv
 
+from response_cache import ResponseCache, create_response_cache, make_cache_key, parse_cache_control
+from singleflight import SingleFlight
+from streaming_json import JsonArrayItemParser, salvage_array_items
+from tutor_sessions import TutorSessionStore
+from rate_limiter import AdmissionController, QuotaExceeded, estimate_prompt_tokens
+from resilience import CircuitOpenError, ResilientCaller, RetryPolicy, is_retryable
+from server import DRAINING, claim_singleton, run as run_server
+from gemini_backends import ClientFactory, create_client_factory, genai_client_factory, load_fake_config
+from grading_jobs import GradingJobManager, GradingJobStore, question_grade_report
+from micro_batcher import DEFAULT_BATCH_TASKS, MicroBatcher
+from model_router import ModelRouter, Route
+from question_bank import QuestionBank, drop_near_duplicates
+from topic_graph import CycleError, TopicGraph
+from flashcard_store import FlashcardStore
+from performance_analytics import analyze_cohort, analyze_student
+from prompt_templates import PROMPTS
+from metrics import (
+    GEMINI_CALLS, GEMINI_OUTPUT_TOKENS, GEMINI_PROMPT_SIZE, GEMINI_PROMPT_TOKENS, GEMINI_QUEUE, GEMINI_RETRIES,
+    GEMINI_UPSTREAM, METRICS, PROMPT_TEMPLATE_INFO, RESPONSE_CACHE, MetricsMiddleware, TimedRoute, record_phase
+)
+from structured_logging import RequestIdMiddleware, configure_logging
+from structured_output import (
+    Assignment, GradeReport, PackedReplies, Quiz, QuestionGrades, StructuredOutputStats, TopicGraphExtraction,
+    parse_structured
+)
+
 # Load environment variables
 load_dotenv()
 
+configure_logging(
+    level=os.getenv("LOG_LEVEL", "INFO"),
+    payload_sample_rate=float(os.getenv("LOG_PAYLOAD_SAMPLE_RATE", "0.1")),
+    payload_max_chars=int(os.getenv("LOG_PAYLOAD_MAX_CHARS", "200")),
+    redact_secrets=os.getenv("LOG_REDACT_SECRETS", "1") != "0"
+)
+logger = logging.getLogger("gemini_service")
+
+# Upper bound on questions per quiz or assignment request
+MAX_GENERATED_QUESTIONS = int(os.getenv("MAX_GENERATED_QUESTIONS", "100"))
+
+# One per chunk of a large question set, so parallel chunks cover different ground
+QUESTION_SET_FOCUS = (
+    "definitions and key terminology",
+    "real-world applications",
+    "reasoning about causes and effects",
+    "problem solving and calculations",
+    "common misconceptions",
+    "comparisons and classification",
+    "historical context and discoveries",
+    "interpreting data, diagrams and examples",
+    "experiments and evidence",
+    "connecting ideas across the topic",
+)
+
 # ==============================================================================
 # GEMINI SERVICE WITH NEW API SDK
 # ==============================================================================
 
-class GeminiService:
-    def __init__(self, api_key: str):
-        print(f"🔧 Initializing GeminiService with API key: {api_key[:10]}...")
+def is_fallback_result(result: Any) -> bool:
+    """True for canned or incomplete responses produced when the upstream call failed"""
+    return isinstance(result, dict) and (
+        bool(result.get("fallback")) or bool(result.get("partial")) or "error" in result
+    )
+
+def cached_generator(func):
+    """Serve a deterministic generator from the response cache.
+
+    The wrapped method accepts an extra ``cache_control`` keyword carrying the
+    client's Cache-Control header. On a miss, identical concurrent requests
+    are coalesced into one generation. Fallback responses are never stored.
+    """
+    signature = inspect.signature(func)
+    method = func.__name__
+
+    @functools.wraps(func)
+    async def wrapper(self, *args, cache_control: Optional[str] = None, **kwargs):
+        cache = self.response_cache
+        read, write = parse_cache_control(cache_control)
+        bound = signature.bind(self, *args, **kwargs)
+        bound.apply_defaults()
+        params = {k: v for k, v in bound.arguments.items() if k != "self"}
+        key = make_cache_key(method, PROMPTS.version(method), params)
+
+        if cache is not None:
+            if read:
+                cached = cache.get(key)
+                if cached is not None:
+                    logger.debug("Response cache hit", extra={"method": method})
+                    RESPONSE_CACHE.inc(method=method, status="hit")
+                    return cached
+                RESPONSE_CACHE.inc(method=method, status="miss")
+            else:
+                cache.record_bypass()
+                RESPONSE_CACHE.inc(method=method, status="bypass")
+
+        async def produce():
+            result = await func(self, *args, **kwargs)
+            if cache is not None and write and not is_fallback_result(result):
+                cache.set(key, result)
+            return result
+
+        if self.single_flight is None:
+            return await produce()
+        return await self.single_flight.do(key, produce, scope=method)
+
+    return wrapper
+
+class GeminiClientPool:
+    """Process-wide pool of genai clients shared across requests.
+
+    Each genai.Client owns its own HTTP session, so reusing clients keeps
+    connections alive and avoids a TLS handshake per request. Clients are
+    leased without blocking: an idle client is preferred, a new one is
+    created while below ``max_size``, otherwise the least busy client is
+    shared (the underlying HTTP session is safe for concurrent use).
+    """
+
+    def __init__(self, api_key: str, max_size: int = 4, client_factory: Optional[ClientFactory] = None):
         self.api_key = api_key
-        
+        self.max_size = max(1, max_size)
+        self.client_factory = client_factory or genai_client_factory
+        self._clients: List[Any] = []
+        self._leases: Dict[int, int] = {}
+        self._lock = threading.Lock()
+        self._closed = False
+        self.created = 0
+        self.reused = 0
+
+    def _create_client(self):
+        client = self.client_factory(self.api_key)
+        self._clients.append(client)
+        self._leases[id(client)] = 0
+        self.created += 1
+        logger.info("Gemini client created", extra={"client": self.created, "pool_size": len(self._clients), "max_size": self.max_size})
+        return client
+
+    def warmup(self, min_size: int = 1):
+        """Create up to ``min_size`` clients before serving traffic"""
+        with self._lock:
+            while len(self._clients) < min(min_size, self.max_size):
+                self._create_client()
+
+    def _acquire(self):
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("Gemini client pool is closed")
+            idle = [c for c in self._clients if self._leases[id(c)] == 0]
+            if idle:
+                client = idle[0]
+                self.reused += 1
+            elif len(self._clients) < self.max_size:
+                client = self._create_client()
+            else:
+                client = min(self._clients, key=lambda c: self._leases[id(c)])
+                self.reused += 1
+            self._leases[id(client)] += 1
+            return client
+
+    def _release(self, client):
+        with self._lock:
+            if id(client) in self._leases:
+                self._leases[id(client)] -= 1
+
+    @contextmanager
+    def client(self):
+        """Lease a client for the duration of one upstream call"""
+        client = self._acquire()
         try:
-            # ✅ Use the NEW Google GenAI SDK
-            from google import genai
-            self.client = genai.Client(api_key=api_key)
-            print("✅ Gemini Client configured successfully with NEW SDK")
-            
-        except ImportError:
-            print("❌ google-genai package not installed. Please run: pip install google-genai")
-            raise
-        except Exception as e:
-            print(f"❌ Gemini configuration failed: {e}")
-            raise
+            yield client
+        finally:
+            self._release(client)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            busy = sum(1 for c in self._clients if self._leases[id(c)] > 0)
+            return {
+                "max_size": self.max_size,
+                "size": len(self._clients),
+                "in_use": busy,
+                "idle": len(self._clients) - busy,
+                "active_leases": sum(self._leases.values()),
+                "created": self.created,
+                "reused": self.reused,
+                **({"fake_backend": self.client_factory.backend.stats()}
+                   if hasattr(self.client_factory, "backend") else {}),
+            }
+
+    async def close(self):
+        """Close every pooled client and its async HTTP connections"""
+        with self._lock:
+            self._closed = True
+            clients, self._clients = self._clients, []
+            self._leases = {}
+        for client in clients:
+            # Every call goes through client.aio; older google-genai releases have neither method
+            aclose = getattr(getattr(client, "aio", None), "aclose", None)
+            close = getattr(client, "close", None)
+            try:
+                if callable(aclose):
+                    await aclose()
+                elif callable(close):
+                    close()
+            except Exception as e:
+                logger.warning("Failed to close Gemini client: %s", e)
+        logger.info("Gemini client pool closed", extra={"clients": len(clients)})
+
+
+class GeminiService:
+    def __init__(self, pool: GeminiClientPool, max_concurrency_per_model: int = 32, batch_max_parallel: int = 8,
+                 response_cache: Optional[ResponseCache] = None, single_flight: Optional[SingleFlight] = None,
+                 tutor_sessions: Optional[TutorSessionStore] = None, admission: Optional[AdmissionController] = None,
+                 resilience: Optional[ResilientCaller] = None, upstream_timeout: float = 30.0,
+                 default_grading_mode: str = "holistic", grading_chunk_size: int = 1, generation_chunk_size: int = 10,
+                 router: Optional[ModelRouter] = None, structured_output: bool = True,
+                 question_bank: Optional[QuestionBank] = None, micro_batch: Optional[Dict[str, Any]] = None,
+                 topic_graph: Optional[TopicGraph] = None, flashcard_store: Optional[FlashcardStore] = None,
+                 flashcard_max_deck: int = 200, flashcard_refill_size: int = 10):
+        self.pool = pool
+        self.question_bank = question_bank
+        self.topic_graph = topic_graph
+        self.flashcard_store = flashcard_store
+        self.flashcard_max_deck = flashcard_max_deck
+        self.flashcard_refill_size = flashcard_refill_size
+        self.router = router or ModelRouter()
+        self.structured_output = structured_output
+        self.structured_stats = StructuredOutputStats()
+        self.default_grading_mode = default_grading_mode
+        self.grading_chunk_size = max(1, grading_chunk_size)
+        self.generation_chunk_size = max(1, generation_chunk_size)
+        self.admission = admission
+        self.resilience = resilience
+        self.upstream_timeout = upstream_timeout
+        self.response_cache = response_cache
+        self.single_flight = single_flight
+        self.tutor_sessions = tutor_sessions
+        if tutor_sessions is not None and tutor_sessions.summarizer is None and os.getenv("TUTOR_SUMMARIZE_WITH_MODEL", "1") != "0":
+            tutor_sessions.summarizer = self._summarize_turns
+        self.max_concurrency_per_model = max(1, max_concurrency_per_model)
+        self.batch_max_parallel = max(1, batch_max_parallel)
+        self._model_semaphores: Dict[str, asyncio.Semaphore] = {}
+        self._in_flight: Dict[str, int] = {}
+        # Opt-in: keyword arguments for MicroBatcher, or None to send every prompt on its own
+        self.micro_batcher = MicroBatcher(
+            call_packed=self._call_packed, call_single=self._call_batch_item, **micro_batch
+        ) if micro_batch is not None else None
+
+    def _model_semaphore(self, model: str) -> asyncio.Semaphore:
+        semaphore = self._model_semaphores.get(model)
+        if semaphore is None:
+            semaphore = asyncio.Semaphore(self.max_concurrency_per_model)
+            self._model_semaphores[model] = semaphore
+        return semaphore
+
+    def concurrency_stats(self) -> Dict[str, Any]:
+        return {
+            model: {
+                "limit": self.max_concurrency_per_model,
+                "in_flight": self._in_flight.get(model, 0),
+            }
+            for model in self._model_semaphores
+        }
+
+    def in_flight(self) -> int:
+        return sum(self._in_flight.values())
+
+    async def drain(self, timeout: float) -> bool:
+        """Wait up to ``timeout`` seconds for in-flight upstream calls; True when none remain"""
+        deadline = time.monotonic() + timeout
+        while self.in_flight() and time.monotonic() < deadline:
+            await asyncio.sleep(0.05)
+        return self.in_flight() == 0
+
+    async def warmup(self, timeout: float = 10.0) -> Dict[str, str]:
+        """Send a one-token prompt to each tier model so connections are open before traffic arrives"""
+        async def probe(model: str) -> str:
+            try:
+                with self.pool.client() as client:
+                    await asyncio.wait_for(
+                        client.aio.models.generate_content(model=model, contents="Reply with OK."),
+                        timeout=timeout
+                    )
+                return "ok"
+            except Exception as e:
+                logger.warning("Warmup probe failed: %s", e, extra={"model": model})
+                return f"failed: {e}"
+
+        models = sorted(set(self.router.tiers.values()))
+        return dict(zip(models, await asyncio.gather(*(probe(model) for model in models))))
+
+    async def _call_gemini_async(self, prompt: str, model: Optional[str] = None, priority: str = "normal",
+                                 task: str = "default", response_schema: Optional[type] = None) -> str:
+        """Non-blocking Gemini call; identical concurrent prompts share one upstream request.
+
+        Without an explicit ``model`` the router picks one for ``task``.
+        ``response_schema`` (a pydantic model) asks the SDK for JSON of that shape.
+
+        Raises QuotaExceeded when the admission controller rejects the call;
+        every other upstream failure returns the fallback message.
+        """
+        route = self.router.fixed(task, model) if model else self.router.route(task, prompt)
+        if self.micro_batcher is not None and response_schema is None and self.micro_batcher.accepts(task, prompt):
+            return await self.micro_batcher.submit((route, priority), prompt)
+        return await self._call_route(prompt, route, priority, response_schema)
 
-    def _call_gemini(self, prompt: str, model: str = "gemini-2.0-flash") -> str:
-        """Helper method to call Gemini API with error handling"""
+    async def _call_batch_item(self, key, prompt: str) -> str:
+        route, priority = key
+        return await self._call_route(prompt, route, priority)
+
+    async def _call_packed(self, key, prompts: List[str]) -> Optional[List[Optional[str]]]:
+        """One upstream call answering several small prompts; None entries could not be demultiplexed"""
+        route, priority = key
+        packed_prompt = PROMPTS.render(
+            "micro_batch", count=len(prompts),
+            requests="\n".join(f"### Request {i}\n{prompt}" for i, prompt in enumerate(prompts, start=1))
+        )
+        response_text = await self._call_route(packed_prompt, route, priority, response_schema=PackedReplies)
+        if "AI service temporarily unavailable" in response_text:
+            # The upstream call failed; answer each caller as a failed single call would
+            return [response_text] * len(prompts)
+        data, repaired, error = parse_structured(response_text, PackedReplies)
+        if data is None:
+            self.structured_stats.record("micro_batch", "failed")
+            logger.warning("Could not demultiplex packed reply: %s", error, extra={"items": len(prompts)})
+            return None
+        self.structured_stats.record("micro_batch", "repaired" if repaired else "valid")
+        replies = {item["id"]: item["response"].strip() for item in data["responses"]}
+        return [replies.get(i) or None for i in range(1, len(prompts) + 1)]
+
+    async def _call_route(self, prompt: str, route: Route, priority: str,
+                          response_schema: Optional[type] = None) -> str:
+        config = None
+        if response_schema is not None and self.structured_output:
+            config = {"response_mime_type": "application/json", "response_schema": response_schema}
+        if self.single_flight is None:
+            return await self._call_gemini_upstream(prompt, route, priority, config)
+        schema_name = response_schema.__name__ if response_schema is not None else ""
+        key = hashlib.sha256(f"{route.model}\0{schema_name}\0{' '.join(prompt.split())}".encode("utf-8")).hexdigest()
+        return await self.single_flight.do(
+            key, lambda: self._call_gemini_upstream(prompt, route, priority, config), scope="gemini_call"
+        )
+
+    async def _generate_structured(self, prompt: str, schema: type, task: str, priority: str = "normal"):
+        """Schema-constrained call, validated once.
+
+        An invalid reply is repaired locally if possible, otherwise re-asked
+        once with the validation error, on the next stronger tier when there
+        is one. Returns (data, response_text); ``data`` is None when no valid
+        document was obtained, and ``response_text`` is kept for salvage.
+        """
+        route = self.router.route(task, prompt)
+        response_text = await self._call_route(prompt, route, priority, schema)
+        if "AI service temporarily unavailable" in response_text:
+            self.structured_stats.record(task, "unavailable")
+            return None, response_text
+
+        data, repaired, error = parse_structured(response_text, schema)
+        if data is not None:
+            self.structured_stats.record(task, "repaired" if repaired else "valid")
+            return data, response_text
+
+        retry_route = self.router.escalate(route) or route
+        logger.warning("Invalid %s from %s, re-asking %s: %s", schema.__name__, route.model, retry_route.model, error)
+        retry_prompt = (
+            f"{prompt}\n\nYour previous reply did not match the required JSON schema: {error}\n"
+            "Reply again with only the corrected JSON document."
+        )
+        retry_text = await self._call_route(retry_prompt, retry_route, priority, schema)
+        if "AI service temporarily unavailable" not in retry_text:
+            data, _, _ = parse_structured(retry_text, schema)
+            if data is not None:
+                self.structured_stats.record(task, "reasked")
+                return data, retry_text
+            response_text = retry_text
+        self.structured_stats.record(task, "failed")
+        return None, response_text
+
+    async def _admit(self, prompt: str, model: str, priority: str) -> int:
+        """Take RPM/TPM capacity for one call; returns the token estimate charged"""
+        if self.admission is None:
+            return 0
+        estimated = self.admission.estimate_tokens(prompt)
+        await self.admission.acquire(model, estimated, priority)
+        return estimated
+
+    def _settle(self, model: str, estimated: int, response) -> None:
+        usage = getattr(response, "usage_metadata", None)
+        if self.admission is not None and usage is not None:
+            self.admission.settle(model, estimated, getattr(usage, "total_token_count", None))
+
+    def _record_route(self, route: Route, started: float, prompt: str, response=None, text: str = "",
+                      ok: bool = True) -> None:
+        """Record latency and token usage, estimating tokens when the SDK reports none"""
+        usage = getattr(response, "usage_metadata", None)
+        input_tokens = getattr(usage, "prompt_token_count", None) or estimate_prompt_tokens(prompt)
+        output_tokens = getattr(usage, "candidates_token_count", None)
+        if output_tokens is None:
+            output_tokens = estimate_prompt_tokens(text) if text else 0
+        self.router.record(route, started, input_tokens, output_tokens, ok=ok)
+        GEMINI_CALLS.inc(task=route.task, model=route.model, outcome="success" if ok else "error")
+        GEMINI_PROMPT_TOKENS.inc(input_tokens, task=route.task, model=route.model)
+        GEMINI_OUTPUT_TOKENS.inc(output_tokens, task=route.task, model=route.model)
+        GEMINI_PROMPT_SIZE.observe(input_tokens, task=route.task)
+
+    @staticmethod
+    def _record_queue_wait(model: str, queued: float) -> None:
+        waited = time.perf_counter() - queued
+        GEMINI_QUEUE.observe(waited, model=model)
+        record_phase("queue", waited)
+
+    @staticmethod
+    def _record_upstream(model: str, started: float) -> None:
+        elapsed = time.perf_counter() - started
+        GEMINI_UPSTREAM.observe(elapsed, model=model)
+        record_phase("upstream", elapsed)
+
+    @staticmethod
+    def _on_retry(model: str, attempt: int, error: BaseException) -> None:
+        GEMINI_RETRIES.inc(model=model)
+        logger.warning("Retrying Gemini call after attempt %d: %s", attempt, error, extra={"model": model})
+
+    async def _generate_once(self, prompt: str, model: str, priority: str, config: Optional[Dict[str, Any]] = None):
+        """One upstream attempt, limited to max_concurrency_per_model in flight per model"""
+        queued = time.perf_counter()
+        estimated = await self._admit(prompt, model, priority)
+        async with self._model_semaphore(model):
+            self._record_queue_wait(model, queued)
+            logger.debug("Sending prompt to Gemini", extra={"model": model})
+            self._in_flight[model] = self._in_flight.get(model, 0) + 1
+            started = time.perf_counter()
+            try:
+                with self.pool.client() as client:
+                    response = await asyncio.wait_for(
+                        client.aio.models.generate_content(
+                            model=model,
+                            contents=prompt,
+                            config=config
+                        ),
+                        timeout=self.upstream_timeout
+                    )
+            finally:
+                self._in_flight[model] -= 1
+                self._record_upstream(model, started)
+        logger.debug("Received response from Gemini", extra={"model": model})
+        self._settle(model, estimated, response)
+        return response
+
+    async def _call_gemini_upstream(self, prompt: str, route: Route, priority: str = "normal",
+                                    config: Optional[Dict[str, Any]] = None) -> str:
+        """Call Gemini with retries for transient errors behind the model's circuit breaker"""
+        model = route.model
+        started = time.perf_counter()
         try:
-            print(f"📤 Sending prompt to Gemini ({model})...")
-            response = self.client.models.generate_content(
-                model=model,
-                contents=prompt
-            )
-            print(f"📥 Received response from Gemini")
+            if self.resilience is None:
+                response = await self._generate_once(prompt, model, priority, config)
+            else:
+                response = await self.resilience.call(
+                    model,
+                    lambda: self._generate_once(prompt, model, priority, config),
+                    on_retry=functools.partial(self._on_retry, model),
+                    passthrough=(QuotaExceeded,)
+                )
+            self._record_route(route, started, prompt, response, response.text or "")
             return response.text
+        except QuotaExceeded:
+            GEMINI_CALLS.inc(task=route.task, model=model, outcome="rejected")
+            raise
+        except CircuitOpenError as e:
+            logger.warning("%s", e, extra={"model": model})
+            GEMINI_CALLS.inc(task=route.task, model=model, outcome="circuit_open")
+            return f"AI service temporarily unavailable. Please try again later. Error: {str(e)}"
         except Exception as e:
-            print(f"❌ Gemini API call failed: {e}")
+            logger.error("Gemini API call failed: %s", e, extra={"model": model})
+            self._record_route(route, started, prompt, ok=False)
             # Return a fallback response instead of raising
             return f"AI service temporarily unavailable. Please try again later. Error: {str(e)}"
 
-    def generate_quiz(self, topic, num_questions, question_type, difficulty, grade_level, language):
-        """Generate quiz questions using real Gemini API"""
-        print(f"🎯 Generating quiz for: {topic}")
-        
-        prompt = f"""
-        Create a quiz with {num_questions} {difficulty} level multiple choice questions about {topic} 
-        for {grade_level} students in {language}.
-        
-        Return the response as a valid JSON object in this exact format:
-        {{
-            "quiz": [
-                {{
-                    "question": "Question text here?",
-                    "options": ["Option A", "Option B", "Option C", "Option D"],
-                    "answer": "A",
-                    "explanation": "Brief explanation of why this is correct"
-                }}
-            ]
-        }}
-        
-        Make sure the questions are educational, clear, and appropriate for the grade level.
-        Provide exactly {num_questions} questions.
+    async def _stream_gemini_async(self, prompt: str, model: Optional[str] = None, priority: str = "normal",
+                                   task: str = "default"):
+        """Yield response text chunks from generate_content_stream.
+
+        Errors propagate to the caller, which decides how to report them.
+        Closing the generator (e.g. on client disconnect) closes the
+        upstream stream and frees the model slot.
         """
-        
+        route = self.router.fixed(task, model) if model else self.router.route(task, prompt)
+        model = route.model
+        # Streams are not retried once tokens may have been sent, but they
+        # still respect and feed the model's circuit breaker
+        breaker = self.resilience.breaker(model) if self.resilience else None
+        if breaker is not None:
+            breaker.before_call(model)
+        queued = time.perf_counter()
         try:
-            response_text = self._call_gemini(prompt, "gemini-2.0-flash")
-            print(f"📝 Raw response: {response_text[:200]}...")
-            
-            # Check if we got an error message instead of real response
-            if "AI service temporarily unavailable" in response_text:
-                return self._get_fallback_quiz(topic, num_questions)
-            
-            # Clean the response
-            response_text = response_text.strip()
-            if '```json' in response_text:
-                response_text = response_text.split('```json')[1].split('```')[0].strip()
-            elif '```' in response_text:
-                response_text = response_text.split('```')[1].strip() if len(response_text.split('```')) > 2 else response_text
-            
-            # Parse JSON
-            result = json.loads(response_text)
-            print(f"✅ Successfully generated {len(result.get('quiz', []))} questions")
-            return result
-            
-        except json.JSONDecodeError as e:
-            print(f"❌ JSON parse error: {e}")
-            return self._get_fallback_quiz(topic, num_questions)
+            await self._admit(prompt, model, priority)
+        except QuotaExceeded:
+            if breaker is not None:
+                breaker.release_probe()
+            GEMINI_CALLS.inc(task=task, model=model, outcome="rejected")
+            raise
+        async with self._model_semaphore(model):
+            self._record_queue_wait(model, queued)
+            logger.debug("Streaming prompt to Gemini", extra={"model": model})
+            self._in_flight[model] = self._in_flight.get(model, 0) + 1
+            started = time.perf_counter()
+            received = []
+            last_chunk = None
+            try:
+                with self.pool.client() as client:
+                    stream = await asyncio.wait_for(
+                        client.aio.models.generate_content_stream(
+                            model=model,
+                            contents=prompt
+                        ),
+                        timeout=self.upstream_timeout
+                    )
+                    try:
+                        async for chunk in stream:
+                            last_chunk = chunk
+                            if chunk.text:
+                                received.append(chunk.text)
+                                yield chunk.text
+                    finally:
+                        aclose = getattr(stream, "aclose", None)
+                        if aclose is not None:
+                            await aclose()
+                if breaker is not None:
+                    breaker.record_success()
+                # The final chunk carries usage metadata for the whole stream
+                self._record_route(route, started, prompt, last_chunk, "".join(received))
+            except Exception as e:
+                self._record_route(route, started, prompt, last_chunk, "".join(received), ok=False)
+                if breaker is not None:
+                    if is_retryable(e):
+                        breaker.record_failure()
+                    else:
+                        breaker.release_probe()
+                raise
+            except BaseException:
+                # Cancelled or closed by a disconnecting client
+                if breaker is not None:
+                    breaker.release_probe()
+                raise
+            finally:
+                self._in_flight[model] -= 1
+                self._record_upstream(model, started)
+        logger.debug("Gemini stream finished", extra={"model": model})
+
+    def _quiz_prompt(self, topic, num_questions, difficulty, grade_level, language, avoid=None, focus=None):
+        return PROMPTS.render(
+            "generate_quiz", topic=topic, num_questions=num_questions, difficulty=difficulty,
+            grade_level=grade_level, language=language, constraints=self._question_constraints(avoid, focus)
+        )
+
+    @staticmethod
+    def _question_constraints(avoid=None, focus=None):
+        lines = []
+        if focus:
+            lines.append(f"Focus these questions on {focus}.")
+        if avoid:
+            listed = "\n".join(f"- {question[:120]}" for question in avoid[:20])
+            lines.append(f"Do not repeat or closely paraphrase these existing questions:\n{listed}")
+        return "\n".join(lines)
+
+    def _chunk_plan(self, count):
+        """Balanced (size, focus) chunks of at most generation_chunk_size questions"""
+        chunks = max(1, math.ceil(count / self.generation_chunk_size))
+        if chunks == 1:
+            return [(count, None)]
+        return [
+            (count // chunks + (1 if i < count % chunks else 0), QUESTION_SET_FOCUS[i % len(QUESTION_SET_FOCUS)])
+            for i in range(chunks)
+        ]
+
+    @staticmethod
+    def _drop_duplicate_pairs(pairs, existing):
+        kept = {id(q) for q in drop_near_duplicates([q for q, _ in pairs], existing)}
+        return [(q, validated) for q, validated in pairs if id(q) in kept]
+
+    async def _generate_question_set(self, count, generate_chunk, existing=()):
+        """Generate ``count`` questions as parallel chunks and merge them without near-duplicates.
+
+        ``generate_chunk(size, focus, avoid)`` returns (questions, validated).
+        Returns [(question, validated)]. When chunking or de-duplication left
+        the set short, one more chunk is asked for the missing questions.
+        """
+        existing = list(existing)
+        plan = self._chunk_plan(count)
+        outcomes = await asyncio.gather(
+            *(generate_chunk(size, focus, existing) for size, focus in plan), return_exceptions=True
+        )
+        collected = []
+        quota_error = None
+        for outcome in outcomes:
+            if isinstance(outcome, QuotaExceeded):
+                quota_error = outcome
+            elif isinstance(outcome, Exception):
+                logger.error("Question chunk failed: %s", outcome)
+            else:
+                questions, validated = outcome
+                collected.extend((question, validated) for question in questions)
+        if not collected and quota_error is not None:
+            raise quota_error
+
+        kept = self._drop_duplicate_pairs(collected, existing)
+        duplicates = len(collected) - len(kept)
+        missing = count - len(kept)
+        if kept and missing > 0 and (len(plan) > 1 or duplicates):
+            avoid = existing + [q.get("question", "") for q, _ in kept]
+            try:
+                questions, validated = await generate_chunk(missing, None, avoid)
+                kept += self._drop_duplicate_pairs([(q, validated) for q in questions], avoid)
+            except Exception as e:
+                logger.warning("Top-up chunk failed: %s", e, extra={"missing": missing})
+        if len(plan) > 1:
+            logger.info("Merged question chunks", extra={
+                "chunks": len(plan), "duplicates": duplicates, "questions": min(len(kept), count)
+            })
+        return kept[:count]
+
+    async def _quiz_chunk(self, topic, size, difficulty, grade_level, language, avoid, focus):
+        prompt = self._quiz_prompt(topic, size, difficulty, grade_level, language, avoid=avoid, focus=focus)
+        result, response_text = await self._generate_structured(prompt, Quiz, task="generate_quiz")
+        logger.debug("Raw quiz response", extra={"payload": response_text})
+        if result is not None:
+            return result["quiz"][:size], True
+        if "AI service temporarily unavailable" in response_text:
+            return [], False
+        # Keep every complete question from a truncated or malformed reply
+        questions = salvage_array_items(response_text, "quiz")[:size]
+        if questions:
+            logger.warning("Salvaged quiz questions from malformed response", extra={"questions": len(questions)})
+        return questions, False
+
+    @cached_generator
+    async def generate_quiz(self, topic, num_questions, question_type, difficulty, grade_level, language):
+        """Generate quiz questions, serving what the question bank has and asking Gemini for the rest"""
+        logger.info("Generating quiz", extra={"topic": topic, "questions": num_questions})
+
+        banked = []
+        if self.question_bank is not None:
+            banked = self.question_bank.sample(topic, grade_level, difficulty, language, num_questions)
+            if len(banked) >= num_questions:
+                logger.info("Served quiz from the question bank", extra={"banked": len(banked)})
+                return {"quiz": banked, "source": "question_bank"}
+        missing = num_questions - len(banked)
+        if banked:
+            logger.info("Question bank partially covered quiz", extra={"banked": len(banked), "missing": missing})
+
+        try:
+            pairs = await self._generate_question_set(
+                missing,
+                lambda size, focus, avoid: self._quiz_chunk(topic, size, difficulty, grade_level, language, avoid, focus),
+                existing=[q.get("question", "") for q in banked]
+            )
+        except QuotaExceeded:
+            raise
         except Exception as e:
-            print(f"❌ Quiz generation error: {e}")
+            logger.error("Quiz generation error: %s", e)
             return self._get_fallback_quiz(topic, num_questions)
 
+        generated = [question for question, _ in pairs]
+        validated = [question for question, ok in pairs if ok]
+        if validated and self.question_bank is not None:
+            await asyncio.to_thread(self.question_bank.add, topic, grade_level, difficulty, language, validated)
+        if generated or banked:
+            logger.info("Generated quiz questions", extra={"questions": len(generated)})
+            return self._combine_quiz(banked, generated, num_questions)
+        return self._get_fallback_quiz(topic, num_questions)
+
+    @staticmethod
+    def _combine_quiz(banked, generated, num_questions):
+        result = {"quiz": banked + generated}
+        if banked:
+            result["source"] = "question_bank+gemini" if generated else "question_bank"
+        # A repaired, salvaged or gap-filled reply can hold fewer questions than asked for
+        if len(result["quiz"]) < num_questions:
+            result["partial"] = True
+        return result
+
     def _get_fallback_quiz(self, topic, num_questions):
         """Provide fallback quiz data when API fails"""
-        print("🔄 Using fallback quiz data")
+        logger.warning("Using fallback quiz data")
         return {
+            "fallback": True,
             "quiz": [
                 {
                     "question": f"What is the main concept of {topic}?",
@@ -130,80 +728,63 @@ class GeminiService:
             ][:num_questions]  # Return only requested number of questions
         }
 
-    def generate_assignment(self, topic, grade_level, subject, num_questions, language):
+    def _assignment_prompt(self, topic, grade_level, subject, num_questions, avoid=None, focus=None):
+        return PROMPTS.render(
+            "generate_assignment", topic=topic, grade_level=grade_level, subject=subject, num_questions=num_questions,
+            constraints=self._question_constraints(avoid, focus)
+        )
+
+    async def _assignment_chunk(self, topic, grade_level, subject, size, avoid, focus):
+        prompt = self._assignment_prompt(topic, grade_level, subject, size, avoid=avoid, focus=focus)
+        result, response_text = await self._generate_structured(prompt, Assignment, task="generate_assignment")
+        logger.debug("Raw assignment response", extra={"payload": response_text})
+        if result is not None:
+            return result["assignment"]["questions"][:size], True
+        if "AI service temporarily unavailable" in response_text:
+            return [], False
+        questions = salvage_array_items(response_text, "questions")[:size]
+        if questions:
+            logger.warning("Salvaged assignment questions from malformed response", extra={"questions": len(questions)})
+        return questions, False
+
+    async def generate_assignment(self, topic, grade_level, subject, num_questions, language):
         """Generate AI-powered assignment with questions and answers"""
-        print(f"📝 Generating assignment for: {topic}")
-        
-        prompt = f"""
-        Create a comprehensive assignment about {topic} for {grade_level} students studying {subject}.
-        
-        Generate {num_questions} diverse questions including:
-        - Multiple choice questions
-        - Short answer questions  
-        - Problem-solving questions
-        - Critical thinking questions
-        
-        Return the response as a valid JSON object in this exact format:
-        {{
-            "assignment": {{
-                "title": "Assignment: {topic}",
-                "topic": "{topic}",
-                "grade_level": "{grade_level}",
-                "subject": "{subject}",
-                "questions": [
-                    {{
-                        "id": 1,
-                        "type": "multiple_choice",
-                        "question": "Question text here?",
-                        "options": ["Option A", "Option B", "Option C", "Option D"],
-                        "correct_answer": "A",
-                        "explanation": "Why this is correct"
-                    }},
-                    {{
-                        "id": 2,
-                        "type": "short_answer", 
-                        "question": "Question text here?",
-                        "correct_answer": "Expected answer here",
-                        "explanation": "Key points to include"
-                    }}
-                ]
-            }}
-        }}
-        
-        Make the assignment educational, engaging, and appropriate for the grade level.
-        """
-        
+        logger.info("Generating assignment", extra={"topic": topic, "questions": num_questions})
+
         try:
-            response_text = self._call_gemini(prompt, "gemini-2.0-flash")
-            print(f"📝 Raw assignment response: {response_text[:200]}...")
-            
-            # Check if we got an error message
-            if "AI service temporarily unavailable" in response_text:
-                return self._get_fallback_assignment(topic, grade_level, subject, num_questions)
-            
-            # Clean the response
-            response_text = response_text.strip()
-            if '```json' in response_text:
-                response_text = response_text.split('```json')[1].split('```')[0].strip()
-            elif '```' in response_text:
-                response_text = response_text.split('```')[1].strip() if len(response_text.split('```')) > 2 else response_text
-            
-            # Parse JSON
-            result = json.loads(response_text)
-            print(f"✅ Successfully generated assignment with {len(result.get('assignment', {}).get('questions', []))} questions")
-            return result
-            
-        except json.JSONDecodeError as e:
-            print(f"❌ JSON parse error: {e}")
-            return self._get_fallback_assignment(topic, grade_level, subject, num_questions)
+            pairs = await self._generate_question_set(
+                num_questions,
+                lambda size, focus, avoid: self._assignment_chunk(topic, grade_level, subject, size, avoid, focus)
+            )
+        except QuotaExceeded:
+            raise
         except Exception as e:
-            print(f"❌ Assignment generation error: {e}")
+            logger.error("Assignment generation error: %s", e)
             return self._get_fallback_assignment(topic, grade_level, subject, num_questions)
 
+        if not pairs:
+            return self._get_fallback_assignment(topic, grade_level, subject, num_questions)
+        # Chunks number their questions independently
+        questions = [{**question, "id": i} for i, (question, _) in enumerate(pairs, start=1)]
+        logger.info("Generated assignment", extra={"questions": len(questions)})
+        result = {
+            "assignment": {
+                "title": f"Assignment: {topic}",
+                "topic": topic,
+                "grade_level": grade_level,
+                "subject": subject,
+                "questions": questions
+            }
+        }
+        if len(questions) < num_questions:
+            result["partial"] = True
+        return result
+
     def _get_fallback_assignment(self, topic, grade_level, subject, num_questions):
         """Provide fallback assignment data when API fails"""
-        print("🔄 Using fallback assignment data")
+        logger.warning("Using fallback assignment data")
         return {
+            "fallback": True,
             "assignment": {
                 "title": f"Assignment: {topic}",
                 "topic": topic,
@@ -251,44 +832,26 @@ class GeminiService:
             }
         }
 
-    def grade_assignment(self, assignment_data, student_answers, language):
+    async def grade_assignment(self, assignment_data, student_answers, language, grading_mode=None):
         """Grade student assignment submissions"""
-        print(f"📊 Grading assignment: {assignment_data.get('topic', 'Unknown')}")
-        
-        grading_prompt = f"""
-        Grade these student answers for an assignment on {assignment_data.get('topic', 'unknown topic')}.
-        
-        Assignment Questions:
-        {json.dumps(assignment_data.get('questions', []), indent=2)}
-        
-        Student Answers:
-        {json.dumps(student_answers, indent=2)}
-        
-        Provide a grading report with:
-        1. Overall score (out of 100)
-        2. Question-by-question feedback
-        3. Areas for improvement
-        4. Strengths demonstrated
+        logger.info("Grading assignment", extra={"topic": assignment_data.get("topic", "Unknown")})
+
+        if (grading_mode or self.default_grading_mode) == "per_question":
+            return await self._grade_assignment_per_question(assignment_data, student_answers, language)
         
-        Return as valid JSON in this format:
-        {{
-            "overall_score": 85,
-            "feedback": "Overall feedback here",
-            "question_grades": [
-                {{
-                    "question_id": 1,
-                    "score": 10,
-                    "max_score": 10,
-                    "feedback": "Specific feedback for question 1"
-                }}
-            ],
-            "strengths": ["List of strengths"],
-            "improvements": ["List of areas to improve"]
-        }}
-        """
+        grading_prompt = PROMPTS.render(
+            "grade_assignment",
+            topic=assignment_data.get('topic', 'unknown topic'),
+            questions_json=json.dumps(assignment_data.get('questions', []), ensure_ascii=False, separators=(',', ':')),
+            answers_json=json.dumps(student_answers, ensure_ascii=False, separators=(',', ':'))
+        )
         
         try:
-            response_text = self._call_gemini(grading_prompt, "gemini-2.0-flash")
+            result, response_text = await self._generate_structured(
+                grading_prompt, GradeReport, task="grade_assignment", priority="high"
+            )
+            if result is not None:
+                return result
             
             if "AI service temporarily unavailable" in response_text:
                 return {
@@ -296,59 +859,209 @@ class GeminiService:
                     "feedback": "Good effort! Your answers show understanding of the main concepts.",
                     "question_grades": [],
                     "strengths": ["Demonstrates basic understanding"],
-                    "improvements": ["Provide more detailed explanations"]
+                    "improvements": ["Provide more detailed explanations"],
+                    "fallback": True
                 }
+            raise ValueError("grading reply did not match the GradeReport schema")
             
-            # Clean and parse response
-            response_text = response_text.strip()
-            if '```json' in response_text:
-                response_text = response_text.split('```json')[1].split('```')[0].strip()
-            
-            result = json.loads(response_text)
-            return result
-            
+        except QuotaExceeded:
+            raise
         except Exception as e:
-            print(f"❌ Assignment grading error: {e}")
+            logger.error("Assignment grading error: %s", e)
             return {
                 "overall_score": 70,
                 "feedback": "Assignment graded with basic criteria.",
                 "question_grades": [],
                 "strengths": ["Completed all questions"],
-                "improvements": ["Review key concepts"]
+                "improvements": ["Review key concepts"],
+                "fallback": True
+            }
+
+    @staticmethod
+    def _choice_index(value, options):
+        """Map "B", "b)", "B. text" or the option text itself to an option index"""
+        if value is None:
+            return None
+        text = str(value).strip()
+        if not text:
+            return None
+        for i, option in enumerate(options):
+            if text.casefold() == str(option).strip().casefold():
+                return i
+        letter = text[0].upper()
+        if "A" <= letter <= "Z" and (len(text) == 1 or text[1] in ".):- "):
+            index = ord(letter) - ord("A")
+            if index < len(options):
+                return index
+        return None
+
+    def _grade_choice_locally(self, question, answer, max_score):
+        """Grade a multiple-choice question against correct_answer; None if it can't be decided"""
+        options = question.get("options") or []
+        correct = self._choice_index(question.get("correct_answer"), options)
+        if not options or correct is None:
+            return None
+        chosen = self._choice_index(answer, options)
+        is_correct = chosen == correct
+        correct_letter = chr(ord("A") + correct)
+        return {
+            "question_id": question.get("id"),
+            "score": max_score if is_correct else 0,
+            "max_score": max_score,
+            "feedback": "Correct!" if is_correct else f"The correct answer is {correct_letter}. {question.get('explanation', '')}".strip(),
+            "graded_by": "answer_key"
+        }
+
+    async def _grade_free_text_chunk(self, topic, chunk, language):
+        """Grade a few open-ended answers with one small prompt; missing grades fall back per question"""
+        items = [
+            {
+                "question_id": question.get("id"),
+                "question": question.get("question"),
+                "expected_answer": question.get("correct_answer"),
+                "student_answer": answer,
+                "max_score": max_score
             }
+            for question, answer, max_score in chunk
+        ]
+        prompt = PROMPTS.render(
+            "grade_assignment_chunk", topic=topic, language=language,
+            items_json=json.dumps(items, ensure_ascii=False, separators=(',', ':'))
+        )
+        grades = {}
+        try:
+            result, response_text = await self._generate_structured(
+                prompt, QuestionGrades, task="grade_assignment", priority="high"
+            )
+            if result is not None:
+                question_grades = result["question_grades"]
+            elif "AI service temporarily unavailable" not in response_text:
+                question_grades = salvage_array_items(response_text, "question_grades")
+            else:
+                question_grades = []
+            for grade in question_grades:
+                grades[str(grade.get("question_id"))] = grade
+        except Exception as e:
+            logger.error("Grading chunk failed: %s", e)
+
+        results = []
+        for question, answer, max_score in chunk:
+            grade = grades.get(str(question.get("id")))
+            try:
+                score = min(max(float(grade["score"]), 0), max_score)
+                results.append({
+                    "question_id": question.get("id"),
+                    "score": score,
+                    "max_score": max_score,
+                    "feedback": grade.get("feedback", ""),
+                    "graded_by": "model"
+                })
+            except (TypeError, KeyError, ValueError):
+                results.append({
+                    "question_id": question.get("id"),
+                    "score": round(max_score * 0.7, 1),
+                    "max_score": max_score,
+                    "feedback": "Answer recorded. Detailed feedback is temporarily unavailable for this question.",
+                    "graded_by": "fallback",
+                    "fallback": True
+                })
+        return results
+
+    async def _grade_assignment_per_question(self, assignment_data, student_answers, language):
+        """Grade choice questions locally and fan open-ended ones out to Gemini in small chunks"""
+        topic = assignment_data.get("topic", "unknown topic")
+        questions = assignment_data.get("questions", [])
+        answers = {str(k): v for k, v in (student_answers or {}).items()}
+
+        grades = {}
+        free_text = []
+        for position, question in enumerate(questions):
+            question_id = question.get("id", position + 1)
+            question = {**question, "id": question_id}
+            max_score = question.get("points") or 10
+            answer = answers.get(str(question_id), "")
+            if not str(answer).strip():
+                grades[position] = {
+                    "question_id": question_id,
+                    "score": 0,
+                    "max_score": max_score,
+                    "feedback": "No answer was submitted for this question.",
+                    "graded_by": "answer_key"
+                }
+                continue
+            local = self._grade_choice_locally(question, answer, max_score)
+            if local is not None:
+                grades[position] = local
+            else:
+                free_text.append((position, question, answer, max_score))
+
+        chunks = [free_text[i:i + self.grading_chunk_size] for i in range(0, len(free_text), self.grading_chunk_size)]
+        logger.info("Per-question grading", extra={"local": len(grades), "open_ended": len(free_text), "chunks": len(chunks)})
+        chunk_results = await asyncio.gather(*(
+            self._grade_free_text_chunk(topic, [(q, a, m) for _, q, a, m in chunk], language)
+            for chunk in chunks
+        ))
+        for chunk, results in zip(chunks, chunk_results):
+            for (position, _, _, _), result in zip(chunk, results):
+                grades[position] = result
+
+        return question_grade_report([grades[position] for position in sorted(grades)])
+
+    def _chat_prompt(self, message, subject, tone, language, history=""):
+        return PROMPTS.render(
+            "chat_with_tutor", subject=subject, tone=tone, language=language, history=history, message=message
+        )
+
+    @asynccontextmanager
+    async def _tutor_session(self, session_id):
+        """Hold the session lock for one exchange so turns are recorded in order"""
+        if self.tutor_sessions is None:
+            yield None
+            return
+        session = self.tutor_sessions.get(session_id)
+        async with session.lock:
+            yield session
+
+    async def _summarize_turns(self, digest, turns):
+        """Summarizer for TutorSessionStore: fold old turns into the running digest"""
+        transcript = "\n".join(f"{t['role']}: {t['content']}" for t in turns)
+        prompt = PROMPTS.render("summarize_turns", digest=digest or 'None', transcript=transcript)
+        summary = await self._call_gemini_async(prompt, priority="low", task="summarize_turns")
+        if "AI service temporarily unavailable" in summary:
+            raise RuntimeError("summarization unavailable")
+        return summary
 
-    def chat_with_tutor(self, session_id, message, subject, tone, language):
+    async def chat_with_tutor(self, session_id, message, subject, tone, language):
         """Chat with AI tutor using real Gemini API"""
-        print(f"💬 Chat request for {subject}: {message[:50]}...")
-        
-        prompt = f"""
-        You are a friendly {subject} tutor. Respond in a {tone} tone in {language}.
-        
-        Student question: {message}
-        
-        Provide a helpful, educational response that explains concepts clearly and encourages learning.
-        Keep your response under 200 words.
-        """
+        logger.info("Chat request", extra={"subject": subject, "payload": message})
         
         try:
-            response_text = self._call_gemini(prompt, "gemini-2.0-flash")
+            async with self._tutor_session(session_id) as session:
+                history = self.tutor_sessions.render_history(session) if session else ""
+                prompt = self._chat_prompt(message, subject, tone, language, history)
+                response_text = await self._call_gemini_async(prompt, task="chat_with_tutor")
             
-            # Check if we got an error message
-            if "AI service temporarily unavailable" in response_text:
-                return {
-                    "session_id": session_id,
-                    "reply": f"I'd love to help you with {subject}! Please try your question again in a moment.",
-                    "timestamp": datetime.now().isoformat(),
-                    "fallback": True
-                }
+                # Check if we got an error message
+                if "AI service temporarily unavailable" in response_text:
+                    return {
+                        "session_id": session_id,
+                        "reply": f"I'd love to help you with {subject}! Please try your question again in a moment.",
+                        "timestamp": datetime.now().isoformat(),
+                        "fallback": True
+                    }
+
+                if session:
+                    self.tutor_sessions.append_exchange(session, message, response_text)
             
             return {
                 "session_id": session_id,
                 "reply": response_text,
                 "timestamp": datetime.now().isoformat()
             }
+        except QuotaExceeded:
+            raise
         except Exception as e:
-            print(f"❌ Chat error: {e}")
+            logger.error("Chat error: %s", e)
             return {
                 "session_id": session_id,
                 "reply": f"I'm here to help with {subject}! Let me know what specific concept you're struggling with.",
@@ -356,17 +1069,19 @@ class GeminiService:
                 "fallback": True
             }
 
-    def generate_explanation(self, topic, grade_level, language, style, previous_knowledge):
+    def _explanation_prompt(self, topic, grade_level, language, style, previous_knowledge):
+        return PROMPTS.render(
+            "generate_explanation", topic=topic, grade_level=grade_level, language=language, style=style,
+            previous_knowledge=previous_knowledge or 'None'
+        )
+
+    @cached_generator
+    async def generate_explanation(self, topic, grade_level, language, style, previous_knowledge):
         """Generate educational explanations"""
-        prompt = f"""
-        Explain {topic} for {grade_level} students in {language} using a {style} style.
-        Previous knowledge: {previous_knowledge or 'None'}
-        
-        Provide a clear, engaging explanation in simple terms.
-        """
+        prompt = self._explanation_prompt(topic, grade_level, language, style, previous_knowledge)
         
         try:
-            response_text = self._call_gemini(prompt, "gemini-2.0-flash")
+            response_text = await self._call_gemini_async(prompt, task="generate_explanation")
             
             if "AI service temporarily unavailable" in response_text:
                 return {
@@ -381,6 +1096,8 @@ class GeminiService:
                 "topic": topic,
                 "grade_level": grade_level
             }
+        except QuotaExceeded:
+            raise
         except Exception as e:
             return {
                 "explanation": f"Here's a {style} explanation about {topic} for {grade_level} students.",
@@ -389,20 +1106,14 @@ class GeminiService:
                 "fallback": True
             }
 
-    def grade_submission(self, question, rubric, student_answer, language, complexity, positive_reinforcement, encourage_specificity):
+    async def grade_submission(self, question, rubric, student_answer, language, complexity, positive_reinforcement, encourage_specificity):
         """Grade student submissions"""
-        prompt = f"""
-        Grade this student answer:
-        Question: {question}
-        Rubric: {rubric}
-        Student Answer: {student_answer}
-        
-        Provide a score out of 10 and constructive feedback in {language}.
-        Focus on what the student did well and suggest one area for improvement.
-        """
+        prompt = PROMPTS.render(
+            "grade_submission", question=question, rubric=rubric, student_answer=student_answer, language=language
+        )
         
         try:
-            response_text = self._call_gemini(prompt, "gemini-2.0-flash")
+            response_text = await self._call_gemini_async(prompt, priority="high", task="grade_submission")
             
             if "AI service temporarily unavailable" in response_text:
                 return {
@@ -417,6 +1128,8 @@ class GeminiService:
                 "feedback": response_text,
                 "rubric_used": rubric
             }
+        except QuotaExceeded:
+            raise
         except Exception as e:
             return {
                 "score": 7.5,
@@ -425,25 +1138,19 @@ class GeminiService:
                 "fallback": True
             }
 
-    def generate_lesson_plan(self, topic, grade_level, duration_minutes, learning_objectives, language):
+    def _lesson_plan_prompt(self, topic, grade_level, duration_minutes, learning_objectives, language):
+        return PROMPTS.render(
+            "generate_lesson_plan", topic=topic, grade_level=grade_level, duration_minutes=duration_minutes,
+            learning_objectives=learning_objectives or 'Standard curriculum objectives', language=language
+        )
+
+    @cached_generator
+    async def generate_lesson_plan(self, topic, grade_level, duration_minutes, learning_objectives, language):
         """Generate comprehensive lesson plans"""
-        prompt = f"""
-        Create a {duration_minutes}-minute lesson plan about {topic} for {grade_level} students.
-        Learning Objectives: {learning_objectives or 'Standard curriculum objectives'}
-        Language: {language}
-        
-        Include:
-        1. Lesson objectives
-        2. Materials needed
-        3. Step-by-step activities
-        4. Assessment ideas
-        5. Differentiation strategies
-        
-        Return as valid JSON format.
-        """
+        prompt = self._lesson_plan_prompt(topic, grade_level, duration_minutes, learning_objectives, language)
         
         try:
-            response_text = self._call_gemini(prompt, "gemini-2.0-flash")
+            response_text = await self._call_gemini_async(prompt, task="generate_lesson_plan")
             
             if "AI service temporarily unavailable" in response_text:
                 return {
@@ -466,100 +1173,171 @@ class GeminiService:
                     "grade_level": grade_level
                 }
                 
+        except QuotaExceeded:
+            raise
         except Exception as e:
             return {
                 "lesson_plan": f"A {duration_minutes}-minute structured lesson on {topic} for {grade_level}.",
                 "error": str(e)
             }
 
-    def generate_teaching_resources(self, topic, resource_type, grade_level, language):
+    @cached_generator
+    async def generate_teaching_resources(self, topic, resource_type, grade_level, language):
         """Generate teaching resources"""
-        prompt = f"""
-        Create a {resource_type} about {topic} for {grade_level} students in {language}.
-        Make it educational, engaging, and age-appropriate.
-        """
+        prompt = PROMPTS.render(
+            "generate_teaching_resources", resource_type=resource_type, topic=topic, grade_level=grade_level,
+            language=language
+        )
         
         try:
-            response_text = self._call_gemini(prompt, "gemini-2.0-flash")
+            response_text = await self._call_gemini_async(prompt, priority="low", task="generate_teaching_resources")
+
+            if "AI service temporarily unavailable" in response_text:
+                return {
+                    "resources": [f"{resource_type.capitalize()} on {topic} for {grade_level}."],
+                    "resource_type": resource_type,
+                    "topic": topic,
+                    "fallback": True
+                }
+
             return {
                 "resources": [response_text],
                 "resource_type": resource_type,
                 "topic": topic
             }
+        except QuotaExceeded:
+            raise
         except Exception as e:
             return {
                 "resources": [f"{resource_type.capitalize()} on {topic} for {grade_level}."],
                 "error": str(e)
             }
 
-    def analyze_performance(self, student_data, recent_scores, completed_topics, language):
-        """Analyze student performance"""
-        prompt = f"""
-        Analyze this student's performance:
-        Recent Scores: {recent_scores}
-        Completed Topics: {completed_topics}
-        Additional Data: {student_data}
-        
-        Provide:
-        1. Average performance analysis
-        2. Strengths and weaknesses
-        3. Recommended next topics
-        4. Study suggestions
-        
-        Language: {language}
-        """
-        
+    async def analyze_performance(self, student_data, recent_scores, completed_topics, language, topic_scores=None,
+                                  max_score=100.0, window=3, cohort_averages=None, include_narrative=True):
+        """Compute performance metrics locally and ask Gemini only for the narrative"""
+        metrics = analyze_student(recent_scores, topic_scores, max_score, window, cohort_averages)
+        result = {
+            "average_score": metrics["average_score"],
+            "topics_count": len(completed_topics),
+            "metrics": metrics,
+            "recommendations": self._performance_recommendations(metrics)
+        }
+        if not include_narrative:
+            return result
+
+        prompt = PROMPTS.render(
+            "analyze_performance", metrics=json.dumps(metrics), completed_topics=completed_topics,
+            student_data=student_data, language=language
+        )
         try:
-            response_text = self._call_gemini(prompt, "gemini-2.0-flash")
-            avg_score = sum(recent_scores) / len(recent_scores) if recent_scores else 0
-            return {
-                "analysis": response_text,
-                "average_score": avg_score,
-                "topics_count": len(completed_topics)
-            }
+            result["analysis"] = await self._call_gemini_async(prompt, task="analyze_performance")
+            return result
+        except QuotaExceeded:
+            raise
         except Exception as e:
-            return {
-                "average_score": 7.5,
-                "recommendations": ["Review completed topics", "Practice more exercises"],
-                "error": str(e)
-            }
+            return {**result, "error": str(e)}
 
-    def generate_learning_path(self, current_level, target_goals, preferred_learning_style, available_topics, language):
-        """Generate personalized learning paths"""
-        prompt = f"""
-        Create a personalized learning path:
-        Current Level: {current_level}
-        Target Goals: {target_goals}
-        Learning Style: {preferred_learning_style}
-        Available Topics: {available_topics}
-        
-        Provide a structured learning journey with milestones.
-        Language: {language}
-        """
+    @staticmethod
+    def _performance_recommendations(metrics):
+        """Rule-based suggestions that need no model call"""
+        weakest = sorted((value, topic) for topic, value in metrics["topic_mastery"].items() if value < 0.6)
+        recommendations = [f"Review {topic}" for _, topic in weakest[:3]]
+        if metrics["trend"] == "declining":
+            recommendations.append("Recent scores are falling; revisit the latest topics")
+        if not recommendations:
+            recommendations.append("Keep practicing with new exercises")
+        return recommendations
+
+    async def generate_learning_path(self, current_level, target_goals, preferred_learning_style, available_topics,
+                                     language, completed_topics=None, include_narrative=False):
+        """Plan a learning path on the topic graph, asking Gemini only for unknown topics or prose"""
+        if self.topic_graph is None:
+            return await self._learning_path_from_gemini(
+                current_level, target_goals, preferred_learning_style, available_topics, language
+            )
+
+        graph = self.topic_graph
+        # A goal that is also an available topic is extracted once
+        unknown = graph.missing([*(available_topics or []), *target_goals])
+        if unknown:
+            await self._extract_prerequisites(unknown, available_topics or [], current_level)
+
+        path = graph.learning_path(
+            current_level, target_goals, preferred_learning_style, completed_topics or [], available_topics or []
+        )
+        if path is None:
+            return await self._learning_path_from_gemini(
+                current_level, target_goals, preferred_learning_style, available_topics, language
+            )
+        result = {
+            **path,
+            "current_level": current_level,
+            "target_goals": target_goals,
+            "source": "topic_graph"
+        }
+        if include_narrative:
+            prompt = PROMPTS.render(
+                "narrate_learning_path", current_level=current_level, target_goals=target_goals,
+                preferred_learning_style=preferred_learning_style, language=language,
+                path=json.dumps([[m["topics"], m["estimated_hours"]] for m in path["milestones"]], ensure_ascii=False)
+            )
+            try:
+                result["learning_path"] = await self._call_gemini_async(prompt, task="narrate_learning_path")
+            except QuotaExceeded:
+                raise
+            except Exception as e:
+                result["error"] = str(e)
+        return result
+
+    async def _extract_prerequisites(self, topics, curriculum, level):
+        """Ask Gemini for the prerequisite edges of topics the graph has not seen, and store them"""
+        prompt = PROMPTS.render(
+            "extract_prerequisites", topics=json.dumps(topics, ensure_ascii=False),
+            curriculum=json.dumps(curriculum, ensure_ascii=False), level=level
+        )
+        result, response_text = await self._generate_structured(
+            prompt, TopicGraphExtraction, task="extract_prerequisites"
+        )
+        if result is None:
+            logger.warning("Prerequisite extraction failed", extra={"topics": len(topics)})
+            return 0
+        added = await asyncio.to_thread(self.topic_graph.add_topics, result["topics"], "gemini", False)
+        logger.info("Extracted prerequisites", extra={"topics": len(result["topics"]), "edges": added})
+        return added
+
+    async def _learning_path_from_gemini(self, current_level, target_goals, preferred_learning_style,
+                                         available_topics, language):
+        prompt = PROMPTS.render(
+            "generate_learning_path", current_level=current_level, target_goals=target_goals,
+            preferred_learning_style=preferred_learning_style, available_topics=available_topics, language=language
+        )
         
         try:
-            response_text = self._call_gemini(prompt, "gemini-2.0-flash")
+            response_text = await self._call_gemini_async(prompt, task="generate_learning_path")
             return {
                 "learning_path": response_text,
                 "current_level": current_level,
-                "target_goals": target_goals
+                "target_goals": target_goals,
+                "source": "gemini"
             }
+        except QuotaExceeded:
+            raise
         except Exception as e:
             return {
                 "path": f"From {current_level} to {target_goals} using {preferred_learning_style} approach.",
                 "error": str(e)
             }
 
-    def generate_flashcards(self, topic, num_cards, language):
+    async def generate_flashcards(self, topic, num_cards, language, avoid=None):
         """Generate study flashcards"""
-        prompt = f"""
-        Create {num_cards} educational flashcards about {topic} in {language}.
-        Format: Front of card (question) | Back of card (answer)
-        Make them clear and educational.
-        """
+        prompt = PROMPTS.render(
+            "generate_flashcards", num_cards=num_cards, topic=topic, language=language,
+            constraints=self._question_constraints(avoid)
+        )
         
         try:
-            response_text = self._call_gemini(prompt, "gemini-2.0-flash")
+            response_text = await self._call_gemini_async(prompt, priority="low", task="generate_flashcards")
             # Parse response into flashcard pairs
             lines = [line.strip() for line in response_text.split('\n') if '|' in line]
             flashcards = []
@@ -571,56 +1349,394 @@ class GeminiService:
                         "back": parts[1].strip()
                     })
             return {"flashcards": flashcards}
+        except QuotaExceeded:
+            raise
         except Exception as e:
             return {
                 "flashcards": [{"front": f"{topic} fact {i+1}", "back": "Explanation..."} for i in range(num_cards)],
                 "error": str(e)
             }
 
-    def generate_study_guide(self, topics, exam_focus, language):
+    async def save_flashcards(self, student_id, topic, flashcards):
+        """Add generated cards to a student's deck, skipping near-duplicates of cards already in it"""
+        existing = await asyncio.to_thread(self.flashcard_store.fronts, student_id, topic)
+        fresh = drop_near_duplicates(flashcards, existing, field="front")
+        return await asyncio.to_thread(self.flashcard_store.add_cards, student_id, topic, fresh)
+
+    async def _refill_deck(self, student_id, topic, language, count):
+        existing = await asyncio.to_thread(self.flashcard_store.fronts, student_id, topic)
+        result = await self.generate_flashcards(topic, count, language, avoid=existing)
+        # Canned fallback cards are not worth scheduling
+        if "error" in result or not result["flashcards"]:
+            return 0
+        added = await self.save_flashcards(student_id, topic, result["flashcards"])
+        logger.info("Refilled flashcard deck", extra={"topic": topic, "cards": len(added)})
+        return len(added)
+
+    async def due_flashcards(self, student_id, topic=None, limit=20, language="English"):
+        """Cards due for review; a deck smaller than ``limit`` is topped up with newly generated cards first"""
+        generated = 0
+        store = self.flashcard_store
+        # Only the deck's size matters: a student who is on schedule has few cards due but needs no new ones
+        size = await asyncio.to_thread(store.deck_size, student_id, topic) if topic else 0
+        if topic and size < min(limit, self.flashcard_max_deck):
+            count = min(max(self.flashcard_refill_size, limit - size), self.flashcard_max_deck - size)
+            refill = functools.partial(self._refill_deck, student_id, topic, language, count)
+            if self.single_flight is not None:
+                generated = await self.single_flight.do(f"{student_id}\0{topic}", refill, scope="flashcard_refill")
+            else:
+                generated = await refill()
+        cards = await asyncio.to_thread(store.due_cards, student_id, topic, limit)
+        return {"student_id": student_id, "topic": topic, "cards": cards, "generated": generated}
+
+    def _study_guide_prompt(self, topics, exam_focus, language):
+        return PROMPTS.render("generate_study_guide", topics=', '.join(topics), exam_focus=exam_focus, language=language)
+
+    @cached_generator
+    async def generate_study_guide(self, topics, exam_focus, language):
         """Generate comprehensive study guides"""
-        prompt = f"""
-        Create a comprehensive study guide covering: {', '.join(topics)}
-        Exam Focus: {exam_focus}
-        Language: {language}
-        
-        Include key concepts, important formulas, common mistakes, and practice tips.
-        """
+        prompt = self._study_guide_prompt(topics, exam_focus, language)
         
         try:
-            response_text = self._call_gemini(prompt, "gemini-2.0-flash")
+            response_text = await self._call_gemini_async(prompt, task="generate_study_guide")
+
+            if "AI service temporarily unavailable" in response_text:
+                return {
+                    "study_guide": f"Study guide for {', '.join(topics)} focusing on {exam_focus}.",
+                    "topics": topics,
+                    "exam_focus": exam_focus,
+                    "fallback": True
+                }
+
             return {
                 "study_guide": response_text,
                 "topics": topics,
                 "exam_focus": exam_focus
             }
+        except QuotaExceeded:
+            raise
         except Exception as e:
             return {
                 "guide": f"Study guide for {', '.join(topics)} focusing on {exam_focus}.",
                 "error": str(e)
             }
 
-    def process_batch_requests(self, requests):
-        """Process multiple AI requests in batch"""
-        results = []
-        for i, request in enumerate(requests):
+    # ------------------------------------------------------------------
+    # Streaming variants: yield text chunks as Gemini produces them
+    # ------------------------------------------------------------------
+
+    async def stream_chat_with_tutor(self, session_id, message, subject, tone, language):
+        logger.info("Streaming chat request", extra={"subject": subject, "payload": message})
+        async with self._tutor_session(session_id) as session:
+            history = self.tutor_sessions.render_history(session) if session else ""
+            prompt = self._chat_prompt(message, subject, tone, language, history)
+            reply = []
+            async for text in self._stream_gemini_async(prompt, task="chat_with_tutor"):
+                reply.append(text)
+                yield text
+            # Only completed replies become part of the conversation
+            if session:
+                self.tutor_sessions.append_exchange(session, message, "".join(reply))
+
+    async def stream_explanation(self, topic, grade_level, language, style, previous_knowledge):
+        prompt = self._explanation_prompt(topic, grade_level, language, style, previous_knowledge)
+        async for text in self._stream_gemini_async(prompt, task="generate_explanation"):
+            yield text
+
+    async def stream_lesson_plan(self, topic, grade_level, duration_minutes, learning_objectives, language):
+        prompt = self._lesson_plan_prompt(topic, grade_level, duration_minutes, learning_objectives, language)
+        async for text in self._stream_gemini_async(prompt, task="generate_lesson_plan"):
+            yield text
+
+    async def stream_study_guide(self, topics, exam_focus, language):
+        prompt = self._study_guide_prompt(topics, exam_focus, language)
+        async for text in self._stream_gemini_async(prompt, task="generate_study_guide"):
+            yield text
+
+    async def _stream_json_items(self, prompt: str, array_key: str, limit: int, task: str = "default"):
+        """Yield each object of ``array_key`` as soon as the model closes it"""
+        parser = JsonArrayItemParser(array_key)
+        emitted = 0
+        try:
+            async for text in self._stream_gemini_async(prompt, task=task):
+                for item in parser.feed(text):
+                    yield item
+                    emitted += 1
+                    if emitted >= limit:
+                        return
+                if parser.done:
+                    return
+        except Exception as e:
+            logger.error("Gemini stream failed after %d items: %s", emitted, e)
+        finally:
+            if parser.items_skipped:
+                logger.warning("Skipped malformed %s items", array_key, extra={"skipped": parser.items_skipped})
+
+    async def _stream_question_set(self, count, make_prompt, array_key, task):
+        """Yield questions from parallel chunk streams as they arrive, skipping near-duplicates"""
+        plan = self._chunk_plan(count)
+        if len(plan) == 1:
+            async for item in self._stream_json_items(make_prompt(count, None), array_key, count, task=task):
+                yield item
+            return
+
+        queue: asyncio.Queue = asyncio.Queue()
+
+        async def produce(size, focus):
             try:
-                # Process each request (simplified)
-                result = f"Processed request {i+1}: {request.get('type', 'unknown')}"
-                results.append(result)
-            except Exception as e:
-                results.append(f"Error processing request {i+1}: {str(e)}")
-        return results
+                async for item in self._stream_json_items(make_prompt(size, focus), array_key, size, task=task):
+                    queue.put_nowait(item)
+            finally:
+                queue.put_nowait(None)
+
+        producers = [asyncio.ensure_future(produce(size, focus)) for size, focus in plan]
+        running = len(producers)
+        seen = []
+        try:
+            while running and len(seen) < count:
+                item = await queue.get()
+                if item is None:
+                    running -= 1
+                elif drop_near_duplicates([item], seen):
+                    seen.append(item.get("question", ""))
+                    yield item
+        finally:
+            for producer in producers:
+                producer.cancel()
+            await asyncio.gather(*producers, return_exceptions=True)
+
+    async def stream_quiz(self, topic, num_questions, question_type, difficulty, grade_level, language):
+        """Yield quiz questions one by one, falling back to canned questions if none arrive"""
+        logger.info("Streaming quiz", extra={"topic": topic})
+        emitted = 0
+        async for question in self._stream_question_set(
+            num_questions,
+            lambda size, focus: self._quiz_prompt(topic, size, difficulty, grade_level, language, focus=focus),
+            "quiz", task="generate_quiz"
+        ):
+            emitted += 1
+            yield question
+        if emitted == 0:
+            for question in self._get_fallback_quiz(topic, num_questions)["quiz"]:
+                yield {**question, "fallback": True}
+
+    async def stream_assignment(self, topic, grade_level, subject, num_questions, language):
+        """Yield assignment questions one by one with sequential ids"""
+        logger.info("Streaming assignment", extra={"topic": topic})
+        emitted = 0
+        async for question in self._stream_question_set(
+            num_questions,
+            lambda size, focus: self._assignment_prompt(topic, grade_level, subject, size, focus=focus),
+            "questions", task="generate_assignment"
+        ):
+            emitted += 1
+            yield {**question, "id": emitted}
+        if emitted == 0:
+            fallback = self._get_fallback_assignment(topic, grade_level, subject, num_questions)
+            for question in fallback["assignment"]["questions"]:
+                yield {**question, "fallback": True}
+
+    async def process_batch_requests(self, requests, max_parallel: Optional[int] = None):
+        """Process multiple AI requests concurrently, returning results in input order"""
+        limit = max(1, max_parallel or self.batch_max_parallel)
+        semaphore = asyncio.Semaphore(limit)
+        logger.info("Processing batch", extra={"requests": len(requests), "parallel": limit})
+
+        async def run_item(index, item):
+            request_type = item.get("type", "unknown") if isinstance(item, dict) else "unknown"
+            entry = {"index": index, "type": request_type}
+            if isinstance(item, dict) and "id" in item:
+                entry["id"] = item["id"]
+
+            handler = BATCH_HANDLERS.get(request_type)
+            if handler is None:
+                entry.update(status="error", error=f"Unsupported request type: {request_type}")
+                return entry
+
+            request_model, method_name = handler
+            params = item.get("params")
+            if params is None:
+                params = {k: v for k, v in item.items() if k not in ("type", "id")}
+            if not isinstance(params, dict):
+                entry.update(status="error", error="Invalid parameters: params must be an object")
+                return entry
+
+            try:
+                payload = request_model(**params)
+            except ValidationError as e:
+                problems = "; ".join(f"{'.'.join(map(str, err['loc']))}: {err['msg']}" for err in e.errors())
+                entry.update(status="error", error=f"Invalid parameters: {problems}")
+                return entry
+
+            async with semaphore:
+                try:
+                    result = await getattr(self, method_name)(**payload.model_dump())
+                    entry.update(status="success", result=result)
+                except Exception as e:
+                    logger.error("Batch item %d (%s) failed: %s", index, request_type, e)
+                    entry.update(status="error", error=str(e))
+            return entry
+
+        return await asyncio.gather(*(run_item(i, item) for i, item in enumerate(requests)))
 
 # ==============================================================================
 # FASTAPI APP SETUP
 # ==============================================================================
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Create the shared Gemini client pool once and close it on shutdown"""
+    api_key = os.getenv("GEMINI_API_KEY")
+    backend = os.getenv("GEMINI_BACKEND", "genai")
+    logger.info("Gemini API key %s in environment", "found" if api_key else "not found", extra={"backend": backend})
+
+    app.state.ready = False
+    app.state.warmup = None
+    app.state.gemini_pool = None
+    app.state.gemini_service = None
+    app.state.gemini_init_error = None
+    app.state.response_cache = create_response_cache(
+        backend=os.getenv("RESPONSE_CACHE_BACKEND", "memory"),
+        ttl_seconds=float(os.getenv("RESPONSE_CACHE_TTL", "3600")),
+        max_entries=int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "1024")),
+        path=os.getenv("RESPONSE_CACHE_PATH", "response_cache.sqlite3")
+    )
+
+    # The offline fake backend needs no API key
+    if api_key or backend == "fake":
+        try:
+            pool = GeminiClientPool(
+                api_key=api_key or "",
+                max_size=int(os.getenv("GEMINI_POOL_SIZE", "4")),
+                client_factory=create_client_factory(
+                    backend, fake_config=load_fake_config(os.getenv("FAKE_GEMINI_CONFIG"))
+                )
+            )
+            pool.warmup(int(os.getenv("GEMINI_POOL_MIN_SIZE", "1")))
+            app.state.gemini_pool = pool
+            app.state.gemini_service = GeminiService(
+                pool,
+                max_concurrency_per_model=int(os.getenv("GEMINI_MAX_CONCURRENCY_PER_MODEL", "32")),
+                batch_max_parallel=int(os.getenv("GEMINI_BATCH_MAX_PARALLEL", "8")),
+                response_cache=app.state.response_cache,
+                single_flight=SingleFlight() if os.getenv("SINGLE_FLIGHT", "1") != "0" else None,
+                tutor_sessions=TutorSessionStore(
+                    max_sessions=int(os.getenv("TUTOR_MAX_SESSIONS", "10000")),
+                    max_turns=int(os.getenv("TUTOR_MAX_TURNS", "12")),
+                    max_history_tokens=int(os.getenv("TUTOR_MAX_HISTORY_TOKENS", "1500")),
+                    idle_ttl_seconds=float(os.getenv("TUTOR_SESSION_TTL", "1800"))
+                ),
+                admission=AdmissionController(
+                    limits=json.loads(os.getenv("GEMINI_RATE_LIMITS", "{}")),
+                    default_rpm=int(os.getenv("GEMINI_DEFAULT_RPM", "2000")),
+                    default_tpm=int(os.getenv("GEMINI_DEFAULT_TPM", "4000000")),
+                    max_queue=int(os.getenv("GEMINI_ADMISSION_MAX_QUEUE", "100")),
+                    max_wait_seconds=float(os.getenv("GEMINI_ADMISSION_MAX_WAIT", "10")),
+                    reserve_fraction=float(os.getenv("GEMINI_HIGH_PRIORITY_RESERVE", "0.2"))
+                ),
+                resilience=ResilientCaller(
+                    retry_policy=RetryPolicy(
+                        max_attempts=int(os.getenv("GEMINI_RETRY_ATTEMPTS", "3")),
+                        base_delay=float(os.getenv("GEMINI_RETRY_BASE_DELAY", "0.5")),
+                        max_delay=float(os.getenv("GEMINI_RETRY_MAX_DELAY", "8"))
+                    ),
+                    failure_threshold=int(os.getenv("GEMINI_BREAKER_FAILURES", "5")),
+                    reset_timeout=float(os.getenv("GEMINI_BREAKER_RESET_SECONDS", "30"))
+                ),
+                upstream_timeout=float(os.getenv("GEMINI_TIMEOUT_SECONDS", "30")),
+                default_grading_mode=os.getenv("ASSIGNMENT_GRADING_MODE", "holistic"),
+                grading_chunk_size=int(os.getenv("GRADING_CHUNK_SIZE", "1")),
+                generation_chunk_size=int(os.getenv("GENERATION_CHUNK_SIZE", "10")),
+                router=ModelRouter(
+                    tiers={
+                        tier: model
+                        for tier, model in (
+                            ("lite", os.getenv("GEMINI_MODEL_LITE")),
+                            ("standard", os.getenv("GEMINI_MODEL_STANDARD")),
+                            ("strong", os.getenv("GEMINI_MODEL_STRONG"))
+                        )
+                        if model
+                    },
+                    rules=json.loads(os.getenv("GEMINI_ROUTING_RULES", "{}")),
+                    prices=json.loads(os.getenv("GEMINI_MODEL_PRICES", "{}")),
+                    default_tier=os.getenv("GEMINI_DEFAULT_TIER", "standard"),
+                    escalation=os.getenv("GEMINI_ESCALATE_ON_INVALID_JSON", "1") != "0"
+                ),
+                structured_output=os.getenv("GEMINI_STRUCTURED_OUTPUT", "1") != "0",
+                question_bank=QuestionBank(
+                    path=os.getenv("QUESTION_BANK_PATH", "question_bank.sqlite3"),
+                    min_similarity=float(os.getenv("QUESTION_BANK_MIN_SIMILARITY", "0.9"))
+                ) if os.getenv("QUESTION_BANK", "1") != "0" else None,
+                micro_batch={
+                    "max_batch_size": int(os.getenv("MICRO_BATCH_MAX_SIZE", "8")),
+                    "max_wait": float(os.getenv("MICRO_BATCH_MAX_WAIT_MS", "10")) / 1000,
+                    "max_item_tokens": int(os.getenv("MICRO_BATCH_MAX_ITEM_TOKENS", "600")),
+                    "tasks": [t for t in os.getenv("MICRO_BATCH_TASKS", ",".join(DEFAULT_BATCH_TASKS)).split(",") if t]
+                } if os.getenv("MICRO_BATCH", "0") != "0" else None,
+                topic_graph=TopicGraph(
+                    path=os.getenv("TOPIC_GRAPH_PATH", "topic_graph.sqlite3"),
+                    memo_size=int(os.getenv("TOPIC_GRAPH_MEMO_SIZE", "1024"))
+                ) if os.getenv("TOPIC_GRAPH", "1") != "0" else None,
+                flashcard_store=FlashcardStore(
+                    path=os.getenv("FLASHCARD_STORE_PATH", "flashcards.sqlite3")
+                ) if os.getenv("FLASHCARD_STORE", "1") != "0" else None,
+                flashcard_max_deck=int(os.getenv("FLASHCARD_MAX_DECK", "200")),
+                flashcard_refill_size=int(os.getenv("FLASHCARD_REFILL_SIZE", "10"))
+            )
+        except Exception as e:
+            logger.error("Gemini configuration failed: %s", e)
+            app.state.gemini_init_error = str(e)
+
+    app.state.grading_jobs = None
+    if app.state.gemini_service is not None:
+        app.state.grading_jobs = GradingJobManager(
+            GradingJobStore(os.getenv("GRADING_JOBS_DB", "grading_jobs.sqlite3")),
+            grade_fn=app.state.gemini_service.grade_assignment,
+            workers=int(os.getenv("GRADING_JOB_WORKERS", "4"))
+        )
+        # With several server workers only one may pick up interrupted jobs
+        grading_jobs_db = os.getenv("GRADING_JOBS_DB", "grading_jobs.sqlite3")
+        if claim_singleton(grading_jobs_db + ".resume.lock"):
+            await app.state.grading_jobs.resume_unfinished()
+        if os.getenv("GEMINI_WARMUP_PROBE", "0") != "0":
+            app.state.warmup = await app.state.gemini_service.warmup(
+                timeout=float(os.getenv("GEMINI_WARMUP_TIMEOUT", "10"))
+            )
+    app.state.ready = app.state.gemini_service is not None
+
+    yield
+
+    app.state.ready = False
+    if app.state.grading_jobs is not None:
+        # Interrupted students stay pending and resume on the next start
+        await app.state.grading_jobs.shutdown()
+    if app.state.gemini_service is not None:
+        if app.state.gemini_service.micro_batcher is not None:
+            await app.state.gemini_service.micro_batcher.close()
+        drained = await app.state.gemini_service.drain(float(os.getenv("GEMINI_DRAIN_SECONDS", "10")))
+        if not drained:
+            logger.warning("Closing client pool with Gemini calls still in flight",
+                           extra={"in_flight": app.state.gemini_service.in_flight()})
+    if app.state.gemini_service is not None and app.state.gemini_service.question_bank is not None:
+        app.state.gemini_service.question_bank.close()
+    if app.state.gemini_service is not None and app.state.gemini_service.topic_graph is not None:
+        app.state.gemini_service.topic_graph.close()
+    if app.state.gemini_service is not None and app.state.gemini_service.flashcard_store is not None:
+        app.state.gemini_service.flashcard_store.close()
+    if app.state.gemini_pool is not None:
+        await app.state.gemini_pool.close()
+    if app.state.response_cache is not None:
+        app.state.response_cache.close()
+
 app = FastAPI(
     title="E-Learning AI Platform API",
     description="AI-powered educational services using NEW Google Gemini API SDK",
-    version="3.0.0"
+    version="3.0.0",
+    lifespan=lifespan
 )
+# Set before any route is declared so every endpoint marks the end of request parsing
+app.router.route_class = TimedRoute
+app.add_middleware(MetricsMiddleware)
 
 # CORS middleware
 app.add_middleware(
@@ -631,24 +1747,35 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Added last so it is outermost and every log line of a request, CORS preflights included, carries its id
+app.add_middleware(RequestIdMiddleware)
+
+@app.exception_handler(QuotaExceeded)
+async def quota_exceeded_handler(request: Request, exc: QuotaExceeded):
+    retry_after = max(1, math.ceil(exc.retry_after)) if math.isfinite(exc.retry_after) else 60
+    logger.warning("Rejected %s: %s", request.url.path, exc, extra={"reason": exc.reason})
+    return JSONResponse(
+        status_code=429,
+        content={"detail": "AI service is at capacity. Please retry shortly.", "reason": exc.reason, "retry_after": retry_after},
+        headers={"Retry-After": str(retry_after)}
+    )
+
 # Dependency injection for Gemini service
-def get_gemini_service():
-    api_key = os.getenv("GEMINI_API_KEY")
-    print(f"🔑 Loading API key from environment: {'Found' if api_key else 'NOT FOUND'}")
-    
-    if not api_key:
-        raise HTTPException(
-            status_code=500, 
-            detail="GEMINI_API_KEY not found in environment variables. Please check your .env file."
-        )
-    
-    try:
-        return GeminiService(api_key=api_key)
-    except Exception as e:
+def get_gemini_service(request: Request) -> GeminiService:
+    service = getattr(request.app.state, "gemini_service", None)
+    if service is not None:
+        return service
+
+    init_error = getattr(request.app.state, "gemini_init_error", None)
+    if init_error:
         raise HTTPException(
             status_code=500, 
-            detail=f"Failed to initialize Gemini service: {str(e)}"
+            detail=f"Failed to initialize Gemini service: {init_error}"
         )
+    raise HTTPException(
+        status_code=500, 
+        detail="GEMINI_API_KEY not found in environment variables. Please check your .env file."
+    )
 
 # ==============================================================================
 # REQUEST MODELS
@@ -656,7 +1783,7 @@ def get_gemini_service():
 
 class QuizRequest(BaseModel):
     topic: str
-    num_questions: int = 3
+    num_questions: int = Field(default=3, ge=1, le=MAX_GENERATED_QUESTIONS)
     question_type: str = "multiple_choice"
     difficulty: str = "medium"
     grade_level: str = "high school"
@@ -696,19 +1823,48 @@ class AssignmentRequest(BaseModel):
     topic: str
     grade_level: str = "high school"
     subject: str = "general"
-    num_questions: int = 5
+    num_questions: int = Field(default=5, ge=1, le=MAX_GENERATED_QUESTIONS)
     language: str = "English"
 
 class AssignmentGradeRequest(BaseModel):
     assignment_data: Dict[str, Any]
     student_answers: Dict[str, str]
     language: str = "English"
+    # "holistic" sends everything in one prompt; "per_question" grades choice
+    # questions locally and open-ended ones concurrently. Defaults to
+    # ASSIGNMENT_GRADING_MODE.
+    grading_mode: Optional[Literal["holistic", "per_question"]] = None
+
+class StudentSubmission(BaseModel):
+    student_id: str
+    student_answers: Dict[str, str]
+
+class GradingJobRequest(BaseModel):
+    assignment_data: Dict[str, Any]
+    submissions: List[StudentSubmission] = Field(..., min_length=1, max_length=500)
+    language: str = "English"
+    grading_mode: Optional[Literal["holistic", "per_question"]] = None
 
 class PerformanceAnalysisRequest(BaseModel):
     student_data: Dict[str, Any]
     recent_scores: List[float]
     completed_topics: List[str]
     language: str = "English"
+    topic_scores: Optional[Dict[str, List[float]]] = None
+    max_score: float = Field(default=100.0, gt=0)
+    window: int = Field(default=3, ge=1, le=50)
+    cohort_averages: Optional[List[float]] = None
+    include_narrative: bool = True
+
+class CohortStudent(BaseModel):
+    student_id: str
+    scores: List[float]
+    topic_scores: Optional[Dict[str, List[float]]] = None
+
+class CohortAnalyticsRequest(BaseModel):
+    students: List[CohortStudent] = Field(..., min_length=1, max_length=50000)
+    max_score: float = Field(default=100.0, gt=0)
+    window: int = Field(default=3, ge=1, le=50)
 
 class LearningPathRequest(BaseModel):
     current_level: str
@@ -716,9 +1872,51 @@ class LearningPathRequest(BaseModel):
     preferred_learning_style: str = "mixed"
     available_topics: Optional[List[str]] = None
     language: str = "English"
+    completed_topics: Optional[List[str]] = None
+    include_narrative: bool = False
+
+class CurriculumTopic(BaseModel):
+    name: str
+    aliases: List[str] = []
+    prerequisites: List[str] = []
+    estimated_hours: Optional[float] = Field(default=None, gt=0)
+
+class CurriculumImportRequest(BaseModel):
+    topics: List[CurriculumTopic] = Field(..., min_length=1, max_length=10000)
+
+class FlashcardRequest(BaseModel):
+    topic: str
+    num_cards: int = 10
+    language: str = "English"
+
+class FlashcardReviewRequest(BaseModel):
+    student_id: str
+    card_id: int
+    grade: int = Field(..., ge=0, le=5)
+
+class StudyGuideRequest(BaseModel):
+    topics: List[str]
+    exam_focus: str = "comprehensive"
+    language: str = "English"
 
 class BatchRequest(BaseModel):
     requests: List[Dict[str, Any]]
+    max_parallel: Optional[int] = Field(default=None, ge=1, le=64)
+
+# Batch item "type" -> (request model used to validate params, GeminiService method)
+BATCH_HANDLERS = {
+    "quiz": (QuizRequest, "generate_quiz"),
+    "chat": (ChatRequest, "chat_with_tutor"),
+    "explanation": (ExplanationRequest, "generate_explanation"),
+    "grading": (GradeRequest, "grade_submission"),
+    "lesson_plan": (LessonPlanRequest, "generate_lesson_plan"),
+    "assignment": (AssignmentRequest, "generate_assignment"),
+    "assignment_grading": (AssignmentGradeRequest, "grade_assignment"),
+    "performance": (PerformanceAnalysisRequest, "analyze_performance"),
+    "learning_path": (LearningPathRequest, "generate_learning_path"),
+    "flashcards": (FlashcardRequest, "generate_flashcards"),
+    "study_guide": (StudyGuideRequest, "generate_study_guide"),
+}
 
 # ==============================================================================
 # API ENDPOINTS
@@ -733,37 +1931,153 @@ async def root():
     }
 
 @app.get("/health")
-async def health_check():
+async def health_check(request: Request):
     api_key = os.getenv("GEMINI_API_KEY")
+    pool = getattr(request.app.state, "gemini_pool", None)
+    service = getattr(request.app.state, "gemini_service", None)
+    resilience = service.resilience.stats() if service and service.resilience else None
+    breakers = resilience["breakers"] if resilience else {}
+    degraded = any(b["state"] != "closed" for b in breakers.values())
     return {
-        "status": "healthy", 
+        "status": "degraded" if degraded else "healthy", 
         "service": "Gemini AI API",
         "api_key_configured": bool(api_key),
+        "backend": os.getenv("GEMINI_BACKEND", "genai"),
+        "client_pool": pool.stats() if pool else None,
+        "model_concurrency": service.concurrency_stats() if service else None,
+        "circuit_breakers": breakers,
+        "retries": resilience["retries"] if resilience else 0,
         "timestamp": datetime.now().isoformat()
     }
 
+@app.get("/ready")
+async def readiness_check(request: Request):
+    """Readiness for load balancers: 503 until startup and warmup finish, and while draining"""
+    service = getattr(request.app.state, "gemini_service", None)
+    checks = {
+        "service_initialized": service is not None,
+        "warmed_up": bool(getattr(request.app.state, "ready", False)),
+        "accepting_traffic": not DRAINING.is_set(),
+    }
+    ready = all(checks.values())
+    body = {
+        "ready": ready,
+        "checks": checks,
+        "in_flight_gemini_calls": service.in_flight() if service else 0,
+        "warmup": getattr(request.app.state, "warmup", None),
+    }
+    return JSONResponse(status_code=200 if ready else 503, content=body)
+
+@app.get("/api/cache/stats")
+async def cache_stats(request: Request):
+    """Response cache hit/miss/eviction counters"""
+    cache = getattr(request.app.state, "response_cache", None)
+    if cache is None:
+        return {"enabled": False}
+    return {"enabled": True, **cache.stats()}
+
+@app.post("/api/cache/clear")
+async def clear_cache(request: Request):
+    """Drop every cached generator response"""
+    cache = getattr(request.app.state, "response_cache", None)
+    if cache is not None:
+        cache.clear()
+    return {"cleared": cache is not None}
+
+@app.get("/api/coalescing/stats")
+async def coalescing_stats(gemini: GeminiService = Depends(get_gemini_service)):
+    """How many identical in-flight requests were served by a shared upstream call"""
+    if gemini.single_flight is None:
+        return {"enabled": False}
+    return {"enabled": True, **gemini.single_flight.stats()}
+
+@app.get("/api/rate-limits/stats")
+async def rate_limit_stats(gemini: GeminiService = Depends(get_gemini_service)):
+    """Per-model RPM/TPM bucket levels, queue depth and rejections"""
+    if gemini.admission is None:
+        return {"enabled": False}
+    return {"enabled": True, **gemini.admission.stats()}
+
+@app.get("/api/curriculum/graph/stats")
+async def topic_graph_stats(gemini: GeminiService = Depends(get_gemini_service)):
+    """Topics and prerequisites in the graph, and how often learning paths came from the memo"""
+    if gemini.topic_graph is None:
+        return {"enabled": False}
+    return {"enabled": True, **gemini.topic_graph.stats()}
+
+@app.get("/api/question-bank/stats")
+async def question_bank_stats(gemini: GeminiService = Depends(get_gemini_service)):
+    """Banked questions and topics, and how often quizzes were served from the bank"""
+    if gemini.question_bank is None:
+        return {"enabled": False}
+    return {"enabled": True, **gemini.question_bank.stats()}
+
+@app.get("/api/prompts/stats")
+async def prompt_stats():
+    """Compiled prompt templates with their version hashes, sizes and render counts"""
+    return PROMPTS.stats()
+
+@app.get("/api/structured-output/stats")
+async def structured_output_stats(gemini: GeminiService = Depends(get_gemini_service)):
+    """Per-method counts of valid, repaired, re-asked and failed JSON replies"""
+    return {"schema_constrained": gemini.structured_output, **gemini.structured_stats.stats()}
+
+@app.get("/api/micro-batch/stats")
+async def micro_batch_stats(gemini: GeminiService = Depends(get_gemini_service)):
+    """Packed batches, average batch size, demultiplexing failures and single-call fallbacks"""
+    if gemini.micro_batcher is None:
+        return {"enabled": False}
+    return {"enabled": True, **gemini.micro_batcher.stats()}
+
+@app.get("/api/routing/stats")
+async def routing_stats(gemini: GeminiService = Depends(get_gemini_service)):
+    """Routing rules plus calls, escalations, latency, tokens and estimated cost per (task, model)"""
+    return gemini.router.stats()
+
+@app.get("/metrics", include_in_schema=False)
+async def metrics():
+    """Prometheus exposition of request phases, Gemini latency, tokens, cache lookups and prompt versions"""
+    for name, template in PROMPTS.stats().items():
+        PROMPT_TEMPLATE_INFO.set(1, task=name, version=template["version"])
+    return PlainTextResponse(METRICS.render(), media_type="text/plain; version=0.0.4")
+
+@app.get("/api/pool/stats")
+async def pool_stats(request: Request):
+    """Gemini client pool usage, for sizing GEMINI_POOL_SIZE"""
+    pool = getattr(request.app.state, "gemini_pool", None)
+    if pool is None:
+        raise HTTPException(status_code=503, detail="Gemini client pool is not initialized")
+    return pool.stats()
+
 # ==============================================================================
 # QUIZ ENDPOINTS
 # ==============================================================================
 
 @app.post("/api/quiz/generate")
-async def generate_quiz(request: QuizRequest, gemini: GeminiService = Depends(get_gemini_service)):
+async def generate_quiz(
+    request: QuizRequest,
+    gemini: GeminiService = Depends(get_gemini_service),
+    cache_control: Optional[str] = Header(default=None)
+):
     """Generate comprehensive quizzes using real Gemini API"""
-    print(f"🚀 Received quiz generation request: {request.topic}, {request.num_questions} questions")
+    logger.info("Received quiz generation request", extra={"topic": request.topic, "questions": request.num_questions})
     
     try:
-        result = gemini.generate_quiz(
+        result = await gemini.generate_quiz(
             topic=request.topic,
             num_questions=request.num_questions,
             question_type=request.question_type,
             difficulty=request.difficulty,
             grade_level=request.grade_level,
-            language=request.language
+            language=request.language,
+            cache_control=cache_control
         )
-        print(f"✅ Successfully generated quiz with {len(result.get('quiz', []))} questions")
+        logger.info("Generated quiz", extra={"questions": len(result.get("quiz", []))})
         return result
+    except QuotaExceeded:
+        raise
     except Exception as e:
-        print(f"❌ Quiz generation failed: {e}")
+        logger.exception("Quiz generation failed")
         raise HTTPException(
             status_code=500, 
             detail=f"Quiz generation failed: {str(e)}"
@@ -776,41 +2090,84 @@ async def generate_quiz(request: QuizRequest, gemini: GeminiService = Depends(ge
 @app.post("/api/tutor/chat")
 async def chat_with_tutor(request: ChatRequest, gemini: GeminiService = Depends(get_gemini_service)):
     """Interactive chat with AI tutor using real Gemini"""
-    print(f"🚀 Received chat request: {request.subject}, message: {request.message[:50]}...")
+    logger.info("Received chat request", extra={"subject": request.subject})
     
     try:
-        result = gemini.chat_with_tutor(
+        result = await gemini.chat_with_tutor(
             session_id=request.session_id,
             message=request.message,
             subject=request.subject,
             tone=request.tone,
             language=request.language
         )
-        print(f"✅ Successfully generated chat response")
+        logger.info("Generated chat response")
         return result
+    except QuotaExceeded:
+        raise
     except Exception as e:
-        print(f"❌ Chat failed: {e}")
+        logger.exception("Chat failed")
         raise HTTPException(
             status_code=500, 
             detail=f"Chat failed: {str(e)}"
         )
 
+class TutorSessionRequest(BaseModel):
+    context: Dict[str, Any] = {}
+
+@app.post("/api/tutor/session/{session_id}")
+async def start_tutor_session(session_id: str, request: TutorSessionRequest, gemini: GeminiService = Depends(get_gemini_service)):
+    """Start (or restart) a tutor session with optional context such as subject and level"""
+    if gemini.tutor_sessions is None:
+        return {"session_id": session_id, "stateful": False}
+    gemini.tutor_sessions.reset(session_id)
+    session = gemini.tutor_sessions.get(session_id)
+    session.context = request.context
+    return {"session_id": session_id, "stateful": True, "context": session.context}
+
+@app.get("/api/tutor/session/{session_id}")
+async def get_tutor_session(session_id: str, gemini: GeminiService = Depends(get_gemini_service)):
+    """Return the remembered turns and digest of a tutor session"""
+    session = gemini.tutor_sessions.peek(session_id) if gemini.tutor_sessions else None
+    if session is None:
+        raise HTTPException(status_code=404, detail="Tutor session not found or expired")
+    return gemini.tutor_sessions.snapshot(session)
+
+@app.delete("/api/tutor/session/{session_id}")
+async def end_tutor_session(session_id: str, gemini: GeminiService = Depends(get_gemini_service)):
+    """Forget a tutor session"""
+    removed = gemini.tutor_sessions.reset(session_id) if gemini.tutor_sessions else False
+    return {"session_id": session_id, "removed": removed}
+
+@app.get("/api/tutor/sessions/stats")
+async def tutor_session_stats(gemini: GeminiService = Depends(get_gemini_service)):
+    """Session store size and eviction/compaction counters"""
+    if gemini.tutor_sessions is None:
+        return {"enabled": False}
+    return {"enabled": True, **gemini.tutor_sessions.stats()}
+
 # ==============================================================================
 # LEARNING ENDPOINTS
 # ==============================================================================
 
 @app.post("/api/learning/explanation")
-async def generate_explanation(request: ExplanationRequest, gemini: GeminiService = Depends(get_gemini_service)):
+async def generate_explanation(
+    request: ExplanationRequest,
+    gemini: GeminiService = Depends(get_gemini_service),
+    cache_control: Optional[str] = Header(default=None)
+):
     """Generate educational explanations"""
     try:
-        result = gemini.generate_explanation(
+        result = await gemini.generate_explanation(
             topic=request.topic,
             grade_level=request.grade_level,
             language=request.language,
             style=request.style,
-            previous_knowledge=request.previous_knowledge
+            previous_knowledge=request.previous_knowledge,
+            cache_control=cache_control
         )
         return result
+    except QuotaExceeded:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Explanation generation failed: {str(e)}")
 
@@ -818,7 +2175,7 @@ async def generate_explanation(request: ExplanationRequest, gemini: GeminiServic
 async def grade_submission(request: GradeRequest, gemini: GeminiService = Depends(get_gemini_service)):
     """Grade student submissions with AI feedback"""
     try:
-        result = gemini.grade_submission(
+        result = await gemini.grade_submission(
             question=request.question,
             rubric=request.rubric,
             student_answer=request.student_answer,
@@ -828,6 +2185,8 @@ async def grade_submission(request: GradeRequest, gemini: GeminiService = Depend
             encourage_specificity=request.encourage_specificity
         )
         return result
+    except QuotaExceeded:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Grading failed: {str(e)}")
 
@@ -836,17 +2195,24 @@ async def grade_submission(request: GradeRequest, gemini: GeminiService = Depend
 # ==============================================================================
 
 @app.post("/api/teacher/lesson-plan")
-async def generate_lesson_plan(request: LessonPlanRequest, gemini: GeminiService = Depends(get_gemini_service)):
+async def generate_lesson_plan(
+    request: LessonPlanRequest,
+    gemini: GeminiService = Depends(get_gemini_service),
+    cache_control: Optional[str] = Header(default=None)
+):
     """Generate comprehensive lesson plans"""
     try:
-        result = gemini.generate_lesson_plan(
+        result = await gemini.generate_lesson_plan(
             topic=request.topic,
             grade_level=request.grade_level,
             duration_minutes=request.duration_minutes,
             learning_objectives=request.learning_objectives,
-            language=request.language
+            language=request.language,
+            cache_control=cache_control
         )
         return result
+    except QuotaExceeded:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Lesson plan generation failed: {str(e)}")
 
@@ -860,20 +2226,22 @@ async def generate_assignment_endpoint(
     gemini: GeminiService = Depends(get_gemini_service)
 ):
     """Generate AI-powered assignment"""
-    print(f"🚀 Received assignment generation request: {request.topic}")
+    logger.info("Received assignment generation request", extra={"topic": request.topic})
     
     try:
-        result = gemini.generate_assignment(
+        result = await gemini.generate_assignment(
             topic=request.topic,
             grade_level=request.grade_level,
             subject=request.subject,
             num_questions=request.num_questions,
             language=request.language
         )
-        print(f"✅ Assignment generated successfully")
+        logger.info("Assignment generated")
         return result
+    except QuotaExceeded:
+        raise
     except Exception as e:
-        print(f"❌ Assignment generation failed: {e}")
+        logger.exception("Assignment generation failed")
         raise HTTPException(status_code=500, detail=f"Assignment generation failed: {str(e)}")
 
 @app.post("/api/assignments/grade")
@@ -882,18 +2250,21 @@ async def grade_assignment_endpoint(
     gemini: GeminiService = Depends(get_gemini_service)
 ):
     """Grade student assignment submissions"""
-    print(f"📊 Received assignment grading request")
+    logger.info("Received assignment grading request")
     
     try:
-        result = gemini.grade_assignment(
+        result = await gemini.grade_assignment(
             assignment_data=request.assignment_data,
             student_answers=request.student_answers,
-            language=request.language
+            language=request.language,
+            grading_mode=request.grading_mode
         )
-        print(f"✅ Assignment graded successfully")
+        logger.info("Assignment graded")
         return result
+    except QuotaExceeded:
+        raise
     except Exception as e:
-        print(f"❌ Assignment grading failed: {e}")
+        logger.exception("Assignment grading failed")
         raise HTTPException(status_code=500, detail=f"Assignment grading failed: {str(e)}")
 
 # ==============================================================================
@@ -904,28 +2275,42 @@ async def grade_assignment_endpoint(
 async def analyze_performance(request: PerformanceAnalysisRequest, gemini: GeminiService = Depends(get_gemini_service)):
     """Generate performance analytics and insights"""
     try:
-        result = gemini.analyze_performance(
-            student_data=request.student_data,
-            recent_scores=request.recent_scores,
-            completed_topics=request.completed_topics,
-            language=request.language
-        )
+        result = await gemini.analyze_performance(**request.model_dump())
         return result
+    except QuotaExceeded:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Performance analysis failed: {str(e)}")
 
+@app.post("/api/analytics/cohort")
+async def analyze_cohort_performance(request: CohortAnalyticsRequest):
+    """Performance metrics for a whole class in one pass, without any model calls"""
+    try:
+        return await asyncio.to_thread(
+            analyze_cohort, [student.model_dump() for student in request.students], request.max_score, request.window
+        )
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Cohort analysis failed: {str(e)}")
+
+@app.post("/api/curriculum/graph")
+async def import_curriculum(request: CurriculumImportRequest, gemini: GeminiService = Depends(get_gemini_service)):
+    """Import curriculum topics with their prerequisites and estimated hours into the topic graph"""
+    if gemini.topic_graph is None:
+        raise HTTPException(status_code=503, detail="Topic graph is disabled")
+    try:
+        added = await asyncio.to_thread(gemini.topic_graph.add_topics, [t.model_dump() for t in request.topics])
+    except CycleError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"prerequisites_added": added, **gemini.topic_graph.stats()}
+
 @app.post("/api/analytics/learning-path")
 async def generate_learning_path(request: LearningPathRequest, gemini: GeminiService = Depends(get_gemini_service)):
     """Generate personalized learning paths"""
     try:
-        result = gemini.generate_learning_path(
-            current_level=request.current_level,
-            target_goals=request.target_goals,
-            preferred_learning_style=request.preferred_learning_style,
-            available_topics=request.available_topics,
-            language=request.language
-        )
+        result = await gemini.generate_learning_path(**request.model_dump())
         return result
+    except QuotaExceeded:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Learning path generation failed: {str(e)}")
 
@@ -938,37 +2323,326 @@ async def generate_flashcards(
     topic: str,
     num_cards: int = 10,
     language: str = "English",
+    student_id: Optional[str] = None,
     gemini: GeminiService = Depends(get_gemini_service)
 ):
-    """Generate study flashcards"""
+    """Generate study flashcards, saved to the student's deck when a student_id is given"""
     try:
-        result = gemini.generate_flashcards(
+        result = await gemini.generate_flashcards(
             topic=topic,
             num_cards=num_cards,
             language=language
         )
+        if student_id and gemini.flashcard_store is not None and "error" not in result:
+            result["flashcards"] = await gemini.save_flashcards(student_id, topic, result["flashcards"])
+            result["deck"] = topic
         return result
+    except QuotaExceeded:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Flashcard generation failed: {str(e)}")
 
+@app.get("/api/study/flashcards/due")
+async def due_flashcards(
+    student_id: str,
+    topic: Optional[str] = None,
+    limit: int = 20,
+    language: str = "English",
+    gemini: GeminiService = Depends(get_gemini_service)
+):
+    """Next cards due for review, generating new ones only when the topic's deck has fewer than ``limit`` cards"""
+    if gemini.flashcard_store is None:
+        raise HTTPException(status_code=503, detail="Flashcard store is disabled")
+    try:
+        return await gemini.due_flashcards(student_id, topic, max(1, min(limit, 200)), language)
+    except QuotaExceeded:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Loading due flashcards failed: {str(e)}")
+
+@app.post("/api/study/flashcards/review")
+async def review_flashcard(request: FlashcardReviewRequest, gemini: GeminiService = Depends(get_gemini_service)):
+    """Record a 0-5 review grade and schedule the card's next review"""
+    if gemini.flashcard_store is None:
+        raise HTTPException(status_code=503, detail="Flashcard store is disabled")
+    result = await asyncio.to_thread(gemini.flashcard_store.review, request.student_id, request.card_id, request.grade)
+    if result is None:
+        raise HTTPException(status_code=404, detail="Card not found")
+    return result
+
+@app.get("/api/study/flashcards/stats")
+async def flashcard_store_stats(gemini: GeminiService = Depends(get_gemini_service)):
+    """Stored cards, decks, cards due now and review counts"""
+    if gemini.flashcard_store is None:
+        return {"enabled": False}
+    return {"enabled": True, **gemini.flashcard_store.stats()}
+
 @app.post("/api/study/guide")
 async def generate_study_guide(
     topics: List[str],
     exam_focus: str = "comprehensive",
     language: str = "English",
-    gemini: GeminiService = Depends(get_gemini_service)
+    gemini: GeminiService = Depends(get_gemini_service),
+    cache_control: Optional[str] = Header(default=None)
 ):
     """Generate comprehensive study guides"""
     try:
-        result = gemini.generate_study_guide(
+        result = await gemini.generate_study_guide(
             topics=topics,
             exam_focus=exam_focus,
-            language=language
+            language=language,
+            cache_control=cache_control
         )
         return result
+    except QuotaExceeded:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Study guide generation failed: {str(e)}")
 
+# ==============================================================================
+# STREAMING ENDPOINTS (Server-Sent Events / NDJSON)
+# ==============================================================================
+
+def sse_event(event: str, data: Dict[str, Any]) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+def sse_response(request: Request, chunks, done: Dict[str, Any], fallback_text: str) -> StreamingResponse:
+    """Forward text chunks as SSE "token" events, ending with "done" or "error".
+
+    If the client disconnects, the upstream Gemini stream is closed so the
+    model slot is released immediately.
+    """
+    async def event_stream():
+        received = 0
+        try:
+            async for text in chunks:
+                if await request.is_disconnected():
+                    logger.info("Client disconnected, cancelling Gemini stream")
+                    return
+                received += len(text)
+                yield sse_event("token", {"text": text})
+            yield sse_event("done", {**done, "characters": received, "timestamp": datetime.now().isoformat()})
+        except asyncio.CancelledError:
+            logger.info("Stream cancelled, closing Gemini stream")
+            raise
+        except QuotaExceeded as e:
+            yield sse_event("error", {"detail": "AI service is at capacity. Please retry shortly.", "retry_after": e.retry_after})
+        except Exception as e:
+            logger.error("Gemini stream failed: %s", e)
+            if received == 0:
+                yield sse_event("token", {"text": fallback_text, "fallback": True})
+            yield sse_event("error", {"detail": "AI service temporarily unavailable", "fallback": received == 0})
+        finally:
+            await chunks.aclose()
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+def ndjson_response(request: Request, items, item_type: str, done: Dict[str, Any]) -> StreamingResponse:
+    """Stream parsed objects as newline-delimited JSON, one line per item"""
+    async def line_stream():
+        count = 0
+        try:
+            async for item in items:
+                if await request.is_disconnected():
+                    logger.info("Client disconnected, cancelling Gemini stream")
+                    return
+                count += 1
+                yield json.dumps({"type": item_type, "index": count - 1, item_type: item}, ensure_ascii=False) + "\n"
+            yield json.dumps({"type": "done", "count": count, **done}, ensure_ascii=False) + "\n"
+        finally:
+            await items.aclose()
+
+    return StreamingResponse(
+        line_stream(),
+        media_type="application/x-ndjson",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@app.post("/api/quiz/generate/stream")
+async def generate_quiz_stream(request: QuizRequest, http_request: Request, gemini: GeminiService = Depends(get_gemini_service)):
+    """Stream quiz questions as NDJSON, each line sent as soon as the question is complete"""
+    items = gemini.stream_quiz(
+        topic=request.topic,
+        num_questions=request.num_questions,
+        question_type=request.question_type,
+        difficulty=request.difficulty,
+        grade_level=request.grade_level,
+        language=request.language
+    )
+    return ndjson_response(http_request, items, "question", done={"topic": request.topic})
+
+@app.post("/api/assignments/generate/stream")
+async def generate_assignment_stream(request: AssignmentRequest, http_request: Request, gemini: GeminiService = Depends(get_gemini_service)):
+    """Stream assignment questions as NDJSON; the done line carries the assignment header"""
+    items = gemini.stream_assignment(
+        topic=request.topic,
+        grade_level=request.grade_level,
+        subject=request.subject,
+        num_questions=request.num_questions,
+        language=request.language
+    )
+    return ndjson_response(
+        http_request,
+        items,
+        "question",
+        done={
+            "title": f"Assignment: {request.topic}",
+            "topic": request.topic,
+            "grade_level": request.grade_level,
+            "subject": request.subject
+        }
+    )
+
+@app.post("/api/tutor/chat/stream")
+async def chat_with_tutor_stream(request: ChatRequest, http_request: Request, gemini: GeminiService = Depends(get_gemini_service)):
+    """Stream the tutor reply token by token"""
+    chunks = gemini.stream_chat_with_tutor(
+        session_id=request.session_id,
+        message=request.message,
+        subject=request.subject,
+        tone=request.tone,
+        language=request.language
+    )
+    return sse_response(
+        http_request,
+        chunks,
+        done={"session_id": request.session_id},
+        fallback_text=f"I'd love to help you with {request.subject}! Please try your question again in a moment."
+    )
+
+@app.post("/api/learning/explanation/stream")
+async def generate_explanation_stream(request: ExplanationRequest, http_request: Request, gemini: GeminiService = Depends(get_gemini_service)):
+    """Stream an educational explanation"""
+    chunks = gemini.stream_explanation(
+        topic=request.topic,
+        grade_level=request.grade_level,
+        language=request.language,
+        style=request.style,
+        previous_knowledge=request.previous_knowledge
+    )
+    return sse_response(
+        http_request,
+        chunks,
+        done={"topic": request.topic, "grade_level": request.grade_level},
+        fallback_text=f"{request.topic} is an important concept that involves key principles and applications."
+    )
+
+@app.post("/api/teacher/lesson-plan/stream")
+async def generate_lesson_plan_stream(request: LessonPlanRequest, http_request: Request, gemini: GeminiService = Depends(get_gemini_service)):
+    """Stream a lesson plan as it is generated"""
+    chunks = gemini.stream_lesson_plan(
+        topic=request.topic,
+        grade_level=request.grade_level,
+        duration_minutes=request.duration_minutes,
+        learning_objectives=request.learning_objectives,
+        language=request.language
+    )
+    return sse_response(
+        http_request,
+        chunks,
+        done={"topic": request.topic, "duration": request.duration_minutes, "grade_level": request.grade_level},
+        fallback_text=f"A {request.duration_minutes}-minute structured lesson on {request.topic} for {request.grade_level}."
+    )
+
+@app.post("/api/study/guide/stream")
+async def generate_study_guide_stream(request: StudyGuideRequest, http_request: Request, gemini: GeminiService = Depends(get_gemini_service)):
+    """Stream a study guide as it is generated"""
+    chunks = gemini.stream_study_guide(
+        topics=request.topics,
+        exam_focus=request.exam_focus,
+        language=request.language
+    )
+    return sse_response(
+        http_request,
+        chunks,
+        done={"topics": request.topics, "exam_focus": request.exam_focus},
+        fallback_text=f"Study guide for {', '.join(request.topics)} focusing on {request.exam_focus}."
+    )
+
+# ==============================================================================
+# BULK GRADING JOBS
+# ==============================================================================
+
+def get_grading_jobs(request: Request, gemini: GeminiService = Depends(get_gemini_service)) -> GradingJobManager:
+    return request.app.state.grading_jobs
+
+@app.post("/api/assignments/grade/jobs", status_code=202)
+async def create_grading_job(
+    request: GradingJobRequest,
+    jobs: GradingJobManager = Depends(get_grading_jobs)
+):
+    """Queue a whole class for grading and return the job id immediately"""
+    student_ids = [s.student_id for s in request.submissions]
+    if len(set(student_ids)) != len(student_ids):
+        raise HTTPException(status_code=422, detail="student_id values must be unique within a job")
+
+    job_id = await jobs.submit(
+        request.assignment_data,
+        [s.model_dump() for s in request.submissions],
+        request.language,
+        request.grading_mode
+    )
+    logger.info("Queued grading job", extra={"job_id": job_id, "students": len(student_ids)})
+    return {
+        "job_id": job_id,
+        "status": "pending",
+        "total": len(student_ids),
+        "status_url": f"/api/assignments/grade/jobs/{job_id}",
+        "stream_url": f"/api/assignments/grade/jobs/{job_id}/stream"
+    }
+
+@app.get("/api/assignments/grade/jobs/{job_id}")
+async def get_grading_job(
+    job_id: str,
+    include_results: bool = True,
+    jobs: GradingJobManager = Depends(get_grading_jobs)
+):
+    """Poll a grading job's progress and the results graded so far"""
+    status = await jobs.status(job_id, include_results=include_results)
+    if status is None:
+        raise HTTPException(status_code=404, detail="Grading job not found")
+    return status
+
+@app.get("/api/assignments/grade/jobs/{job_id}/stream")
+async def stream_grading_job(
+    job_id: str,
+    http_request: Request,
+    jobs: GradingJobManager = Depends(get_grading_jobs)
+):
+    """Stream "result" events per graded student, "progress" updates and a final "done" event"""
+    status = await jobs.status(job_id, include_results=False)
+    if status is None:
+        raise HTTPException(status_code=404, detail="Grading job not found")
+
+    async def event_stream():
+        since = 0.0
+        sent = set()
+        while True:
+            for result in await asyncio.to_thread(jobs.store.results, job_id, since):
+                if result["student_id"] in sent:
+                    continue
+                sent.add(result["student_id"])
+                since = max(since, result["updated_at"])
+                yield sse_event("result", result)
+            current = await jobs.status(job_id, include_results=False)
+            if current["status"] not in ("pending", "running"):
+                yield sse_event("done", current)
+                return
+            yield sse_event("progress", current)
+            if await http_request.is_disconnected():
+                return
+            await jobs.wait_for_change(job_id, timeout=15.0)
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 # ==============================================================================
 # BATCH PROCESSING ENDPOINT
 # ==============================================================================
@@ -978,10 +2652,19 @@ async def process_batch_requests(
     request: BatchRequest,
     gemini: GeminiService = Depends(get_gemini_service)
 ):
-    """Process multiple AI requests in batch"""
+    """Process multiple AI requests in batch
+
+    Each item is {"type": "quiz", "params": {...}} (or the params inline next
+    to "type"), using the same fields as the matching single endpoint.
+    """
     try:
-        results = gemini.process_batch_requests(request.requests)
-        return {"results": results}
+        results = await gemini.process_batch_requests(request.requests, request.max_parallel)
+        failed = sum(1 for r in results if r["status"] == "error")
+        return {
+            "results": results,
+            "succeeded": len(results) - failed,
+            "failed": failed
+        }
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Batch processing failed: {str(e)}")
 
@@ -990,11 +2673,5 @@ async def process_batch_requests(
 # ==============================================================================
 
 if __name__ == "__main__":
-    print("🚀 Starting FastAPI server with NEW Gemini SDK...")
-    uvicorn.run(
-        "gemini_service:app",
-        host="0.0.0.0",
-        port=8000,
-        reload=True,
-        log_level="info"
-    )
\ No newline at end of file
+    # SERVER_MODE=production runs WEB_CONCURRENCY workers without reload; see server.py
+    run_server("gemini_service:app")
\ No newline at end of file
@@ -0,0 +1,334 @@
+"""
+Durable bulk grading jobs for whole class rosters
+
+A job is one assignment plus N student submissions. It is written to SQLite
+before the API returns, each student's result is persisted as soon as it is
+graded, and on startup every unfinished job is resumed from the students
+that are still pending, so a restart never regrades finished students.
+A student who only gets placeholder scores because Gemini is unavailable
+is retried and then recorded as failed, never as done. In per-question
+mode only the placeholder questions are regraded, and a student who still
+has some after the last attempt is recorded as failed with the real grades
+kept. A worker slot is held for one grading attempt, never for a backoff.
+"""
+
+import asyncio
+import json
+import logging
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from rate_limiter import QuotaExceeded
+
+GradeFn = Callable[[Dict[str, Any], Dict[str, str], str, Optional[str]], Awaitable[Dict[str, Any]]]
+
+logger = logging.getLogger("grading_jobs")
+
+
+def question_grade_report(question_grades: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Per-question grading result: overall score, feedback, strengths and improvements"""
+    earned = sum(g["score"] for g in question_grades)
+    possible = sum(g["max_score"] for g in question_grades)
+    overall = round(100 * earned / possible) if possible else 0
+
+    strengths = [f"Strong answer on question {g['question_id']}" for g in question_grades
+                 if g["max_score"] and g["score"] / g["max_score"] >= 0.8 and not g.get("fallback")]
+    improvements = [f"Question {g['question_id']}: {g['feedback']}" for g in question_grades
+                    if g["max_score"] and g["score"] / g["max_score"] < 0.6]
+
+    fallback_questions = sum(1 for g in question_grades if g.get("fallback"))
+    result = {
+        "overall_score": overall,
+        "feedback": f"You earned {earned:g} of {possible:g} points across {len(question_grades)} questions.",
+        "question_grades": question_grades,
+        "strengths": strengths[:5] or ["Completed the assignment"],
+        "improvements": improvements[:5] or ["Keep practicing to deepen your understanding"],
+        "grading_mode": "per_question",
+        "fallback_questions": fallback_questions
+    }
+    if fallback_questions:
+        # Some scores are placeholders, not real grades
+        result["fallback"] = True
+    return result
+
+
+def _is_partial(result: Optional[Dict[str, Any]]) -> bool:
+    return bool(result) and result.get("grading_mode") == "per_question"
+
+
+def _placeholder_questions(assignment: Dict[str, Any], result: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    """The assignment limited to the questions ``result`` only has placeholder scores for"""
+    if not _is_partial(result):
+        return assignment
+    pending = {str(g["question_id"]) for g in result["question_grades"] if g.get("fallback")}
+    # Ids default to the position, so pin them before dropping questions
+    questions = [{**q, "id": q.get("id", position + 1)} for position, q in enumerate(assignment.get("questions", []))]
+    return {**assignment, "questions": [q for q in questions if str(q["id"]) in pending]}
+
+
+def _merge_regraded(result: Optional[Dict[str, Any]], regraded: Dict[str, Any]) -> Dict[str, Any]:
+    if not _is_partial(result) or not _is_partial(regraded):
+        return regraded
+    grades = {str(g["question_id"]): g for g in regraded["question_grades"]}
+    return question_grade_report([grades.get(str(g["question_id"]), g) for g in result["question_grades"]])
+
+
+class GradingJobStore:
+    """SQLite persistence for jobs and per-student progress"""
+
+    def __init__(self, path: str = "grading_jobs.sqlite3"):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS grading_jobs (
+                job_id TEXT PRIMARY KEY,
+                status TEXT NOT NULL,
+                assignment TEXT NOT NULL,
+                language TEXT NOT NULL,
+                grading_mode TEXT,
+                total INTEGER NOT NULL,
+                created_at REAL NOT NULL,
+                updated_at REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS grading_submissions (
+                job_id TEXT NOT NULL,
+                position INTEGER NOT NULL,
+                student_id TEXT NOT NULL,
+                answers TEXT NOT NULL,
+                status TEXT NOT NULL,
+                result TEXT,
+                error TEXT,
+                updated_at REAL NOT NULL,
+                PRIMARY KEY (job_id, student_id)
+            );
+            CREATE INDEX IF NOT EXISTS grading_submissions_status ON grading_submissions (job_id, status);
+            """
+        )
+
+    def create_job(self, assignment: Dict[str, Any], submissions: List[Dict[str, Any]],
+                   language: str, grading_mode: Optional[str]) -> str:
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN")
+            self._conn.execute(
+                "INSERT INTO grading_jobs VALUES (?, 'pending', ?, ?, ?, ?, ?, ?)",
+                (job_id, json.dumps(assignment), language, grading_mode, len(submissions), now, now),
+            )
+            self._conn.executemany(
+                "INSERT INTO grading_submissions VALUES (?, ?, ?, ?, 'pending', NULL, NULL, ?)",
+                [
+                    (job_id, position, str(s["student_id"]), json.dumps(s["student_answers"]), now)
+                    for position, s in enumerate(submissions)
+                ],
+            )
+            self._conn.execute("COMMIT")
+        return job_id
+
+    def get_job(self, job_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM grading_jobs WHERE job_id = ?", (job_id,)).fetchone()
+        if row is None:
+            return None
+        job = dict(row)
+        job["assignment"] = json.loads(job["assignment"])
+        return job
+
+    def pending_submissions(self, job_id: str) -> List[Dict[str, Any]]:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT student_id, answers FROM grading_submissions"
+                " WHERE job_id = ? AND status = 'pending' ORDER BY position",
+                (job_id,),
+            ).fetchall()
+        return [{"student_id": r["student_id"], "student_answers": json.loads(r["answers"])} for r in rows]
+
+    def record_result(self, job_id: str, student_id: str, result: Optional[Dict[str, Any]],
+                      error: Optional[str] = None) -> None:
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "UPDATE grading_submissions SET status = ?, result = ?, error = ?, updated_at = ?"
+                " WHERE job_id = ? AND student_id = ?",
+                ("failed" if error else "done", json.dumps(result) if result is not None else None,
+                 error, now, job_id, student_id),
+            )
+            self._conn.execute("UPDATE grading_jobs SET updated_at = ? WHERE job_id = ?", (now, job_id))
+
+    def set_status(self, job_id: str, status: str) -> None:
+        with self._lock:
+            self._conn.execute(
+                "UPDATE grading_jobs SET status = ?, updated_at = ? WHERE job_id = ?",
+                (status, time.time(), job_id),
+            )
+
+    def unfinished_jobs(self) -> List[str]:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT job_id FROM grading_jobs WHERE status IN ('pending', 'running') ORDER BY created_at"
+            ).fetchall()
+        return [r["job_id"] for r in rows]
+
+    def progress(self, job_id: str) -> Dict[str, int]:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT status, COUNT(*) AS n FROM grading_submissions WHERE job_id = ? GROUP BY status",
+                (job_id,),
+            ).fetchall()
+        counts = {"pending": 0, "done": 0, "failed": 0}
+        counts.update({r["status"]: r["n"] for r in rows})
+        return counts
+
+    def results(self, job_id: str, since: float = 0.0) -> List[Dict[str, Any]]:
+        """Finished submissions, optionally only those updated at or after ``since``"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT student_id, status, result, error, updated_at FROM grading_submissions"
+                " WHERE job_id = ? AND status != 'pending' AND updated_at >= ? ORDER BY position",
+                (job_id, since),
+            ).fetchall()
+        return [
+            {
+                "student_id": r["student_id"],
+                "status": r["status"],
+                "result": json.loads(r["result"]) if r["result"] else None,
+                "error": r["error"],
+                "updated_at": r["updated_at"],
+            }
+            for r in rows
+        ]
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+class GradingJobManager:
+    """Runs grading jobs over a shared pool of worker slots"""
+
+    def __init__(self, store: GradingJobStore, grade_fn: GradeFn, workers: int = 4, max_attempts: int = 3):
+        self.store = store
+        self.grade_fn = grade_fn
+        self.max_attempts = max(1, max_attempts)
+        self._slots = asyncio.Semaphore(max(1, workers))
+        self.workers = max(1, workers)
+        self._tasks: Dict[str, asyncio.Task] = {}
+        self._changed: Dict[str, asyncio.Event] = {}
+
+    async def submit(self, assignment: Dict[str, Any], submissions: List[Dict[str, Any]],
+                     language: str, grading_mode: Optional[str]) -> str:
+        job_id = await asyncio.to_thread(self.store.create_job, assignment, submissions, language, grading_mode)
+        self._start(job_id)
+        return job_id
+
+    async def resume_unfinished(self) -> List[str]:
+        """Restart jobs interrupted by a shutdown; finished students are skipped"""
+        job_ids = await asyncio.to_thread(self.store.unfinished_jobs)
+        for job_id in job_ids:
+            logger.info("Resuming grading job", extra={"job_id": job_id})
+            self._start(job_id)
+        return job_ids
+
+    def _start(self, job_id: str) -> None:
+        task = asyncio.ensure_future(self._run(job_id))
+        self._tasks[job_id] = task
+        task.add_done_callback(lambda _: self._tasks.pop(job_id, None))
+
+    def _notify(self, job_id: str) -> None:
+        # Wake every waiter at once; later waiters get a fresh event
+        event = self._changed.pop(job_id, None)
+        if event is not None:
+            event.set()
+
+    async def wait_for_change(self, job_id: str, timeout: float) -> None:
+        """Block until the job records progress or ``timeout`` passes"""
+        event = self._changed.setdefault(job_id, asyncio.Event())
+        try:
+            await asyncio.wait_for(event.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+    async def _run(self, job_id: str) -> None:
+        job = await asyncio.to_thread(self.store.get_job, job_id)
+        if job is None:
+            return
+        await asyncio.to_thread(self.store.set_status, job_id, "running")
+        self._notify(job_id)
+        pending = await asyncio.to_thread(self.store.pending_submissions, job_id)
+        logger.info("Grading job started", extra={"job_id": job_id, "pending": len(pending), "total": job["total"]})
+
+        await asyncio.gather(*(self._grade_student(job, submission) for submission in pending))
+
+        progress = await asyncio.to_thread(self.store.progress, job_id)
+        status = "completed" if progress["failed"] == 0 else "completed_with_errors"
+        await asyncio.to_thread(self.store.set_status, job_id, status)
+        self._notify(job_id)
+        logger.info("Grading job finished", extra={"job_id": job_id, "status": status})
+
+    async def _grade_student(self, job: Dict[str, Any], submission: Dict[str, Any]) -> None:
+        job_id = job["job_id"]
+        student_id = submission["student_id"]
+        error = None
+        result = None
+        for attempt in range(1, self.max_attempts + 1):
+            try:
+                # Only questions that got placeholder scores last time are regraded
+                async with self._slots:
+                    graded = await self.grade_fn(_placeholder_questions(job["assignment"], result),
+                                                 submission["student_answers"], job["language"], job["grading_mode"])
+                result = _merge_regraded(result, graded)
+                if not result.get("fallback"):
+                    error = None
+                    break
+                # Placeholder scores from an upstream outage must never be saved as grades
+                error = "Grading service unavailable"
+                delay = min(2.0 ** attempt, 30.0)
+            except QuotaExceeded as e:
+                # Background work can afford to wait for quota instead of failing
+                error = str(e)
+                delay = max(1.0, min(e.retry_after, 60.0))
+            except Exception as e:
+                error = str(e)
+                logger.error("Grading failed for student: %s", e, extra={"job_id": job_id, "student_id": student_id})
+                break
+            if attempt < self.max_attempts:
+                await asyncio.sleep(delay)
+        if error and not _is_partial(result):
+            # A holistic placeholder has no real grades worth keeping
+            result = None
+        await asyncio.to_thread(self.store.record_result, job_id, student_id, result, error)
+        self._notify(job_id)
+
+    async def status(self, job_id: str, include_results: bool = True) -> Optional[Dict[str, Any]]:
+        job = await asyncio.to_thread(self.store.get_job, job_id)
+        if job is None:
+            return None
+        progress = await asyncio.to_thread(self.store.progress, job_id)
+        data = {
+            "job_id": job_id,
+            "status": job["status"],
+            "total": job["total"],
+            "completed": progress["done"] + progress["failed"],
+            "failed": progress["failed"],
+            "pending": progress["pending"],
+            "created_at": job["created_at"],
+            "updated_at": job["updated_at"],
+        }
+        if include_results:
+            data["results"] = await asyncio.to_thread(self.store.results, job_id)
+        return data
+
+    async def shutdown(self) -> None:
+        """Stop workers; unfinished students stay pending and resume on the next start"""
+        tasks = list(self._tasks.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self.store.close()
@@ -0,0 +1,260 @@
+"""
+Prometheus-format metrics for the AI service
+
+A small in-process registry of counters and histograms rendered in the
+Prometheus text exposition format at ``/metrics``. MetricsMiddleware times
+every HTTP request, including streamed bodies, and splits it into phases:
+
+- parse: from arrival until the endpoint starts (body read and validation)
+- queue: time waiting for admission and a per-model concurrency slot
+- upstream: time inside Gemini calls
+- post: everything else (local processing, serialization, streaming)
+
+``prompt_template_info`` exports the version of every prompt template,
+labelled by the task it renders for, so a latency or token shift on a task
+can be joined to the prompt edit that caused it.
+
+Service code adds to the current request's phases through
+``record_phase``, which uses a context variable so nothing has to be passed
+through call signatures.
+"""
+
+import functools
+import inspect
+import math
+import time
+from contextvars import ContextVar
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+from fastapi.routing import APIRoute
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+TOKEN_BUCKETS = (16, 64, 256, 512, 1024, 2048, 4096, 8192, 16384, 32768)
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    parts = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _format_number(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1.0, **labels: str) -> None:
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        self._values[key] = self._values.get(key, 0.0) + amount
+
+    def samples(self) -> Iterable[str]:
+        for key, value in sorted(self._values.items()):
+            yield f"{self.name}{_format_labels(self.labelnames, key)} {_format_number(value)}"
+
+
+class Gauge:
+    kind = "gauge"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def set(self, value: float, **labels: str) -> None:
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        self._values[key] = value
+
+    def samples(self) -> Iterable[str]:
+        for key, value in sorted(self._values.items()):
+            yield f"{self.name}{_format_labels(self.labelnames, key)} {_format_number(value)}"
+
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+        # labels -> (per-bucket counts, sum, count)
+        self._series: Dict[Tuple[str, ...], List] = {}
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        series = self._series.get(key)
+        if series is None:
+            series = [[0] * len(self.buckets), 0.0, 0]
+            self._series[key] = series
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                series[0][i] += 1
+                break
+        series[1] += value
+        series[2] += 1
+
+    def samples(self) -> Iterable[str]:
+        for key, (counts, total, count) in sorted(self._series.items()):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                labels = _format_labels(self.labelnames, key, f'le="{_format_number(bound)}"')
+                yield f"{self.name}_bucket{labels} {cumulative}"
+            labels = _format_labels(self.labelnames, key)
+            yield f"{self.name}_sum{labels} {_format_number(total)}"
+            yield f"{self.name}_count{labels} {count}"
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics: Dict[str, object] = {}
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self._metrics.setdefault(name, Counter(name, documentation, labelnames))
+
+    def gauge(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Gauge:
+        return self._metrics.setdefault(name, Gauge(name, documentation, labelnames))
+
+    def histogram(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                  buckets: Sequence[float] = LATENCY_BUCKETS) -> Histogram:
+        return self._metrics.setdefault(name, Histogram(name, documentation, labelnames, buckets))
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics.values():
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.samples())
+        return "\n".join(lines) + "\n"
+
+
+METRICS = MetricsRegistry()
+
+HTTP_REQUESTS = METRICS.counter(
+    "http_requests_total", "HTTP requests by route, method and status", ("route", "method", "status"))
+HTTP_DURATION = METRICS.histogram(
+    "http_request_duration_seconds", "End-to-end request latency including streamed bodies", ("route", "method"))
+HTTP_PHASES = METRICS.histogram(
+    "http_request_phase_seconds", "Request latency split into parse, queue, upstream and post phases",
+    ("route", "phase"))
+GEMINI_CALLS = METRICS.counter(
+    "gemini_calls_total", "Upstream Gemini calls by task, model and outcome", ("task", "model", "outcome"))
+GEMINI_UPSTREAM = METRICS.histogram(
+    "gemini_upstream_latency_seconds", "Latency of a single upstream Gemini attempt", ("model",))
+GEMINI_QUEUE = METRICS.histogram(
+    "gemini_queue_wait_seconds", "Time waiting for admission and a per-model concurrency slot", ("model",))
+GEMINI_RETRIES = METRICS.counter(
+    "gemini_retries_total", "Upstream attempts retried after a transient error", ("model",))
+GEMINI_PROMPT_TOKENS = METRICS.counter(
+    "gemini_prompt_tokens_total", "Prompt tokens sent to Gemini", ("task", "model"))
+GEMINI_OUTPUT_TOKENS = METRICS.counter(
+    "gemini_output_tokens_total", "Output tokens received from Gemini", ("task", "model"))
+GEMINI_PROMPT_SIZE = METRICS.histogram(
+    "gemini_prompt_tokens", "Prompt tokens per call", ("task",), buckets=TOKEN_BUCKETS)
+PROMPT_TEMPLATE_INFO = METRICS.gauge(
+    "prompt_template_info", "Always 1; the version of the prompt template each task renders", ("task", "version"))
+RESPONSE_CACHE = METRICS.counter(
+    "response_cache_requests_total", "Response cache lookups by method and status (hit, miss, bypass)",
+    ("method", "status"))
+
+PHASES = ("parse", "queue", "upstream", "post")
+
+
+class RequestTimings:
+    __slots__ = ("started", "handler_started", "queue", "upstream")
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.handler_started: Optional[float] = None
+        self.queue = 0.0
+        self.upstream = 0.0
+
+
+_current_timings: ContextVar[Optional[RequestTimings]] = ContextVar("request_timings", default=None)
+
+
+def record_phase(phase: str, seconds: float) -> None:
+    """Add time spent in ``phase`` ("queue" or "upstream") to the current request"""
+    timings = _current_timings.get()
+    if timings is not None:
+        setattr(timings, phase, getattr(timings, phase) + seconds)
+
+
+def mark_handler_started() -> None:
+    timings = _current_timings.get()
+    if timings is not None and timings.handler_started is None:
+        timings.handler_started = time.perf_counter()
+
+
+class TimedRoute(APIRoute):
+    """Route class that marks when the endpoint starts, ending the parse phase"""
+
+    def __init__(self, path: str, endpoint, **kwargs):
+        if inspect.iscoroutinefunction(endpoint):
+            original = endpoint
+
+            @functools.wraps(original)
+            async def endpoint(*args, **kw):
+                mark_handler_started()
+                return await original(*args, **kw)
+
+        super().__init__(path, endpoint, **kwargs)
+
+
+class MetricsMiddleware:
+    """Pure ASGI middleware so streamed responses are timed until their last chunk"""
+
+    def __init__(self, app, skip_paths: Sequence[str] = ("/metrics",)):
+        self.app = app
+        self.skip_paths = set(skip_paths)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] in self.skip_paths:
+            await self.app(scope, receive, send)
+            return
+
+        timings = RequestTimings()
+        token = _current_timings.set(timings)
+        status = {"code": 500}
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _current_timings.reset(token)
+            self._observe(scope, timings, status["code"])
+
+    @staticmethod
+    def _observe(scope, timings: RequestTimings, status_code: int) -> None:
+        total = time.perf_counter() - timings.started
+        route = getattr(scope.get("route"), "path", None) or "unmatched"
+        method = scope.get("method", "")
+        HTTP_REQUESTS.inc(route=route, method=method, status=str(status_code))
+        HTTP_DURATION.observe(total, route=route, method=method)
+
+        parse = (timings.handler_started - timings.started) if timings.handler_started else 0.0
+        # Concurrent upstream calls can add up to more than wall time; post is the remainder
+        post = max(0.0, total - parse - timings.queue - timings.upstream)
+        for phase, seconds in zip(PHASES, (parse, timings.queue, timings.upstream, post)):
+            HTTP_PHASES.observe(seconds, route=route, phase=phase)
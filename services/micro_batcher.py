@@ -0,0 +1,136 @@
+"""
+Micro-batching of small Gemini prompts
+
+Tiny prompts (flashcards, short tutor replies, single-answer grading) each
+pay the full per-request upstream latency and one unit of RPM quota. The
+MicroBatcher holds compatible prompts for at most ``max_wait`` seconds, or
+until ``max_batch_size`` are waiting, and hands them to ``call_packed`` as
+one multi-item request. Prompts are compatible when they share a key (the
+resolved route and priority), so a batch always goes to one model.
+
+``call_packed`` returns one reply per prompt, None for a prompt it could
+not demultiplex, or None for the whole batch. Those prompts are sent
+again individually through ``call_single``, as is a batch of one.
+"""
+
+import asyncio
+import time
+from typing import Any, Awaitable, Callable, Dict, Hashable, Iterable, List, Optional, Tuple
+
+from rate_limiter import estimate_prompt_tokens
+
+DEFAULT_BATCH_TASKS = ("generate_flashcards", "chat_with_tutor", "grade_submission")
+
+PackedCall = Callable[[Hashable, List[str]], Awaitable[Optional[List[Optional[str]]]]]
+SingleCall = Callable[[Hashable, str], Awaitable[str]]
+
+
+class MicroBatcher:
+    def __init__(self, call_packed: PackedCall, call_single: SingleCall, max_batch_size: int = 8,
+                 max_wait: float = 0.01, max_item_tokens: int = 600, tasks: Iterable[str] = DEFAULT_BATCH_TASKS):
+        self.call_packed = call_packed
+        self.call_single = call_single
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max(0.0, max_wait)
+        self.max_item_tokens = max_item_tokens
+        self.tasks = frozenset(tasks)
+        # key -> [(prompt, future, time queued)]
+        self._pending: Dict[Hashable, List[Tuple[str, asyncio.Future, float]]] = {}
+        self._timers: Dict[Hashable, asyncio.TimerHandle] = {}
+        self._flushes: set = set()
+        self.items = 0
+        self.batches = 0
+        self.packed_items = 0
+        self.single_calls = 0
+        self.demux_failures = 0
+        self.wait_total = 0.0
+
+    def accepts(self, task: str, prompt: str) -> bool:
+        return task in self.tasks and estimate_prompt_tokens(prompt) <= self.max_item_tokens
+
+    async def submit(self, key: Hashable, prompt: str) -> str:
+        """Queue ``prompt`` with others sharing ``key`` and wait for its own reply"""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        batch = self._pending.setdefault(key, [])
+        batch.append((prompt, future, time.perf_counter()))
+        self.items += 1
+        if len(batch) >= self.max_batch_size:
+            self._flush(key)
+        elif key not in self._timers:
+            self._timers[key] = loop.call_later(self.max_wait, self._flush, key)
+        return await future
+
+    def _flush(self, key: Hashable) -> None:
+        timer = self._timers.pop(key, None)
+        if timer is not None:
+            timer.cancel()
+        now = time.perf_counter()
+        batch = []
+        for prompt, future, queued in self._pending.pop(key, []):
+            self.wait_total += now - queued
+            # Callers that already gave up need no reply
+            if not future.done():
+                batch.append((prompt, future))
+        if batch:
+            task = asyncio.ensure_future(self._run(key, batch))
+            self._flushes.add(task)
+            task.add_done_callback(self._flushes.discard)
+
+    async def _run(self, key: Hashable, batch: List[Tuple[str, asyncio.Future]]) -> None:
+        replies: Optional[List[Optional[str]]] = None
+        if len(batch) > 1:
+            self.batches += 1
+            try:
+                replies = await self.call_packed(key, [prompt for prompt, _ in batch])
+            except Exception:
+                # Includes a rejected packed call; each prompt still gets its own chance
+                replies = None
+            if replies is None or len(replies) != len(batch):
+                self.demux_failures += 1
+                replies = None
+        leftovers = []
+        for i, (prompt, future) in enumerate(batch):
+            reply = replies[i] if replies is not None else None
+            if reply is None:
+                leftovers.append((prompt, future))
+            elif not future.done():
+                self.packed_items += 1
+                future.set_result(reply)
+        await asyncio.gather(*(self._single(key, prompt, future) for prompt, future in leftovers))
+
+    async def _single(self, key: Hashable, prompt: str, future: asyncio.Future) -> None:
+        if future.done():
+            return
+        self.single_calls += 1
+        try:
+            reply = await self.call_single(key, prompt)
+        except Exception as e:
+            if not future.done():
+                future.set_exception(e)
+            return
+        if not future.done():
+            future.set_result(reply)
+
+    async def close(self) -> None:
+        """Send whatever is still waiting and let running batches finish"""
+        for key in list(self._pending):
+            self._flush(key)
+        if self._flushes:
+            await asyncio.gather(*list(self._flushes), return_exceptions=True)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "max_batch_size": self.max_batch_size,
+            "max_wait_ms": round(1000 * self.max_wait, 1),
+            "max_item_tokens": self.max_item_tokens,
+            "tasks": sorted(self.tasks),
+            "items": self.items,
+            "batches": self.batches,
+            "packed_items": self.packed_items,
+            "avg_batch_size": round(self.packed_items / self.batches, 2) if self.batches else 0.0,
+            "single_calls": self.single_calls,
+            "demux_failures": self.demux_failures,
+            "avg_batching_delay_ms": round(1000 * self.wait_total / self.items, 2) if self.items else 0.0,
+            "upstream_calls_saved": max(0, self.packed_items - self.batches),
+        }
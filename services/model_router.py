@@ -0,0 +1,160 @@
+"""
+Per-task model routing for Gemini calls
+
+Models are grouped into tiers (lite, standard, strong). Each task has an
+ordered list of rules; the first rule whose ``max_prompt_tokens`` fits the
+prompt picks the tier or an explicit model, so short tutor replies can go to
+the lite model while long ones and grading use a stronger one. When a cheaper
+model returns JSON that fails validation, the call can be escalated once to
+the next tier. Latency, token usage and estimated cost are recorded per
+(task, model) route.
+"""
+
+import time
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+
+from rate_limiter import estimate_prompt_tokens
+
+TIER_ORDER = ("lite", "standard", "strong")
+
+DEFAULT_TIERS = {
+    "lite": "gemini-2.0-flash-lite",
+    "standard": "gemini-2.0-flash",
+    "strong": "gemini-2.5-flash",
+}
+
+# task -> ordered rules; a rule without max_prompt_tokens always matches
+DEFAULT_RULES: Dict[str, List[Dict[str, Any]]] = {
+    "generate_flashcards": [{"tier": "lite"}],
+    "summarize_turns": [{"tier": "lite"}],
+    "chat_with_tutor": [{"max_prompt_tokens": 600, "tier": "lite"}, {"tier": "standard"}],
+    "grade_assignment": [{"tier": "strong"}],
+    "generate_learning_path": [{"tier": "strong"}],
+    "extract_prerequisites": [{"tier": "strong"}],
+}
+
+# USD per million (input, output) tokens, used only for the cost estimates in stats()
+DEFAULT_PRICES = {
+    "gemini-2.0-flash-lite": (0.075, 0.30),
+    "gemini-2.0-flash": (0.10, 0.40),
+    "gemini-2.5-flash": (0.30, 2.50),
+}
+
+
+class Route(NamedTuple):
+    task: str
+    model: str
+    tier: Optional[str]
+
+
+class RouteStats:
+    __slots__ = ("calls", "failures", "escalations", "latency_total", "latency_max",
+                 "input_tokens", "output_tokens", "cost_usd")
+
+    def __init__(self):
+        self.calls = 0
+        self.failures = 0
+        self.escalations = 0
+        self.latency_total = 0.0
+        self.latency_max = 0.0
+        self.input_tokens = 0
+        self.output_tokens = 0
+        self.cost_usd = 0.0
+
+
+class ModelRouter:
+    def __init__(self, tiers: Optional[Dict[str, str]] = None,
+                 rules: Optional[Dict[str, List[Dict[str, Any]]]] = None,
+                 prices: Optional[Dict[str, Tuple[float, float]]] = None,
+                 default_tier: str = "standard", escalation: bool = True):
+        self.tiers = {**DEFAULT_TIERS, **(tiers or {})}
+        self.rules = {**DEFAULT_RULES, **(rules or {})}
+        self.prices = {**DEFAULT_PRICES, **{m: tuple(p) for m, p in (prices or {}).items()}}
+        self.default_tier = default_tier if default_tier in self.tiers else "standard"
+        self.escalation = escalation
+        self._stats: Dict[Tuple[str, str], RouteStats] = {}
+
+    def _tier_of(self, model: str) -> Optional[str]:
+        for tier, tier_model in self.tiers.items():
+            if tier_model == model:
+                return tier
+        return None
+
+    def _resolve(self, task: str, rule: Dict[str, Any]) -> Route:
+        if "model" in rule:
+            return Route(task, rule["model"], self._tier_of(rule["model"]))
+        tier = rule.get("tier", self.default_tier)
+        if tier not in self.tiers:
+            tier = self.default_tier
+        return Route(task, self.tiers[tier], tier)
+
+    def route(self, task: str, prompt: str) -> Route:
+        """Pick the model for ``task`` given the size of its prompt"""
+        prompt_tokens = estimate_prompt_tokens(prompt)
+        for rule in self.rules.get(task, ()):
+            limit = rule.get("max_prompt_tokens")
+            if limit is None or prompt_tokens <= limit:
+                return self._resolve(task, rule)
+        return self._resolve(task, {"tier": self.default_tier})
+
+    def fixed(self, task: str, model: str) -> Route:
+        """Route for a caller that asked for a specific model"""
+        return Route(task, model, self._tier_of(model))
+
+    def escalate(self, route: Route) -> Optional[Route]:
+        """Next stronger tier after ``route``, or None when already at the top"""
+        if not self.escalation or route.tier not in TIER_ORDER:
+            return None
+        for tier in TIER_ORDER[TIER_ORDER.index(route.tier) + 1:]:
+            model = self.tiers.get(tier)
+            if model and model != route.model:
+                self._route_stats(route).escalations += 1
+                return Route(route.task, model, tier)
+        return None
+
+    def _route_stats(self, route: Route) -> RouteStats:
+        key = (route.task, route.model)
+        stats = self._stats.get(key)
+        if stats is None:
+            stats = RouteStats()
+            self._stats[key] = stats
+        return stats
+
+    def record(self, route: Route, started: float, input_tokens: Optional[int],
+               output_tokens: Optional[int], ok: bool = True) -> None:
+        """Record one upstream call; ``started`` is a time.perf_counter() value"""
+        latency = time.perf_counter() - started
+        stats = self._route_stats(route)
+        stats.calls += 1
+        if not ok:
+            stats.failures += 1
+        stats.latency_total += latency
+        stats.latency_max = max(stats.latency_max, latency)
+        stats.input_tokens += input_tokens or 0
+        stats.output_tokens += output_tokens or 0
+        input_price, output_price = self.prices.get(route.model, (0.0, 0.0))
+        stats.cost_usd += ((input_tokens or 0) * input_price + (output_tokens or 0) * output_price) / 1_000_000
+
+    def stats(self) -> Dict[str, Any]:
+        routes = []
+        for (task, model), s in sorted(self._stats.items()):
+            routes.append({
+                "task": task,
+                "model": model,
+                "calls": s.calls,
+                "failures": s.failures,
+                "escalations": s.escalations,
+                "avg_latency_ms": round(1000 * s.latency_total / s.calls, 1) if s.calls else 0.0,
+                "max_latency_ms": round(1000 * s.latency_max, 1),
+                "input_tokens": s.input_tokens,
+                "output_tokens": s.output_tokens,
+                "estimated_cost_usd": round(s.cost_usd, 6),
+                "cost_per_1k_calls_usd": round(1000 * s.cost_usd / s.calls, 4) if s.calls else 0.0,
+            })
+        return {
+            "tiers": self.tiers,
+            "default_tier": self.default_tier,
+            "escalation": self.escalation,
+            "rules": self.rules,
+            "routes": routes,
+        }
@@ -0,0 +1,204 @@
+"""
+Local performance analytics
+
+Trend, moving average, volatility, per-topic mastery and percentile rank
+are computed with NumPy instead of being left to Gemini. Score histories
+of a whole cohort are packed into one NaN-padded matrix (students x
+assessments, oldest first), so every metric is a handful of array
+operations however many students there are. Gemini is only asked for the
+optional narrative, and is given these numbers rather than raw scores.
+
+Scores are normalized by ``max_score`` for mastery; every other metric is
+reported on the original scale. A single student's ``moving_average`` is the
+whole series; cohort rows carry only its last value, as
+``latest_moving_average``.
+"""
+
+from typing import Any, Dict, List, Mapping, Optional, Sequence
+
+import numpy as np
+
+# A trend this steep (fraction of max_score per assessment) counts as improving/declining
+TREND_THRESHOLD = 0.01
+# Weight of each older score relative to the next one when computing mastery
+MASTERY_DECAY = 0.7
+
+
+def pad_scores(histories: Sequence[Sequence[float]]) -> np.ndarray:
+    """(students, longest history) float matrix, left-aligned and NaN-padded"""
+    lengths = np.fromiter((len(h) for h in histories), dtype=np.int64, count=len(histories))
+    matrix = np.full((len(histories), int(lengths.max(initial=0))), np.nan)
+    if lengths.sum():
+        rows = np.repeat(np.arange(len(histories)), lengths)
+        cols = np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+        matrix[rows, cols] = np.fromiter((s for h in histories for s in h), dtype=float, count=int(lengths.sum()))
+    return matrix
+
+
+def score_metrics(matrix: np.ndarray, window: int = 3) -> Dict[str, np.ndarray]:
+    """Per-student average, trend slope, last moving average and volatility of a padded matrix"""
+    present = ~np.isnan(matrix)
+    counts = present.sum(axis=1)
+    filled = np.where(present, matrix, 0.0)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        average = filled.sum(axis=1) / counts
+
+        # Least-squares slope of score against assessment index
+        x = np.broadcast_to(np.arange(matrix.shape[1], dtype=float), matrix.shape) * present
+        sx, sy = x.sum(axis=1), filled.sum(axis=1)
+        sxx, sxy = (x * x).sum(axis=1), (x * filled).sum(axis=1)
+        denominator = counts * sxx - sx * sx
+        slope = np.where(denominator > 0, (counts * sxy - sx * sy) / denominator, 0.0)
+
+        # Mean of the last ``window`` scores, via prefix sums
+        prefix = np.concatenate([np.zeros((matrix.shape[0], 1)), np.cumsum(filled, axis=1)], axis=1)
+        rows = np.arange(matrix.shape[0])
+        start = np.maximum(counts - window, 0)
+        moving_average = (prefix[rows, counts] - prefix[rows, start]) / (counts - start)
+
+        # Spread of score-to-score changes
+        changes = np.diff(matrix, axis=1)
+        valid = ~np.isnan(changes)
+        change_counts = valid.sum(axis=1)
+        changes = np.where(valid, changes, 0.0)
+        change_mean = changes.sum(axis=1) / change_counts
+        deviations = np.where(valid, changes - change_mean[:, None], 0.0)
+        volatility = np.sqrt((deviations ** 2).sum(axis=1) / change_counts)
+    volatility = np.where(change_counts > 0, volatility, 0.0)
+    return {
+        "count": counts,
+        "average": average,
+        "slope": slope,
+        "moving_average": moving_average,
+        "volatility": volatility,
+    }
+
+
+def moving_average_series(scores: Sequence[float], window: int = 3) -> List[float]:
+    """Trailing moving average of one history; the first entries average what is available"""
+    values = np.asarray(scores, dtype=float)
+    if not len(values):
+        return []
+    prefix = np.concatenate([[0.0], np.cumsum(values)])
+    end = np.arange(1, len(values) + 1)
+    start = np.maximum(end - window, 0)
+    return _round((prefix[end] - prefix[start]) / (end - start)).tolist()
+
+
+def percentile_ranks(values: np.ndarray, reference: Optional[np.ndarray] = None) -> np.ndarray:
+    """Percent of ``reference`` (default: ``values``) below each value, counting ties as half"""
+    reference = np.sort(values if reference is None else reference)
+    reference = reference[~np.isnan(reference)]
+    if not len(reference):
+        return np.full(len(values), np.nan)
+    below = np.searchsorted(reference, values, side="left")
+    at_or_below = np.searchsorted(reference, values, side="right")
+    ranks = 100.0 * (below + 0.5 * (at_or_below - below)) / len(reference)
+    return np.where(np.isnan(values), np.nan, ranks)
+
+
+def topic_mastery(topic_scores: Sequence[Optional[Mapping[str, Sequence[float]]]], max_score: float = 100.0,
+                  decay: float = MASTERY_DECAY) -> List[Dict[str, float]]:
+    """Recency-weighted share of ``max_score`` per student and topic, in one pass over all scores"""
+    topics: Dict[str, int] = {}
+    student_idx, topic_idx, ages, values = [], [], [], []
+    for student, by_topic in enumerate(topic_scores):
+        for topic, scores in (by_topic or {}).items():
+            index = topics.setdefault(topic, len(topics))
+            student_idx.extend([student] * len(scores))
+            topic_idx.extend([index] * len(scores))
+            ages.extend(range(len(scores) - 1, -1, -1))
+            values.extend(scores)
+    mastery: List[Dict[str, float]] = [{} for _ in topic_scores]
+    if not values:
+        return mastery
+
+    keys = np.asarray(student_idx) * len(topics) + np.asarray(topic_idx)
+    weights = decay ** np.asarray(ages, dtype=float)
+    normalized = np.clip(np.asarray(values, dtype=float) / max_score, 0.0, 1.0)
+    size = len(topic_scores) * len(topics)
+    weighted = np.bincount(keys, weights=weights * normalized, minlength=size)
+    totals = np.bincount(keys, weights=weights, minlength=size)
+    names = list(topics)
+    for key in np.flatnonzero(totals):
+        student, topic = divmod(int(key), len(topics))
+        mastery[student][names[topic]] = round(float(weighted[key] / totals[key]), 3)
+    return mastery
+
+
+def trend_labels(slope: np.ndarray, max_score: float = 100.0) -> np.ndarray:
+    threshold = TREND_THRESHOLD * max_score
+    return np.where(slope > threshold, "improving", np.where(slope < -threshold, "declining", "stable"))
+
+
+def analyze_student(scores: Sequence[float], topic_scores: Optional[Mapping[str, Sequence[float]]] = None,
+                    max_score: float = 100.0, window: int = 3,
+                    cohort_averages: Optional[Sequence[float]] = None) -> Dict[str, Any]:
+    """All metrics for one student; the percentile needs the cohort's average scores"""
+    metrics = score_metrics(pad_scores([scores]), window)
+    percentile = None
+    if cohort_averages:
+        percentile = percentile_ranks(metrics["average"], np.asarray(cohort_averages, dtype=float))[0]
+    return {
+        "average_score": _value(metrics["average"][0]),
+        "trend_slope": _value(metrics["slope"][0]),
+        "trend": str(trend_labels(metrics["slope"], max_score)[0]),
+        "moving_average": moving_average_series(scores, window),
+        "volatility": _value(metrics["volatility"][0]),
+        "percentile": _value(percentile),
+        "topic_mastery": topic_mastery([topic_scores], max_score)[0],
+        "assessments": int(metrics["count"][0]),
+    }
+
+
+def analyze_cohort(students: Sequence[Mapping[str, Any]], max_score: float = 100.0,
+                   window: int = 3) -> Dict[str, Any]:
+    """Metrics for every student (``student_id``, ``scores``, optional ``topic_scores``) plus cohort summary"""
+    metrics = score_metrics(pad_scores([s.get("scores") or [] for s in students]), window)
+    percentiles = percentile_ranks(metrics["average"])
+    trends = trend_labels(metrics["slope"], max_score)
+    mastery = topic_mastery([s.get("topic_scores") for s in students], max_score)
+
+    average, slope = _round(metrics["average"]), _round(metrics["slope"])
+    moving_average, volatility = _round(metrics["moving_average"]), _round(metrics["volatility"])
+    percentiles = _round(percentiles, 1)
+    results = [
+        {
+            "student_id": student.get("student_id"),
+            "average_score": _value(average[i]),
+            "trend_slope": _value(slope[i]),
+            "trend": str(trends[i]),
+            "latest_moving_average": _value(moving_average[i]),
+            "volatility": _value(volatility[i]),
+            "percentile": _value(percentiles[i]),
+            "topic_mastery": mastery[i],
+            "assessments": int(metrics["count"][i]),
+        }
+        for i, student in enumerate(students)
+    ]
+
+    scored = metrics["average"][~np.isnan(metrics["average"])]
+    topic_totals: Dict[str, List[float]] = {}
+    for by_topic in mastery:
+        for topic, value in by_topic.items():
+            topic_totals.setdefault(topic, []).append(value)
+    summary = {
+        "students": len(students),
+        "scored_students": int(len(scored)),
+        "average_score": _value(scored.mean()) if len(scored) else None,
+        "quartiles": _round(np.percentile(scored, [25, 50, 75])).tolist() if len(scored) else None,
+        "trends": {label: int((trends == label).sum()) for label in ("improving", "stable", "declining")},
+        "topic_mastery": {topic: round(float(np.mean(values)), 3) for topic, values in topic_totals.items()},
+    }
+    return {"students": results, "cohort": summary}
+
+
+def _round(values: np.ndarray, digits: int = 2) -> np.ndarray:
+    return np.round(np.asarray(values, dtype=float), digits)
+
+
+def _value(value: Any) -> Optional[float]:
+    """JSON-safe float: rounded, with NaN (no scores) as None"""
+    if value is None or np.isnan(value):
+        return None
+    return round(float(value), 2)
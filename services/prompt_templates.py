@@ -0,0 +1,303 @@
+"""
+Compiled, versioned prompt templates
+
+Prompts used to be rebuilt as indented multi-line f-strings on every call,
+and every leading space and pretty-printed JSON example was billed as input
+tokens. Templates are now compiled once at import: lines are dedented and
+stripped, blank lines dropped and JSON examples minified. Rendering is a
+single ``str.format_map``. Each compiled template has a short content hash
+that is used as its version in response-cache keys, so editing a prompt
+invalidates exactly the cached responses it produced.
+"""
+
+import hashlib
+import json
+import re
+import textwrap
+from typing import Any, Dict, Optional, Tuple
+
+_ESCAPED_PLACEHOLDER = re.compile(r"\{\{(\w+)\}\}")
+_PLACEHOLDER = re.compile(r"\{(\w+)\}")
+
+
+def _first_line_pattern(text: str) -> "re.Pattern[str]":
+    """Regex matching the rendered first line, capturing its placeholders"""
+    first_line = text.split("\n", 1)[0]
+    parts = []
+    seen = set()
+    for i, piece in enumerate(_PLACEHOLDER.split(first_line)):
+        if i % 2 == 0:
+            parts.append(re.escape(piece.replace("{{", "{").replace("}}", "}")))
+        elif piece in seen:
+            parts.append(f"(?P={piece})")
+        else:
+            seen.add(piece)
+            parts.append(f"(?P<{piece}>.+?)")
+    return re.compile("^" + "".join(parts) + "$")
+
+
+class PromptTemplate:
+    __slots__ = ("name", "text", "version", "pattern", "source_chars", "renders", "rendered_chars")
+
+    def __init__(self, name: str, source: str, examples: Optional[Dict[str, Any]] = None):
+        self.name = name
+        source = textwrap.dedent(source)
+        pretty_source = source
+        for key, example in (examples or {}).items():
+            compact = json.dumps(example, ensure_ascii=False, separators=(",", ":"))
+            # Escape JSON braces for str.format but keep {placeholders} inside example values
+            compact = _ESCAPED_PLACEHOLDER.sub(r"{\1}", compact.replace("{", "{{").replace("}", "}}"))
+            source = source.replace("{" + key + "}", compact)
+            pretty_source = pretty_source.replace("{" + key + "}", json.dumps(example, indent=4))
+        self.text = "\n".join(line.strip() for line in source.splitlines() if line.strip())
+        self.version = hashlib.sha256(f"{name}\0{self.text}".encode("utf-8")).hexdigest()[:12]
+        self.pattern = _first_line_pattern(self.text)
+        self.source_chars = len(textwrap.indent(pretty_source, " " * 8))
+        self.renders = 0
+        self.rendered_chars = 0
+
+    def render(self, **params: Any) -> str:
+        prompt = self.text.format_map(params).strip()
+        self.renders += 1
+        self.rendered_chars += len(prompt)
+        return prompt
+
+
+class PromptRegistry:
+    def __init__(self):
+        self._templates: Dict[str, PromptTemplate] = {}
+
+    def register(self, name: str, source: str, examples: Optional[Dict[str, Any]] = None) -> PromptTemplate:
+        template = PromptTemplate(name, source, examples)
+        self._templates[name] = template
+        return template
+
+    def render(self, name: str, **params: Any) -> str:
+        return self._templates[name].render(**params)
+
+    def version(self, name: str) -> str:
+        return self._templates[name].version
+
+    def identify(self, prompt: str) -> Tuple[Optional[str], Dict[str, str]]:
+        """Name of the template that rendered ``prompt`` and its first-line parameters"""
+        first_line = prompt.strip().split("\n", 1)[0]
+        # Most specific first, so a template whose first line extends another's wins
+        for template in sorted(self._templates.values(), key=lambda t: -len(t.pattern.pattern)):
+            match = template.pattern.match(first_line)
+            if match:
+                return template.name, match.groupdict()
+        return None, {}
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            name: {
+                "version": t.version,
+                "template_chars": len(t.text),
+                "uncompiled_chars": t.source_chars,
+                "renders": t.renders,
+                "avg_rendered_chars": round(t.rendered_chars / t.renders, 1) if t.renders else 0.0,
+            }
+            for name, t in sorted(self._templates.items())
+        }
+
+
+PROMPTS = PromptRegistry()
+
+PROMPTS.register("generate_quiz", """
+    Create a quiz with {num_questions} {difficulty} level multiple choice questions about {topic}
+    for {grade_level} students in {language}.
+    Return the response as a valid JSON object in this exact format:
+    {format}
+    Make sure the questions are educational, clear, and appropriate for the grade level.
+    Provide exactly {num_questions} questions.
+    {constraints}
+""", examples={"format": {"quiz": [{
+    "question": "Question text here?",
+    "options": ["Option A", "Option B", "Option C", "Option D"],
+    "answer": "A",
+    "explanation": "Brief explanation of why this is correct",
+}]}})
+
+PROMPTS.register("generate_assignment", """
+    Create a comprehensive assignment about {topic} for {grade_level} students studying {subject}.
+    Generate {num_questions} diverse questions including:
+    - Multiple choice questions
+    - Short answer questions
+    - Problem-solving questions
+    - Critical thinking questions
+    Return the response as a valid JSON object in this exact format:
+    {format}
+    Make the assignment educational, engaging, and appropriate for the grade level.
+    {constraints}
+""", examples={"format": {"assignment": {
+    "title": "Assignment: {topic}",
+    "topic": "{topic}",
+    "grade_level": "{grade_level}",
+    "subject": "{subject}",
+    "questions": [
+        {
+            "id": 1,
+            "type": "multiple_choice",
+            "question": "Question text here?",
+            "options": ["Option A", "Option B", "Option C", "Option D"],
+            "correct_answer": "A",
+            "explanation": "Why this is correct",
+        },
+        {
+            "id": 2,
+            "type": "short_answer",
+            "question": "Question text here?",
+            "correct_answer": "Expected answer here",
+            "explanation": "Key points to include",
+        },
+    ],
+}}})
+
+PROMPTS.register("grade_assignment", """
+    Grade these student answers for an assignment on {topic}.
+    Assignment Questions:
+    {questions_json}
+    Student Answers:
+    {answers_json}
+    Provide a grading report with:
+    1. Overall score (out of 100)
+    2. Question-by-question feedback
+    3. Areas for improvement
+    4. Strengths demonstrated
+    Return as valid JSON in this format:
+    {format}
+""", examples={"format": {
+    "overall_score": 85,
+    "feedback": "Overall feedback here",
+    "question_grades": [
+        {"question_id": 1, "score": 10, "max_score": 10, "feedback": "Specific feedback for question 1"},
+    ],
+    "strengths": ["List of strengths"],
+    "improvements": ["List of areas to improve"],
+}})
+
+PROMPTS.register("grade_assignment_chunk", """
+    Grade these student answers for an assignment on {topic}. Write feedback in {language}.
+    Compare each student_answer with expected_answer and award 0 to max_score points.
+    {items_json}
+    Return valid JSON: {format}
+""", examples={"format": {"question_grades": [
+    {"question_id": 1, "score": 8, "max_score": 10, "feedback": "One or two sentences"},
+]}})
+
+PROMPTS.register("chat_with_tutor", """
+    You are a friendly {subject} tutor. Respond in a {tone} tone in {language}.
+    {history}
+    Student question: {message}
+    Provide a helpful, educational response that explains concepts clearly and encourages learning.
+    Keep your response under 200 words.
+""")
+
+PROMPTS.register("summarize_turns", """
+    Update this summary of a tutoring conversation with the new turns below.
+    Keep the topics covered, what the student understood or struggled with, and open questions.
+    Reply with the updated summary only, in at most 80 words.
+    Current summary: {digest}
+    New turns:
+    {transcript}
+""")
+
+PROMPTS.register("generate_explanation", """
+    Explain {topic} for {grade_level} students in {language} using a {style} style.
+    Previous knowledge: {previous_knowledge}
+    Provide a clear, engaging explanation in simple terms.
+""")
+
+PROMPTS.register("grade_submission", """
+    Grade this student answer:
+    Question: {question}
+    Rubric: {rubric}
+    Student Answer: {student_answer}
+    Provide a score out of 10 and constructive feedback in {language}.
+    Focus on what the student did well and suggest one area for improvement.
+""")
+
+PROMPTS.register("generate_lesson_plan", """
+    Create a {duration_minutes}-minute lesson plan about {topic} for {grade_level} students.
+    Learning Objectives: {learning_objectives}
+    Language: {language}
+    Include:
+    1. Lesson objectives
+    2. Materials needed
+    3. Step-by-step activities
+    4. Assessment ideas
+    5. Differentiation strategies
+    Return as valid JSON format.
+""")
+
+PROMPTS.register("generate_teaching_resources", """
+    Create a {resource_type} about {topic} for {grade_level} students in {language}.
+    Make it educational, engaging, and age-appropriate.
+""")
+
+PROMPTS.register("analyze_performance", """
+    Write a short performance review for this student from the metrics below.
+    The numbers are already computed; do not recalculate them.
+    Metrics: {metrics}
+    Completed Topics: {completed_topics}
+    Additional Data: {student_data}
+    Provide:
+    1. What the average, trend and volatility say about performance
+    2. Strengths and weaknesses by topic mastery
+    3. Recommended next topics
+    4. Study suggestions
+    Language: {language}
+""")
+
+PROMPTS.register("generate_learning_path", """
+    Create a personalized learning path:
+    Current Level: {current_level}
+    Target Goals: {target_goals}
+    Learning Style: {preferred_learning_style}
+    Available Topics: {available_topics}
+    Provide a structured learning journey with milestones.
+    Language: {language}
+""")
+
+PROMPTS.register("extract_prerequisites", """
+    List the direct prerequisites of each of these topics: {topics}
+    Curriculum topics: {curriculum}
+    Keep each listed topic's name exactly as given. Use curriculum topic names for prerequisites
+    where one fits, and only name topics a student must know first. Estimate the study hours each topic needs at {level} level.
+    Return the response as a valid JSON object in this exact format:
+    {format}
+""", examples={"format": {"topics": [{
+    "name": "Fractions",
+    "prerequisites": ["Division"],
+    "estimated_hours": 3,
+}]}})
+
+PROMPTS.register("narrate_learning_path", """
+    Describe this learning path to a {current_level} student aiming for: {target_goals}
+    Learning Style: {preferred_learning_style}
+    Path (stages in order, with estimated hours): {path}
+    Explain why the stages come in this order and give one tip per milestone.
+    Do not add, remove or reorder topics.
+    Language: {language}
+""")
+
+PROMPTS.register("generate_flashcards", """
+    Create {num_cards} educational flashcards about {topic} in {language}.
+    Format: Front of card (question) | Back of card (answer)
+    Make them clear and educational.
+    {constraints}
+""")
+
+PROMPTS.register("generate_study_guide", """
+    Create a comprehensive study guide covering: {topics}
+    Exam Focus: {exam_focus}
+    Language: {language}
+    Include key concepts, important formulas, common mistakes, and practice tips.
+""")
+
+PROMPTS.register("micro_batch", """
+    Answer each of the {count} numbered requests below separately, as if it were the only one.
+    Follow each request's own instructions on content, format, length and language.
+    Return valid JSON with exactly one entry per request, using the request number as id: {format}
+    {requests}
+""", examples={"format": {"responses": [{"id": 1, "response": "Complete answer to request 1"}]}})
@@ -0,0 +1,203 @@
+"""
+Local bank of validated quiz questions
+
+Every schema-valid question Gemini generates is stored in SQLite with its
+topic, grade level, difficulty and language, and kept in memory grouped by
+topic. A quiz is served entirely from the bank only when the requested
+topic has the same words as a stored one ("plant photosynthesis" and
+"photosynthesis plant"). Topics are also indexed by character trigrams,
+and very similar topics with the same numbers and ordinals may top up part
+of a quiz, but never all of it, since "World War I" and "World War II"
+look alike as text. Gemini is only asked for the questions the bank cannot
+supply.
+"""
+
+import hashlib
+import json
+import random
+import re
+import sqlite3
+import threading
+import time
+from collections import defaultdict
+from typing import Any, Dict, FrozenSet, Iterable, List, Set, Tuple
+
+_NON_WORD = re.compile(r"[^\w]+", re.UNICODE)
+_ORDINALS = frozenset(
+    "first second third fourth fifth sixth seventh eighth ninth tenth i ii iii iv v vi vii viii ix x".split()
+)
+
+
+def normalize_text(text: str) -> str:
+    return " ".join(_NON_WORD.sub(" ", str(text).lower()).split())
+
+
+def trigrams(text: str) -> Set[str]:
+    padded = f"  {normalize_text(text)} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def distinguishing_tokens(text: str) -> FrozenSet[str]:
+    """Numbers and ordinals in ``text``; topics that differ in these are different topics"""
+    return frozenset(
+        token for token in normalize_text(text).split() if token in _ORDINALS or any(c.isdigit() for c in token)
+    )
+
+
+def dice_similarity(a: Set[str], b: Set[str]) -> float:
+    return 2 * len(a & b) / (len(a) + len(b)) if a or b else 1.0
+
+
+def drop_near_duplicates(questions: List[Dict[str, Any]], existing: Iterable[str] = (),
+                         threshold: float = 0.85, field: str = "question") -> List[Dict[str, Any]]:
+    """Questions whose text is not a near-duplicate of ``existing`` or of an earlier kept question"""
+    seen = [trigrams(text) for text in existing]
+    kept = []
+    for question in questions:
+        grams = trigrams(question.get(field, ""))
+        if any(dice_similarity(grams, other) >= threshold for other in seen):
+            continue
+        seen.append(grams)
+        kept.append(question)
+    return kept
+
+
+class QuestionBank:
+    def __init__(self, path: str = "question_bank.sqlite3", min_similarity: float = 0.9):
+        self.path = path
+        self.min_similarity = min_similarity
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS questions (
+                fingerprint TEXT PRIMARY KEY,
+                topic TEXT NOT NULL,
+                grade_level TEXT NOT NULL,
+                difficulty TEXT NOT NULL,
+                language TEXT NOT NULL,
+                question TEXT NOT NULL,
+                created_at REAL NOT NULL
+            )
+            """
+        )
+        self._conn.commit()
+        # (topic, grade_level, difficulty, language) -> questions, all normalized
+        self._questions: Dict[Tuple[str, str, str, str], List[Dict[str, Any]]] = defaultdict(list)
+        self._fingerprints: Set[str] = set()
+        self._topic_grams: Dict[str, Set[str]] = {}
+        self._gram_index: Dict[str, Set[str]] = defaultdict(set)
+        self.hits = 0
+        self.partial_hits = 0
+        self.misses = 0
+        self._load()
+
+    def _load(self) -> None:
+        rows = self._conn.execute(
+            "SELECT fingerprint, topic, grade_level, difficulty, language, question FROM questions"
+        ).fetchall()
+        for fingerprint, topic, grade_level, difficulty, language, question in rows:
+            self._index(fingerprint, (topic, grade_level, difficulty, language), json.loads(question))
+
+    def _index(self, fingerprint: str, key: Tuple[str, str, str, str], question: Dict[str, Any]) -> None:
+        self._fingerprints.add(fingerprint)
+        self._questions[key].append(question)
+        topic = key[0]
+        if topic not in self._topic_grams:
+            grams = trigrams(topic)
+            self._topic_grams[topic] = grams
+            for gram in grams:
+                self._gram_index[gram].add(topic)
+
+    @staticmethod
+    def _key(topic: str, grade_level: str, difficulty: str, language: str) -> Tuple[str, str, str, str]:
+        return (normalize_text(topic), normalize_text(grade_level), normalize_text(difficulty), normalize_text(language))
+
+    def matching_topics(self, topic: str) -> Tuple[List[str], List[str]]:
+        """Stored topics with the same words as ``topic``, and similar ones usable for top-ups.
+
+        A similar topic needs trigram Dice similarity of at least
+        ``min_similarity`` and the same numbers and ordinals; best first.
+        """
+        key = normalize_text(topic)
+        words = set(key.split())
+        markers = distinguishing_tokens(key)
+        grams = trigrams(key)
+        overlap: Dict[str, int] = defaultdict(int)
+        for gram in grams:
+            for candidate in self._gram_index.get(gram, ()):
+                overlap[candidate] += 1
+        exact, similar = [], []
+        for candidate, shared in overlap.items():
+            if set(candidate.split()) == words:
+                exact.append(candidate)
+                continue
+            score = 2 * shared / (len(grams) + len(self._topic_grams[candidate]))
+            if score >= self.min_similarity and distinguishing_tokens(candidate) == markers:
+                similar.append((score, candidate))
+        return exact, [candidate for _, candidate in sorted(similar, reverse=True)]
+
+    def sample(self, topic: str, grade_level: str, difficulty: str, language: str, count: int) -> List[Dict[str, Any]]:
+        """Up to ``count`` random questions on the same topic, topped up from similar topics.
+
+        Similar topics never supply the whole quiz: at least one question is
+        left for Gemini unless the topic itself fills it.
+        """
+        _, grade_level, difficulty, language = self._key(topic, grade_level, difficulty, language)
+        chosen: List[Dict[str, Any]] = []
+        with self._lock:
+            exact, similar = self.matching_topics(topic)
+            for candidate in exact:
+                pool = self._questions.get((candidate, grade_level, difficulty, language), [])
+                chosen.extend(random.sample(pool, min(count - len(chosen), len(pool))))
+                if len(chosen) >= count:
+                    break
+            for candidate in similar:
+                if len(chosen) >= count - 1:
+                    break
+                pool = self._questions.get((candidate, grade_level, difficulty, language), [])
+                chosen.extend(random.sample(pool, min(count - 1 - len(chosen), len(pool))))
+            if len(chosen) >= count:
+                self.hits += 1
+            elif chosen:
+                self.partial_hits += 1
+            else:
+                self.misses += 1
+        return [dict(question) for question in chosen]
+
+    def add(self, topic: str, grade_level: str, difficulty: str, language: str,
+            questions: List[Dict[str, Any]]) -> int:
+        """Store validated questions, skipping ones already banked; returns how many were new"""
+        key = self._key(topic, grade_level, difficulty, language)
+        now = time.time()
+        rows = []
+        with self._lock:
+            for question in questions:
+                fingerprint = hashlib.sha256(
+                    f"{key[3]}\0{normalize_text(question.get('question', ''))}".encode("utf-8")
+                ).hexdigest()
+                if fingerprint in self._fingerprints:
+                    continue
+                self._index(fingerprint, key, question)
+                rows.append((fingerprint, *key, json.dumps(question, ensure_ascii=False), now))
+            if rows:
+                self._conn.executemany("INSERT OR IGNORE INTO questions VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+                self._conn.commit()
+        return len(rows)
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.partial_hits + self.misses
+        return {
+            "questions": len(self._fingerprints),
+            "topics": len(self._topic_grams),
+            "min_similarity": self.min_similarity,
+            "hits": self.hits,
+            "partial_hits": self.partial_hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+        }
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
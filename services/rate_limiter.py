@@ -0,0 +1,180 @@
+"""
+Token-bucket admission control for upstream Gemini calls
+
+Every model has two buckets: requests per minute and tokens per minute.
+A call is admitted only when both buckets can cover it. Otherwise it waits,
+but only up to ``max_wait_seconds`` and only while fewer than ``max_queue``
+callers are already waiting for that model. Past those limits it fails fast
+with QuotaExceeded, which the API turns into 429 with Retry-After.
+
+Lower-priority calls may not drain a bucket below a reserved fraction of
+its capacity, which keeps headroom for high-priority work such as grading.
+"""
+
+import asyncio
+import time
+from typing import Any, Dict, Optional
+
+PRIORITIES = ("high", "normal", "low")
+
+
+class QuotaExceeded(Exception):
+    def __init__(self, model: str, retry_after: float, reason: str):
+        super().__init__(f"Gemini quota exhausted for {model}: {reason}")
+        self.model = model
+        self.retry_after = max(0.0, retry_after)
+        self.reason = reason
+
+
+def estimate_prompt_tokens(prompt: str) -> int:
+    """Rough token count (~4 characters per token) for quota budgeting"""
+    return max(1, len(prompt) // 4)
+
+
+class TokenBucket:
+    def __init__(self, capacity: float, refill_per_second: float):
+        self.capacity = float(capacity)
+        self.refill_per_second = float(refill_per_second)
+        self.tokens = float(capacity)
+        self._updated = time.monotonic()
+
+    def _refill(self, now: float) -> None:
+        elapsed = now - self._updated
+        if elapsed > 0:
+            self.tokens = min(self.capacity, self.tokens + elapsed * self.refill_per_second)
+            self._updated = now
+
+    def wait_time(self, amount: float, reserve: float = 0.0, now: Optional[float] = None) -> float:
+        """Seconds until ``amount`` can be taken without dropping below ``reserve``"""
+        self._refill(time.monotonic() if now is None else now)
+        needed = amount + reserve - self.tokens
+        if needed <= 0:
+            return 0.0
+        if amount + reserve > self.capacity or self.refill_per_second <= 0:
+            return float("inf")
+        return needed / self.refill_per_second
+
+    def consume(self, amount: float) -> None:
+        self.tokens -= amount
+
+    def refund(self, amount: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + amount)
+
+
+class ModelQuota:
+    def __init__(self, rpm: int, tpm: int):
+        self.requests = TokenBucket(rpm, rpm / 60.0)
+        self.tokens = TokenBucket(tpm, tpm / 60.0)
+        self.waiting = 0
+        self.admitted = 0
+        self.rejected = 0
+        self.wait_seconds_total = 0.0
+
+
+class AdmissionController:
+    def __init__(self, limits: Optional[Dict[str, Dict[str, int]]] = None, default_rpm: int = 2000,
+                 default_tpm: int = 4_000_000, max_queue: int = 100, max_wait_seconds: float = 10.0,
+                 reserve_fraction: float = 0.2, expected_output_tokens: int = 512):
+        self.limits = limits or {}
+        self.default_rpm = default_rpm
+        self.default_tpm = default_tpm
+        self.max_queue = max_queue
+        self.max_wait_seconds = max_wait_seconds
+        self.reserve_fraction = min(max(reserve_fraction, 0.0), 0.45)
+        self.expected_output_tokens = expected_output_tokens
+        self._quotas: Dict[str, ModelQuota] = {}
+
+    def _quota(self, model: str) -> ModelQuota:
+        quota = self._quotas.get(model)
+        if quota is None:
+            limit = self.limits.get(model, {})
+            quota = ModelQuota(int(limit.get("rpm", self.default_rpm)), int(limit.get("tpm", self.default_tpm)))
+            self._quotas[model] = quota
+        return quota
+
+    def _reserve(self, priority: str) -> float:
+        """Fraction of each bucket this priority must leave untouched"""
+        if priority == "high":
+            return 0.0
+        if priority == "low":
+            return 2 * self.reserve_fraction
+        return self.reserve_fraction
+
+    def estimate_tokens(self, prompt: str) -> int:
+        return estimate_prompt_tokens(prompt) + self.expected_output_tokens
+
+    async def acquire(self, model: str, estimated_tokens: int, priority: str = "normal") -> float:
+        """Wait for capacity and take it; returns the time spent queued"""
+        quota = self._quota(model)
+        reserve = self._reserve(priority)
+        request_reserve = quota.requests.capacity * reserve
+        token_reserve = quota.tokens.capacity * reserve
+        # A single oversized request is charged at most a full bucket
+        estimated_tokens = min(estimated_tokens, quota.tokens.capacity)
+        started = time.monotonic()
+
+        queued = False
+        try:
+            while True:
+                now = time.monotonic()
+                wait = max(
+                    quota.requests.wait_time(1, request_reserve, now),
+                    quota.tokens.wait_time(estimated_tokens, token_reserve, now),
+                )
+                if wait == 0:
+                    quota.requests.consume(1)
+                    quota.tokens.consume(estimated_tokens)
+                    quota.admitted += 1
+                    waited = now - started
+                    quota.wait_seconds_total += waited
+                    return waited
+
+                elapsed = now - started
+                if not queued and quota.waiting >= self.max_queue:
+                    quota.rejected += 1
+                    raise QuotaExceeded(model, wait, "admission queue is full")
+                if elapsed + wait > self.max_wait_seconds:
+                    quota.rejected += 1
+                    raise QuotaExceeded(model, wait, f"{priority}-priority wait would exceed {self.max_wait_seconds:g}s")
+
+                if not queued:
+                    queued = True
+                    quota.waiting += 1
+                await asyncio.sleep(min(wait, 0.25))
+        finally:
+            if queued:
+                quota.waiting -= 1
+
+    def settle(self, model: str, estimated_tokens: int, actual_tokens: Optional[int]) -> None:
+        """Correct the token bucket once the real usage of a call is known"""
+        if actual_tokens is None:
+            return
+        quota = self._quota(model)
+        difference = estimated_tokens - actual_tokens
+        if difference > 0:
+            quota.tokens.refund(difference)
+        else:
+            quota.tokens.consume(-difference)
+
+    def stats(self) -> Dict[str, Any]:
+        now = time.monotonic()
+        result = {}
+        for model, quota in self._quotas.items():
+            quota.requests.wait_time(0, now=now)
+            quota.tokens.wait_time(0, now=now)
+            result[model] = {
+                "rpm_limit": int(quota.requests.capacity),
+                "tpm_limit": int(quota.tokens.capacity),
+                "requests_available": round(quota.requests.tokens, 1),
+                "tokens_available": int(quota.tokens.tokens),
+                "waiting": quota.waiting,
+                "admitted": quota.admitted,
+                "rejected": quota.rejected,
+                "avg_wait_ms": round(1000 * quota.wait_seconds_total / quota.admitted, 2) if quota.admitted else 0.0,
+            }
+        return {
+            "max_queue": self.max_queue,
+            "max_wait_seconds": self.max_wait_seconds,
+            "reserve_fraction": self.reserve_fraction,
+            "models": result,
+        }
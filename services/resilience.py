@@ -0,0 +1,181 @@
+"""
+Retry and circuit-breaker policies for upstream Gemini calls
+
+Errors are classified first: rate limits, server errors, timeouts and
+connection failures are retried with capped exponential backoff and full
+jitter; everything else (bad request, auth, safety blocks) fails at once.
+A circuit breaker per model opens after consecutive failures so that an
+outage short-circuits straight to the fallback responses instead of every
+request waiting for the upstream timeout.
+"""
+
+import asyncio
+import random
+import time
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple, Type
+
+RETRYABLE_STATUS_CODES = {408, 429, 500, 502, 503, 504}
+RETRYABLE_MESSAGE_HINTS = ("timeout", "timed out", "temporarily", "unavailable", "connection", "resource_exhausted")
+
+
+class CircuitOpenError(Exception):
+    def __init__(self, model: str, retry_after: float):
+        super().__init__(f"Circuit breaker open for {model}, retry in {retry_after:.1f}s")
+        self.model = model
+        self.retry_after = retry_after
+
+
+def error_status_code(error: BaseException) -> Optional[int]:
+    """HTTP status of an SDK/httpx error, if it carries one"""
+    for attribute in ("code", "status_code"):
+        value = getattr(error, attribute, None)
+        if isinstance(value, int):
+            return value
+    response = getattr(error, "response", None)
+    value = getattr(response, "status_code", None)
+    return value if isinstance(value, int) else None
+
+
+def is_retryable(error: BaseException) -> bool:
+    if isinstance(error, (asyncio.TimeoutError, TimeoutError, ConnectionError)):
+        return True
+    status = error_status_code(error)
+    if status is not None:
+        return status in RETRYABLE_STATUS_CODES
+    # Transport errors from httpx/aiohttp carry no status code
+    name = type(error).__name__.lower()
+    if "timeout" in name or "connect" in name or "network" in name:
+        return True
+    message = str(error).lower()
+    return any(hint in message for hint in RETRYABLE_MESSAGE_HINTS)
+
+
+class RetryPolicy:
+    def __init__(self, max_attempts: int = 3, base_delay: float = 0.5, max_delay: float = 8.0):
+        self.max_attempts = max(1, max_attempts)
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def backoff(self, attempt: int) -> float:
+        """Full-jitter delay before retry number ``attempt`` (1-based)"""
+        return random.uniform(0, min(self.max_delay, self.base_delay * (2 ** (attempt - 1))))
+
+
+class CircuitBreaker:
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.failure_threshold = max(1, failure_threshold)
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self.times_opened = 0
+        self.short_circuited = 0
+        self._probe_in_flight = False
+
+    def before_call(self, model: str) -> None:
+        """Raise CircuitOpenError unless a call may go upstream now"""
+        if self.state == self.OPEN:
+            remaining = self.opened_at + self.reset_timeout - time.monotonic()
+            if remaining > 0:
+                self.short_circuited += 1
+                raise CircuitOpenError(model, remaining)
+            self.state = self.HALF_OPEN
+        if self.state == self.HALF_OPEN:
+            # Let exactly one probe through; everyone else keeps failing fast
+            if self._probe_in_flight:
+                self.short_circuited += 1
+                raise CircuitOpenError(model, self.reset_timeout)
+            self._probe_in_flight = True
+
+    def release_probe(self) -> None:
+        """Free the half-open probe slot after a call that says nothing about upstream health"""
+        self._probe_in_flight = False
+
+    def record_success(self) -> None:
+        self.state = self.CLOSED
+        self.consecutive_failures = 0
+        self._probe_in_flight = False
+
+    def record_failure(self) -> None:
+        self.consecutive_failures += 1
+        if self.state == self.HALF_OPEN or self.consecutive_failures >= self.failure_threshold:
+            if self.state != self.OPEN:
+                self.times_opened += 1
+            self.state = self.OPEN
+            self.opened_at = time.monotonic()
+        self._probe_in_flight = False
+
+    def snapshot(self) -> Dict[str, Any]:
+        data = {
+            "state": self.state,
+            "consecutive_failures": self.consecutive_failures,
+            "times_opened": self.times_opened,
+            "short_circuited": self.short_circuited,
+        }
+        if self.state == self.OPEN:
+            data["retry_in_seconds"] = round(max(0.0, self.opened_at + self.reset_timeout - time.monotonic()), 1)
+        return data
+
+
+class ResilientCaller:
+    """Runs upstream calls through a per-model breaker and the retry policy"""
+
+    def __init__(self, retry_policy: Optional[RetryPolicy] = None, failure_threshold: int = 5,
+                 reset_timeout: float = 30.0):
+        self.retry_policy = retry_policy or RetryPolicy()
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._breakers: Dict[str, CircuitBreaker] = {}
+        self.retries = 0
+        self.non_retryable_failures = 0
+
+    def breaker(self, model: str) -> CircuitBreaker:
+        breaker = self._breakers.get(model)
+        if breaker is None:
+            breaker = CircuitBreaker(self.failure_threshold, self.reset_timeout)
+            self._breakers[model] = breaker
+        return breaker
+
+    async def call(self, model: str, fn: Callable[[], Awaitable[Any]],
+                   on_retry: Optional[Callable[[int, BaseException], None]] = None,
+                   passthrough: Tuple[Type[BaseException], ...] = ()) -> Any:
+        """Call ``fn`` with retries; exceptions in ``passthrough`` are raised untouched"""
+        breaker = self.breaker(model)
+        attempt = 0
+        while True:
+            attempt += 1
+            breaker.before_call(model)
+            try:
+                result = await fn()
+            except (asyncio.CancelledError, *passthrough):
+                # Not the upstream's fault
+                breaker.release_probe()
+                raise
+            except Exception as e:
+                if not is_retryable(e):
+                    # Bad requests say nothing about upstream health
+                    breaker.release_probe()
+                    self.non_retryable_failures += 1
+                    raise
+                breaker.record_failure()
+                if attempt >= self.retry_policy.max_attempts or breaker.state == CircuitBreaker.OPEN:
+                    raise
+                self.retries += 1
+                if on_retry is not None:
+                    on_retry(attempt, e)
+                await asyncio.sleep(self.retry_policy.backoff(attempt))
+                continue
+            breaker.record_success()
+            return result
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "max_attempts": self.retry_policy.max_attempts,
+            "retries": self.retries,
+            "non_retryable_failures": self.non_retryable_failures,
+            "breakers": {model: breaker.snapshot() for model, breaker in self._breakers.items()},
+        }
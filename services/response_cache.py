@@ -0,0 +1,259 @@
+"""
+Content-addressed response cache for deterministic AI generators
+
+Keys are a SHA-256 of the generator name, its prompt version and the
+normalized request parameters, so two requests that only differ in case or
+whitespace share one entry. Backends are pluggable: an in-process LRU is the
+default and a SQLite file can be used to share entries between workers.
+"""
+
+import copy
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+
+def normalize_params(value: Any) -> Any:
+    """Normalize request parameters so equivalent requests hash identically"""
+    if isinstance(value, str):
+        return " ".join(value.split()).casefold()
+    if isinstance(value, dict):
+        return {str(k): normalize_params(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [normalize_params(v) for v in value]
+    return value
+
+
+def make_cache_key(method: str, prompt_version: str, params: Dict[str, Any]) -> str:
+    payload = json.dumps(
+        {"method": method, "version": prompt_version, "params": normalize_params(params)},
+        sort_keys=True,
+        separators=(",", ":"),
+        default=str,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def parse_cache_control(header: Optional[str]) -> Tuple[bool, bool]:
+    """Return (read, write) for a Cache-Control request header.
+
+    ``no-cache`` skips the lookup but stores the fresh result,
+    ``no-store`` bypasses the cache entirely.
+    """
+    if not header:
+        return True, True
+    directives = {part.strip().lower() for part in header.split(",")}
+    if "no-store" in directives:
+        return False, False
+    if "no-cache" in directives or "max-age=0" in directives:
+        return False, True
+    return True, True
+
+
+class CacheBackend(ABC):
+    """Storage interface for ResponseCache; values must be JSON-serializable"""
+
+    name = "base"
+
+    def __init__(self):
+        self.evictions = 0
+        self.expirations = 0
+
+    @abstractmethod
+    def get(self, key: str) -> Optional[Any]:
+        """Return the stored value, or None when missing or expired"""
+
+    @abstractmethod
+    def set(self, key: str, value: Any, ttl: float) -> None:
+        """Store a value for ``ttl`` seconds, evicting entries if over capacity"""
+
+    @abstractmethod
+    def delete(self, key: str) -> None:
+        """Remove a single entry"""
+
+    @abstractmethod
+    def clear(self) -> None:
+        """Remove every entry"""
+
+    @abstractmethod
+    def size(self) -> int:
+        """Number of stored entries"""
+
+    def close(self) -> None:
+        pass
+
+
+class InMemoryCacheBackend(CacheBackend):
+    """Process-local LRU with per-entry TTL"""
+
+    name = "memory"
+
+    def __init__(self, max_entries: int = 1024):
+        super().__init__()
+        self.max_entries = max(1, max_entries)
+        self._entries: "OrderedDict[str, Tuple[float, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at <= time.time():
+                del self._entries[key]
+                self.expirations += 1
+                return None
+            self._entries.move_to_end(key)
+            return copy.deepcopy(value)
+
+    def set(self, key, value, ttl):
+        with self._lock:
+            self._entries[key] = (time.time() + ttl, copy.deepcopy(value))
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def size(self):
+        return len(self._entries)
+
+
+class SQLiteCacheBackend(CacheBackend):
+    """On-disk LRU in a SQLite file, shareable between worker processes"""
+
+    name = "sqlite"
+
+    def __init__(self, path: str = "response_cache.sqlite3", max_entries: int = 10000):
+        super().__init__()
+        self.path = path
+        self.max_entries = max(1, max_entries)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            " key TEXT PRIMARY KEY, value TEXT NOT NULL,"
+            " expires_at REAL NOT NULL, last_access REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS responses_lru ON responses (last_access)")
+
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value, expires_at FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            if row[1] <= now:
+                self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self.expirations += 1
+                return None
+            self._conn.execute("UPDATE responses SET last_access = ? WHERE key = ?", (now, key))
+        return json.loads(row[0])
+
+    def set(self, key, value, ttl):
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses (key, value, expires_at, last_access) VALUES (?, ?, ?, ?)",
+                (key, json.dumps(value), now + ttl, now),
+            )
+            overflow = self.size() - self.max_entries
+            if overflow > 0:
+                self._conn.execute(
+                    "DELETE FROM responses WHERE key IN"
+                    " (SELECT key FROM responses ORDER BY last_access LIMIT ?)",
+                    (overflow,),
+                )
+                self.evictions += overflow
+
+    def delete(self, key):
+        with self._lock:
+            self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM responses")
+
+    def size(self):
+        return self._conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class ResponseCache:
+    """Counts hits, misses and bypasses on top of a CacheBackend"""
+
+    def __init__(self, backend: CacheBackend, ttl_seconds: float = 3600):
+        self.backend = backend
+        self.ttl_seconds = ttl_seconds
+        self.hits = 0
+        self.misses = 0
+        self.bypasses = 0
+        self.stores = 0
+
+    def get(self, key: str) -> Optional[Any]:
+        value = self.backend.get(key)
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    def set(self, key: str, value: Any, ttl: Optional[float] = None) -> None:
+        self.backend.set(key, value, self.ttl_seconds if ttl is None else ttl)
+        self.stores += 1
+
+    def record_bypass(self) -> None:
+        self.bypasses += 1
+
+    def clear(self) -> None:
+        self.backend.clear()
+
+    def close(self) -> None:
+        self.backend.close()
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "backend": self.backend.name,
+            "entries": self.backend.size(),
+            "ttl_seconds": self.ttl_seconds,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "bypasses": self.bypasses,
+            "stores": self.stores,
+            "evictions": self.backend.evictions,
+            "expirations": self.backend.expirations,
+        }
+
+
+def create_response_cache(backend: str = "memory", ttl_seconds: float = 3600,
+                          max_entries: int = 1024, path: str = "response_cache.sqlite3") -> Optional[ResponseCache]:
+    """Build a ResponseCache from configuration; ``backend="none"`` disables caching"""
+    backend = (backend or "memory").lower()
+    if backend in ("none", "off", "disabled"):
+        return None
+    if backend in ("sqlite", "disk"):
+        return ResponseCache(SQLiteCacheBackend(path=path, max_entries=max_entries), ttl_seconds)
+    if backend == "memory":
+        return ResponseCache(InMemoryCacheBackend(max_entries=max_entries), ttl_seconds)
+    raise ValueError(f"Unknown response cache backend: {backend}")
@@ -0,0 +1,104 @@
+"""
+Launch modes for the AI service
+
+``development`` keeps the single auto-reloading process. ``production``
+runs WEB_CONCURRENCY worker processes (default: one per CPU) sharing one
+listening socket, without the file watcher. Each worker finishes its
+lifespan startup (client pool, caches, question bank, optional upstream
+warmup) before it accepts connections.
+
+On SIGTERM/SIGINT a worker marks itself draining so ``/ready`` fails,
+stops accepting connections, waits up to GRACEFUL_SHUTDOWN_SECONDS for
+in-flight requests and streams, and only then runs the app's shutdown,
+which waits for any remaining upstream Gemini calls before closing the
+client pool.
+
+Workers share nothing in memory: the in-memory response cache, tutor
+sessions and /metrics counters are per process. Use the sqlite response
+cache backend to share cached responses between workers. The flashcard
+store keeps an in-memory index per worker but catches up from its SQLite
+file before every read, so decks are shared.
+"""
+
+import logging
+import os
+import threading
+from typing import Optional
+
+import uvicorn
+from uvicorn.supervisors import Multiprocess
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+logger = logging.getLogger("server")
+
+# Set in a worker as soon as it is asked to shut down
+DRAINING = threading.Event()
+
+_singleton_locks = {}
+
+
+class DrainingServer(uvicorn.Server):
+    def handle_exit(self, sig, frame) -> None:
+        DRAINING.set()
+        super().handle_exit(sig, frame)
+
+
+def claim_singleton(path: str) -> bool:
+    """True in exactly one worker process per lock file, for once-per-deployment startup work"""
+    if fcntl is None:
+        return True
+    if path in _singleton_locks:
+        return True
+    handle = open(path, "a+")
+    try:
+        fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        handle.close()
+        return False
+    # Held until the process exits
+    _singleton_locks[path] = handle
+    return True
+
+
+def run(app: str = "gemini_service:app", mode: Optional[str] = None) -> None:
+    mode = (mode or os.getenv("SERVER_MODE", "development")).lower()
+    host = os.getenv("HOST", "0.0.0.0")
+    port = int(os.getenv("PORT", "8000"))
+    log_level = os.getenv("LOG_LEVEL", "INFO").lower()
+
+    if mode != "production":
+        logger.info("Starting development server with auto-reload", extra={"host": host, "port": port})
+        # The access line is logged as JSON by RequestIdMiddleware
+        uvicorn.run(app, host=host, port=port, reload=True, log_level=log_level, access_log=False)
+        return
+
+    config = uvicorn.Config(
+        app,
+        host=host,
+        port=port,
+        workers=int(os.getenv("WEB_CONCURRENCY", str(os.cpu_count() or 1))),
+        timeout_graceful_shutdown=int(os.getenv("GRACEFUL_SHUTDOWN_SECONDS", "30")),
+        timeout_keep_alive=int(os.getenv("KEEP_ALIVE_SECONDS", "5")),
+        backlog=int(os.getenv("SOCKET_BACKLOG", "2048")),
+        log_level=log_level,
+        access_log=False,
+        proxy_headers=True,
+        server_header=False,
+    )
+    server = DrainingServer(config)
+    logger.info("Starting production server", extra={"host": host, "port": port, "workers": config.workers})
+    if config.workers > 1:
+        sock = config.bind_socket()
+        Multiprocess(config, target=server.run, sockets=[sock]).run()
+    else:
+        server.run()
+
+
+if __name__ == "__main__":
+    # Go through the importable module so workers and the app share its DRAINING flag
+    import server
+    server.run()
@@ -0,0 +1,55 @@
+"""
+Single-flight coalescing of identical in-flight async calls
+
+Concurrent callers that ask for the same key wait on one shared task instead
+of each starting their own upstream request. The shared task is shielded, so
+a caller that disconnects does not cancel the work for everyone else.
+"""
+
+import asyncio
+import copy
+from collections import defaultdict
+from typing import Any, Awaitable, Callable, Dict
+
+
+class SingleFlight:
+    def __init__(self):
+        self._inflight: Dict[str, asyncio.Task] = {}
+        self._counters: Dict[str, Dict[str, int]] = defaultdict(lambda: {"calls": 0, "upstream": 0, "deduplicated": 0})
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[Any]], scope: str = "default") -> Any:
+        """Run ``fn`` once per key at a time; followers get a copy of the leader's result"""
+        counters = self._counters[scope]
+        counters["calls"] += 1
+        flight_key = f"{scope}:{key}"
+
+        task = self._inflight.get(flight_key)
+        if task is not None:
+            counters["deduplicated"] += 1
+            return copy.deepcopy(await asyncio.shield(task))
+
+        counters["upstream"] += 1
+        task = asyncio.ensure_future(fn())
+        self._inflight[flight_key] = task
+
+        def _forget(done_task, flight_key=flight_key):
+            if self._inflight.get(flight_key) is done_task:
+                del self._inflight[flight_key]
+            # Retrieve the exception so abandoned flights don't log "never retrieved"
+            if not done_task.cancelled():
+                done_task.exception()
+
+        task.add_done_callback(_forget)
+        return await asyncio.shield(task)
+
+    def stats(self) -> Dict[str, Any]:
+        scopes = {scope: dict(counters) for scope, counters in self._counters.items()}
+        calls = sum(c["calls"] for c in scopes.values())
+        deduplicated = sum(c["deduplicated"] for c in scopes.values())
+        return {
+            "in_flight": len(self._inflight),
+            "calls": calls,
+            "deduplicated": deduplicated,
+            "dedup_rate": round(deduplicated / calls, 4) if calls else 0.0,
+            "scopes": scopes,
+        }
@@ -0,0 +1,107 @@
+"""
+Incremental parser for JSON arrays of objects in streamed model output
+
+The model is asked for a document like {"quiz": [{...}, {...}]}. Instead of
+waiting for the whole reply, JsonArrayItemParser is fed text chunks as they
+arrive and returns each array element as soon as its closing brace is seen.
+Markdown code fences and any text around the document are ignored, and a
+truncated tail only loses the unfinished element.
+"""
+
+import json
+import re
+from typing import Any, Dict, List
+
+
+class JsonArrayItemParser:
+    def __init__(self, array_key: str):
+        self.array_key = array_key
+        self._key_pattern = re.compile(r'"' + re.escape(array_key) + r'"\s*:\s*\[')
+        self._buffer = ""
+        self._pos = 0
+        self._in_array = False
+        self._done = False
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._item_start = -1
+        self.items_parsed = 0
+        self.items_skipped = 0
+
+    @property
+    def done(self) -> bool:
+        """True once the closing bracket of the array has been seen"""
+        return self._done
+
+    def feed(self, text: str) -> List[Dict[str, Any]]:
+        """Consume a chunk and return the objects completed by it"""
+        if self._done or not text:
+            return []
+        self._buffer += text
+
+        if not self._in_array:
+            match = self._key_pattern.search(self._buffer, max(0, self._pos - len(self.array_key) - 8))
+            if match is None:
+                self._pos = len(self._buffer)
+                return []
+            self._in_array = True
+            self._buffer = self._buffer[match.end():]
+            self._pos = 0
+
+        completed = []
+        buffer = self._buffer
+        i = self._pos
+        while i < len(buffer):
+            char = buffer[i]
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif char == "\\":
+                    self._escape = True
+                elif char == '"':
+                    self._in_string = False
+            elif char == '"':
+                self._in_string = True
+            elif char in "{[":
+                if self._depth == 0 and char == "{":
+                    self._item_start = i
+                self._depth += 1
+            elif char in "}]":
+                if self._depth == 0 and char == "]":
+                    self._done = True
+                    i += 1
+                    break
+                self._depth -= 1
+                if self._depth == 0 and self._item_start >= 0:
+                    item = self._decode(buffer[self._item_start:i + 1])
+                    if item is not None:
+                        completed.append(item)
+                    self._item_start = -1
+            i += 1
+
+        # Drop consumed text so the buffer only holds the unfinished element
+        if self._item_start >= 0:
+            self._buffer = buffer[self._item_start:]
+            self._pos = i - self._item_start
+            self._item_start = 0
+        else:
+            self._buffer = ""
+            self._pos = 0
+        return completed
+
+    def _decode(self, fragment: str):
+        try:
+            item = json.loads(fragment)
+        except json.JSONDecodeError:
+            self.items_skipped += 1
+            return None
+        if not isinstance(item, dict):
+            self.items_skipped += 1
+            return None
+        self.items_parsed += 1
+        return item
+
+
+def salvage_array_items(text: str, array_key: str) -> List[Dict[str, Any]]:
+    """Recover every complete object from a possibly truncated or malformed reply"""
+    return JsonArrayItemParser(array_key).feed(text)
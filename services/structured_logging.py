@@ -0,0 +1,196 @@
+"""
+Structured JSON logging for the AI service
+
+Log records are handed to a QueueHandler on the calling thread and written
+to stdout by a QueueListener thread, so request handlers never block on
+stdout. Every line is one JSON object carrying the request id of the HTTP
+request that produced it. Verbose payloads (raw model replies, user
+messages) are logged with ``extra={"payload": ...}``; the record is always
+written, but only a sampled fraction keeps its payload, truncated. API
+keys, bearer tokens and secret-like fields are redacted before anything is
+written.
+"""
+
+import atexit
+import copy
+import json
+import logging
+import queue
+import random
+import re
+import sys
+import time
+import uuid
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+from typing import Any, Optional
+
+REDACTED = "[REDACTED]"
+
+request_id_var: ContextVar[str] = ContextVar("request_id", default="-")
+
+_SECRET_FIELD = re.compile(r"api[_-]?key|authorization|token|secret|password|cookie", re.IGNORECASE)
+_SECRET_PATTERNS = (
+    re.compile(r"AIza[0-9A-Za-z_\-]{20,}"),
+    re.compile(r"(?i)\bbearer\s+[A-Za-z0-9._~+/\-]+=*"),
+    re.compile(r"(?i)\b(api[_-]?key|key|token|secret|password)=[^\s&\"']+"),
+)
+_VALID_REQUEST_ID = re.compile(r"^[A-Za-z0-9._\-]{1,128}$")
+
+# Attributes every LogRecord has; anything else came from ``extra``
+_RECORD_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime", "request_id"}
+
+
+def redact(value: Any) -> Any:
+    """Copy of ``value`` with secret-looking strings and fields masked"""
+    if isinstance(value, str):
+        for pattern in _SECRET_PATTERNS:
+            value = pattern.sub(REDACTED, value)
+        return value
+    if isinstance(value, dict):
+        return {
+            key: REDACTED if isinstance(key, str) and _SECRET_FIELD.search(key) and item else redact(item)
+            for key, item in value.items()
+        }
+    if isinstance(value, (list, tuple)):
+        return [redact(item) for item in value]
+    return value
+
+
+class JsonFormatter(logging.Formatter):
+    def __init__(self, redact_secrets: bool = True):
+        super().__init__()
+        self.redact_secrets = redact_secrets
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "request_id": getattr(record, "request_id", "-"),
+            "msg": record.getMessage(),
+        }
+        for key, value in record.__dict__.items():
+            if key not in _RECORD_ATTRS:
+                entry[key] = value
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry["exc"] = record.exc_text
+        if self.redact_secrets:
+            entry = redact(entry)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class RequestContextFilter(logging.Filter):
+    """Stamp records with the current request id while still on the calling task"""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.request_id = request_id_var.get()
+        return True
+
+
+class PayloadSampler(logging.Filter):
+    """Keep the ``payload`` of ``sample_rate`` of records, truncated to ``max_chars``; strip it from the rest"""
+
+    def __init__(self, sample_rate: float = 0.1, max_chars: int = 200):
+        super().__init__()
+        self.sample_rate = min(1.0, max(0.0, sample_rate))
+        self.max_chars = max_chars
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        payload = getattr(record, "payload", None)
+        if payload is None:
+            return True
+        if random.random() >= self.sample_rate:
+            del record.payload
+            return True
+        text = payload if isinstance(payload, str) else json.dumps(payload, ensure_ascii=False, default=str)
+        if len(text) > self.max_chars:
+            text = text[:self.max_chars] + "..."
+        record.payload = text
+        return True
+
+
+class _NonBlockingQueueHandler(QueueHandler):
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Merge args and render tracebacks here; the listener thread only formats JSON
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+_listener: Optional[QueueListener] = None
+
+
+def configure_logging(level: str = "INFO", payload_sample_rate: float = 0.1, payload_max_chars: int = 200,
+                      redact_secrets: bool = True, stream=None) -> QueueListener:
+    """Route the root logger through a background JSON writer; safe to call again"""
+    global _listener
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        if isinstance(handler, _NonBlockingQueueHandler):
+            root.removeHandler(handler)
+    if _listener is not None:
+        _listener.stop()
+
+    records: "queue.SimpleQueue[logging.LogRecord]" = queue.SimpleQueue()
+    writer = logging.StreamHandler(stream or sys.stdout)
+    writer.setFormatter(JsonFormatter(redact_secrets))
+    handler = _NonBlockingQueueHandler(records)
+    handler.addFilter(RequestContextFilter())
+    handler.addFilter(PayloadSampler(payload_sample_rate, payload_max_chars))
+    root.addHandler(handler)
+    root.setLevel(level.upper())
+
+    _listener = QueueListener(records, writer)
+    _listener.start()
+    return _listener
+
+
+@atexit.register
+def _flush_logs() -> None:
+    if _listener is not None:
+        _listener.stop()
+
+
+class RequestIdMiddleware:
+    """Pure ASGI middleware: assigns each request an id, echoes it and logs one access line"""
+
+    def __init__(self, app, header: str = "x-request-id", logger_name: str = "access"):
+        self.app = app
+        self.header = header.lower().encode("latin-1")
+        self.logger = logging.getLogger(logger_name)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        incoming = dict(scope["headers"]).get(self.header, b"").decode("latin-1")
+        request_id = incoming if _VALID_REQUEST_ID.match(incoming) else uuid.uuid4().hex
+        token = request_id_var.set(request_id)
+        started = time.perf_counter()
+        status = {"code": 500}
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+                message["headers"] = list(message.get("headers", [])) + [(self.header, request_id.encode("latin-1"))]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            self.logger.info("Request completed", extra={
+                "method": scope.get("method"),
+                "path": scope.get("path"),
+                "status": status["code"],
+                "duration_ms": round(1000 * (time.perf_counter() - started), 1),
+            })
+            request_id_var.reset(token)
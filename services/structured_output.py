@@ -0,0 +1,181 @@
+"""
+Schema-validated JSON output for Gemini generators
+
+The pydantic models below are passed to the SDK as ``response_schema`` so the
+model is constrained to the expected shape, and the same models validate the
+reply once with pydantic-core. A reply that still fails is first repaired
+locally (code fences, surrounding prose, trailing commas, a truncated tail)
+before the caller spends a single re-ask on it. Outcomes are counted per
+method so parse-failure rates can be monitored.
+"""
+
+import re
+from typing import Any, Dict, List, Optional, Tuple, Type
+
+from pydantic import BaseModel, ValidationError
+
+_TRAILING_COMMA = re.compile(r",\s*([}\]])")
+
+
+class QuizQuestion(BaseModel):
+    question: str
+    options: List[str]
+    answer: str
+    explanation: str = ""
+
+
+class Quiz(BaseModel):
+    quiz: List[QuizQuestion]
+
+
+class AssignmentQuestion(BaseModel):
+    id: int
+    type: str
+    question: str
+    options: Optional[List[str]] = None
+    correct_answer: str
+    explanation: str = ""
+
+
+class AssignmentBody(BaseModel):
+    title: str
+    topic: str
+    grade_level: str
+    subject: str
+    questions: List[AssignmentQuestion]
+
+
+class Assignment(BaseModel):
+    assignment: AssignmentBody
+
+
+class QuestionGrade(BaseModel):
+    question_id: int
+    score: float
+    max_score: float
+    feedback: str = ""
+
+
+class QuestionGrades(BaseModel):
+    question_grades: List[QuestionGrade]
+
+
+class GradeReport(BaseModel):
+    overall_score: float
+    feedback: str
+    question_grades: List[QuestionGrade] = []
+    strengths: List[str] = []
+    improvements: List[str] = []
+
+
+class PackedReply(BaseModel):
+    id: int
+    response: str
+
+
+class PackedReplies(BaseModel):
+    responses: List[PackedReply]
+
+
+class TopicPrerequisites(BaseModel):
+    name: str
+    prerequisites: List[str] = []
+    estimated_hours: float = 2.0
+
+
+class TopicGraphExtraction(BaseModel):
+    topics: List[TopicPrerequisites]
+
+
+def _json_span(text: str) -> str:
+    """The JSON document inside a reply, without code fences or surrounding prose"""
+    text = text.strip()
+    parts = text.split("```")
+    if len(parts) > 2:
+        text = parts[1].strip()
+        if text.startswith("json"):
+            text = text[4:].strip()
+    start = text.find("{")
+    return text[start:] if start > 0 else text
+
+
+def _truncation_repairs(text: str, limit: int = 4) -> List[str]:
+    """Candidate fixes for a truncated document, most complete first.
+
+    Each candidate cuts the text at a comma between array elements and closes
+    the brackets still open there, dropping the unfinished element.
+    """
+    stack = []
+    in_string = escape = False
+    cuts = []
+    for i, char in enumerate(text):
+        if in_string:
+            if escape:
+                escape = False
+            elif char == "\\":
+                escape = True
+            elif char == '"':
+                in_string = False
+            continue
+        if char == '"':
+            in_string = True
+        elif char in "{[":
+            stack.append("}" if char == "{" else "]")
+        elif char in "}]":
+            if not stack:
+                return [text[:i]]
+            stack.pop()
+            if not stack:
+                # Ignore anything after the top-level document
+                return [text[:i + 1]]
+        elif char == "," and stack and stack[-1] == "]":
+            cuts.append(text[:i] + "".join(reversed(stack)))
+    return cuts[::-1][:limit] or [text]
+
+
+def repair_candidates(text: str) -> List[str]:
+    """Best-effort local fixes of common model JSON mistakes"""
+    return [_TRAILING_COMMA.sub(r"\1", candidate) for candidate in _truncation_repairs(_json_span(text))]
+
+
+def parse_structured(text: str, schema: Type[BaseModel]) -> Tuple[Optional[Dict[str, Any]], bool, str]:
+    """Validate a reply against ``schema``.
+
+    Returns (data, repaired, error): ``data`` is None when the reply could
+    not be validated even after local repair.
+    """
+    try:
+        return schema.model_validate_json(_json_span(text)).model_dump(exclude_none=True), False, ""
+    except ValidationError as e:
+        error = e
+    for candidate in repair_candidates(text):
+        try:
+            return schema.model_validate_json(candidate).model_dump(exclude_none=True), True, ""
+        except ValidationError:
+            continue
+    # Report the original error; it is what a re-ask should correct
+    return None, False, "; ".join(
+        f"{'.'.join(str(part) for part in err['loc']) or 'document'}: {err['msg']}" for err in error.errors()[:5]
+    )
+
+
+class StructuredOutputStats:
+    OUTCOMES = ("valid", "repaired", "reasked", "failed", "unavailable")
+
+    def __init__(self):
+        self._counts: Dict[str, Dict[str, int]] = {}
+
+    def record(self, method: str, outcome: str) -> None:
+        counts = self._counts.setdefault(method, dict.fromkeys(self.OUTCOMES, 0))
+        counts[outcome] += 1
+
+    def stats(self) -> Dict[str, Any]:
+        methods = {}
+        for method, counts in sorted(self._counts.items()):
+            answered = sum(counts[o] for o in ("valid", "repaired", "reasked", "failed"))
+            methods[method] = {
+                **counts,
+                "first_pass_failure_rate": round(1 - counts["valid"] / answered, 4) if answered else 0.0,
+                "final_failure_rate": round(counts["failed"] / answered, 4) if answered else 0.0,
+            }
+        return {"methods": methods}
@@ -0,0 +1,50 @@
+import asyncio
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import benchmark
+import topic_graph
+from gemini_service import app
+
+
+def test_goal_listed_as_available_topic_is_extracted_once(tmp_path, monkeypatch):
+    for name, value in {
+        "GEMINI_BACKEND": "fake",
+        "FAKE_GEMINI_CONFIG": json.dumps({"latency": {"distribution": "fixed", "median": 0.0}, "tokens_per_second": 0}),
+        "QUESTION_BANK": "0",
+        "TOPIC_GRAPH_PATH": str(tmp_path / "topic_graph.sqlite3"),
+        "FLASHCARD_STORE_PATH": str(tmp_path / "flashcards.sqlite3"),
+        "GRADING_JOBS_DB": str(tmp_path / "grading_jobs.sqlite3"),
+    }.items():
+        monkeypatch.setenv(name, value)
+    monkeypatch.delenv("GEMINI_API_KEY", raising=False)
+    warnings = []
+    monkeypatch.setattr(topic_graph.logger, "warning", lambda msg, *args, **kwargs: warnings.append(msg))
+
+    async def run():
+        async with app.router.lifespan_context(app):
+            service = app.state.gemini_service
+            extracted = []
+            extract = service._extract_prerequisites
+
+            async def recording_extract(topics, curriculum, level):
+                extracted.append(list(topics))
+                return await extract(topics, curriculum, level)
+
+            monkeypatch.setattr(service, "_extract_prerequisites", recording_extract)
+            body = {"current_level": "beginner", "target_goals": ["Calculus"],
+                    "available_topics": ["Limits", "calculus"]}
+            status, reply = await benchmark.InProcessClient(app).request(
+                "POST", "/api/analytics/learning-path", None, json.dumps(body).encode(), {}
+            )
+            return status, json.loads(reply), extracted, service.topic_graph
+
+    status, path, extracted, graph = asyncio.run(run())
+    assert status == 200
+    assert extracted == [["Limits", "calculus"]]
+    assert "Skipped cyclic prerequisite" not in warnings
+    assert "calculus" not in graph._prerequisites["calculus"]
+    assert [step["topic"] for step in path["steps"]] == ["Limits", "calculus"]
@@ -0,0 +1,275 @@
+"""
+Persisted topic prerequisite graph
+
+Curriculum topics, their prerequisites and estimated study hours are kept
+in SQLite and in memory. They are imported once or extracted by Gemini the
+first time a topic is seen. A learning path is every topic the goals depend
+on, minus what the student has already covered, in topological order and
+grouped into stages whose topics can be studied in any order. Paths are
+computed locally and memoized per (level, goals, style, completed,
+available) until the graph changes, so Gemini is only needed for topics
+the graph does not know yet, or for an optional narrative.
+
+A name matches a topic only by its normalized name, an imported alias, or
+the same set of words. There is no fuzzy matching: "linear algebra" is not
+"algebra", so an unknown topic is extracted rather than mapped onto a
+broader one.
+"""
+
+import logging
+import sqlite3
+import threading
+import time
+from collections import OrderedDict, defaultdict
+from typing import Any, Dict, Iterable, List, Mapping, Optional, Sequence, Set, Tuple
+
+from question_bank import normalize_text
+
+logger = logging.getLogger("topic_graph")
+
+DEFAULT_HOURS = 2.0
+
+STYLE_ACTIVITIES = {
+    "visual": "Study diagrams, concept maps and short videos",
+    "auditory": "Listen to an explanation, then explain it aloud in your own words",
+    "reading": "Read the notes and write a one-page summary",
+    "kinesthetic": "Work through hands-on exercises and experiments",
+    "mixed": "Read the notes, watch a short video, then practice with exercises",
+}
+
+
+class CycleError(ValueError):
+    """An imported prerequisite would make a topic depend on itself"""
+
+
+class TopicGraph:
+    def __init__(self, path: str = "topic_graph.sqlite3", memo_size: int = 1024):
+        self.path = path
+        self.memo_size = memo_size
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS topics (
+                key TEXT PRIMARY KEY,
+                name TEXT NOT NULL,
+                hours REAL NOT NULL,
+                source TEXT NOT NULL,
+                updated_at REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS prerequisites (
+                topic TEXT NOT NULL,
+                prerequisite TEXT NOT NULL,
+                PRIMARY KEY (topic, prerequisite)
+            );
+            CREATE TABLE IF NOT EXISTS aliases (
+                alias TEXT PRIMARY KEY,
+                topic TEXT NOT NULL
+            );
+            """
+        )
+        self._conn.commit()
+        # Keyed by normalized topic name
+        self._names: Dict[str, str] = {}
+        self._hours: Dict[str, float] = {}
+        self._prerequisites: Dict[str, Set[str]] = defaultdict(set)
+        # Normalized alias -> topic key, and sorted words -> topic key
+        self._aliases: Dict[str, str] = {}
+        self._word_sets: Dict[Tuple[str, ...], str] = {}
+        self._paths: "OrderedDict[Tuple, Dict[str, Any]]" = OrderedDict()
+        self.version = 0
+        self.path_hits = 0
+        self.path_misses = 0
+        self._load()
+
+    def _load(self) -> None:
+        for key, name, hours in self._conn.execute("SELECT key, name, hours FROM topics").fetchall():
+            self._index(key, name, hours)
+        for topic, prerequisite in self._conn.execute("SELECT topic, prerequisite FROM prerequisites").fetchall():
+            self._prerequisites[topic].add(prerequisite)
+        self._aliases.update(self._conn.execute("SELECT alias, topic FROM aliases").fetchall())
+
+    def _index(self, key: str, name: str, hours: float) -> None:
+        self._names[key] = name
+        self._hours[key] = hours
+        self._word_sets.setdefault(tuple(sorted(set(key.split()))), key)
+
+    def resolve(self, name: str) -> Optional[str]:
+        """Key of the stored topic ``name`` is the name, an alias or a word reordering of"""
+        key = normalize_text(name)
+        if key in self._names:
+            return key
+        if key in self._aliases:
+            return self._aliases[key]
+        return self._word_sets.get(tuple(sorted(set(key.split()))))
+
+    def missing(self, names: Iterable[str]) -> List[str]:
+        """Names no stored topic matches, each normalized name once"""
+        found: Dict[str, str] = {}
+        for name in names:
+            if self.resolve(name) is None:
+                found.setdefault(normalize_text(name), name)
+        return list(found.values())
+
+    def _depends_on(self, topic: str, target: str) -> bool:
+        stack, seen = [topic], set()
+        while stack:
+            current = stack.pop()
+            if current == target:
+                return True
+            if current not in seen:
+                seen.add(current)
+                stack.extend(self._prerequisites.get(current, ()))
+        return False
+
+    def add_topics(self, topics: Iterable[Mapping[str, Any]], source: str = "import", strict: bool = True) -> int:
+        """Store topics (``name``, ``prerequisites``, ``estimated_hours``, ``aliases``); returns how many edges were added.
+
+        A prerequisite that would close a cycle raises CycleError when
+        ``strict`` (topics before it are kept), and is skipped otherwise.
+        """
+        now = time.time()
+        topic_rows, edge_rows, alias_rows = [], [], []
+        with self._lock:
+            for topic in topics:
+                key = normalize_text(topic["name"])
+                if not key:
+                    continue
+                hours = float(topic.get("estimated_hours") or self._hours.get(key, DEFAULT_HOURS))
+                self._index(key, str(topic["name"]).strip(), hours)
+                topic_rows.append((key, self._names[key], hours, source, now))
+                for alias in topic.get("aliases") or []:
+                    alias_key = normalize_text(alias)
+                    if alias_key and alias_key != key:
+                        self._aliases[alias_key] = key
+                        alias_rows.append((alias_key, key))
+                for prerequisite in topic.get("prerequisites") or []:
+                    prerequisite_key = normalize_text(prerequisite)
+                    if not prerequisite_key or prerequisite_key in self._prerequisites[key]:
+                        continue
+                    if self._depends_on(prerequisite_key, key):
+                        if strict:
+                            self._commit(topic_rows, edge_rows, alias_rows)
+                            raise CycleError(f"'{prerequisite}' already depends on '{topic['name']}'")
+                        logger.warning("Skipped cyclic prerequisite", extra={
+                            "topic": topic["name"], "prerequisite": prerequisite
+                        })
+                        continue
+                    if prerequisite_key not in self._names:
+                        self._index(prerequisite_key, str(prerequisite).strip(), DEFAULT_HOURS)
+                        topic_rows.append((prerequisite_key, self._names[prerequisite_key], DEFAULT_HOURS, source, now))
+                    self._prerequisites[key].add(prerequisite_key)
+                    edge_rows.append((key, prerequisite_key))
+            self._commit(topic_rows, edge_rows, alias_rows)
+        return len(edge_rows)
+
+    def _commit(self, topic_rows: List[Tuple], edge_rows: List[Tuple], alias_rows: List[Tuple]) -> None:
+        if topic_rows:
+            self._conn.executemany("INSERT OR REPLACE INTO topics VALUES (?, ?, ?, ?, ?)", topic_rows)
+        if edge_rows:
+            self._conn.executemany("INSERT OR IGNORE INTO prerequisites VALUES (?, ?)", edge_rows)
+        if alias_rows:
+            self._conn.executemany("INSERT OR REPLACE INTO aliases VALUES (?, ?)", alias_rows)
+        if topic_rows or edge_rows or alias_rows:
+            self._conn.commit()
+            # Cached paths may now be wrong
+            self.version += 1
+            self._paths.clear()
+
+    def _ancestors(self, keys: Iterable[str]) -> Set[str]:
+        found: Set[str] = set()
+        stack = list(keys)
+        while stack:
+            for prerequisite in self._prerequisites.get(stack.pop(), ()):
+                if prerequisite not in found:
+                    found.add(prerequisite)
+                    stack.append(prerequisite)
+        return found
+
+    def learning_path(self, current_level: str, goals: Sequence[str], style: str = "mixed",
+                      completed: Sequence[str] = (), available: Sequence[str] = ()) -> Optional[Dict[str, Any]]:
+        """Ordered study plan toward ``goals``, or None when no goal or available topic is in the graph"""
+        memo_key = (normalize_text(current_level), tuple(sorted(map(normalize_text, goals))),
+                    normalize_text(style), tuple(sorted(map(normalize_text, completed))),
+                    tuple(sorted(map(normalize_text, available))))
+        with self._lock:
+            cached = self._paths.get(memo_key)
+            if cached is not None:
+                self._paths.move_to_end(memo_key)
+                self.path_hits += 1
+                return dict(cached)
+            self.path_misses += 1
+            path = self._plan(current_level, goals, style, completed, available)
+            self._paths[memo_key] = path
+            if len(self._paths) > self.memo_size:
+                self._paths.popitem(last=False)
+        return dict(path) if path is not None else None
+
+    def _plan(self, current_level: str, goals: Sequence[str], style: str,
+              completed: Sequence[str], available: Sequence[str]) -> Optional[Dict[str, Any]]:
+        resolved = {goal: self.resolve(goal) for goal in goals}
+        targets = {key for key in resolved.values() if key is not None}
+        if not targets:
+            # Goals outside the graph, such as "pass the final exam": cover the offered topics
+            targets = {key for key in map(self.resolve, available) if key is not None}
+        if not targets:
+            return None
+
+        known = {key for key in map(self.resolve, completed) if key is not None}
+        level = self.resolve(current_level)
+        if level is not None:
+            known |= {level} | self._ancestors([level])
+        needed = (targets | self._ancestors(targets)) - known
+
+        # Kahn's algorithm, one stage per layer
+        remaining = {key: self._prerequisites.get(key, set()) & needed for key in needed}
+        activity = STYLE_ACTIVITIES.get(normalize_text(style), STYLE_ACTIVITIES["mixed"])
+        steps, milestones, total = [], [], 0.0
+        while remaining:
+            ready = sorted((key for key, deps in remaining.items() if not deps), key=lambda k: self._names[k])
+            for key in ready:
+                del remaining[key]
+            for deps in remaining.values():
+                deps.difference_update(ready)
+            stage_hours = sum(self._hours[key] for key in ready)
+            total += stage_hours
+            for key in ready:
+                steps.append({
+                    "order": len(steps) + 1,
+                    "topic": self._names[key],
+                    "stage": len(milestones) + 1,
+                    "prerequisites": sorted(self._names[p] for p in self._prerequisites.get(key, ())),
+                    "estimated_hours": self._hours[key],
+                    "activity": activity,
+                    "goal": key in targets,
+                })
+            milestones.append({
+                "stage": len(milestones) + 1,
+                "topics": [self._names[key] for key in ready],
+                "estimated_hours": round(stage_hours, 2),
+                "cumulative_hours": round(total, 2),
+            })
+        return {
+            "steps": steps,
+            "milestones": milestones,
+            "total_hours": round(total, 2),
+            "already_covered": sorted(self._names[key] for key in known & (targets | self._ancestors(targets))),
+            "unmatched_goals": [goal for goal, key in resolved.items() if key is None],
+        }
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.path_hits + self.path_misses
+        return {
+            "topics": len(self._names),
+            "prerequisites": sum(len(p) for p in self._prerequisites.values()),
+            "version": self.version,
+            "memoized_paths": len(self._paths),
+            "path_hits": self.path_hits,
+            "path_misses": self.path_misses,
+            "hit_rate": round(self.path_hits / lookups, 4) if lookups else 0.0,
+        }
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,200 @@
+"""
+Bounded per-session conversation memory for the AI tutor
+
+Each session keeps its most recent turns in a buffer. When the buffer or
+its estimated token budget overflows, the oldest half of the turns is
+folded into a short digest in one block, so compaction happens once every
+few exchanges rather than on every one. The digest is updated extractively
+right away and, when a summarizer is provided, refined by the model in the
+background so the reply is never delayed by summarization. A session has
+at most one summary call in flight; turns compacted meanwhile are queued
+and folded in by a single follow-up call. Sessions expire after an idle TTL and the store
+keeps at most ``max_sessions`` sessions in LRU order, so memory stays flat
+no matter how many learners are connected.
+"""
+
+import asyncio
+import logging
+import time
+from collections import OrderedDict, deque
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional
+
+Summarizer = Callable[[str, List[Dict[str, str]]], Awaitable[str]]
+
+logger = logging.getLogger("tutor_sessions")
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count (~4 characters per token) used for budgeting"""
+    return max(1, len(text) // 4)
+
+
+def extractive_digest(digest: str, turns: List[Dict[str, str]], max_chars: int) -> str:
+    """Fold turns into the digest by keeping the first sentence of each"""
+    lines = [digest] if digest else []
+    for turn in turns:
+        first_sentence = turn["content"].strip().split("\n")[0].split(". ")[0][:160]
+        lines.append(f"{turn['role']}: {first_sentence}")
+    text = "\n".join(lines)
+    # Keep the most recent part when the digest itself grows too long
+    return text[-max_chars:] if len(text) > max_chars else text
+
+
+class TutorSession:
+    __slots__ = ("session_id", "turns", "digest", "summary_base", "queued", "summarizing",
+                 "context", "tokens", "last_active", "lock")
+
+    def __init__(self, session_id: str):
+        self.session_id = session_id
+        self.turns: Deque[Dict[str, str]] = deque()
+        self.digest = ""
+        # Digest the queued turns are to be summarized into, and turns not yet sent to the summarizer
+        self.summary_base = ""
+        self.queued: List[Dict[str, str]] = []
+        self.summarizing = False
+        self.context: Dict[str, Any] = {}
+        self.tokens = 0
+        self.last_active = time.monotonic()
+        self.lock = asyncio.Lock()
+
+
+class TutorSessionStore:
+    def __init__(self, max_sessions: int = 10000, max_turns: int = 12, max_history_tokens: int = 1500,
+                 idle_ttl_seconds: float = 1800, digest_max_chars: int = 1200,
+                 summarizer: Optional[Summarizer] = None):
+        self.max_sessions = max(1, max_sessions)
+        self.max_turns = max(2, max_turns)
+        self.max_history_tokens = max_history_tokens
+        self.idle_ttl_seconds = idle_ttl_seconds
+        self.digest_max_chars = digest_max_chars
+        self.summarizer = summarizer
+        self._sessions: "OrderedDict[str, TutorSession]" = OrderedDict()
+        self.created = 0
+        self.evicted = 0
+        self.expired = 0
+        self.compactions = 0
+        self.summaries = 0
+        self._pending: set = set()
+
+    def _expire_idle(self, now: float) -> None:
+        # LRU order means the idle sessions are at the front
+        while self._sessions:
+            session = next(iter(self._sessions.values()))
+            if now - session.last_active < self.idle_ttl_seconds:
+                break
+            self._sessions.popitem(last=False)
+            self.expired += 1
+
+    def get(self, session_id: str) -> TutorSession:
+        """Return the session, creating it (and evicting the LRU one) if needed"""
+        now = time.monotonic()
+        self._expire_idle(now)
+        session = self._sessions.get(session_id)
+        if session is None:
+            session = TutorSession(session_id)
+            self._sessions[session_id] = session
+            self.created += 1
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+                self.evicted += 1
+        else:
+            self._sessions.move_to_end(session_id)
+        session.last_active = now
+        return session
+
+    def peek(self, session_id: str) -> Optional[TutorSession]:
+        return self._sessions.get(session_id)
+
+    def reset(self, session_id: str) -> bool:
+        return self._sessions.pop(session_id, None) is not None
+
+    def snapshot(self, session: TutorSession) -> Dict[str, Any]:
+        return {
+            "session_id": session.session_id,
+            "context": session.context,
+            "digest": session.digest,
+            "turns": list(session.turns),
+            "estimated_tokens": session.tokens,
+            "idle_seconds": round(time.monotonic() - session.last_active, 1),
+        }
+
+    def render_history(self, session: TutorSession) -> str:
+        """History block to prepend to the tutor prompt"""
+        parts = []
+        if session.context:
+            details = ", ".join(f"{k}: {v}" for k, v in session.context.items())
+            parts.append(f"Session context: {details}")
+        if session.digest:
+            parts.append(f"Summary of earlier conversation:\n{session.digest}")
+        if session.turns:
+            recent = "\n".join(f"{t['role'].capitalize()}: {t['content']}" for t in session.turns)
+            parts.append(f"Recent conversation:\n{recent}")
+        return "\n\n".join(parts)
+
+    def append_exchange(self, session: TutorSession, message: str, reply: str) -> None:
+        """Record a student/tutor exchange, compacting the oldest half of the turns when over budget"""
+        session.turns.append({"role": "student", "content": message})
+        session.turns.append({"role": "tutor", "content": reply})
+        session.tokens = sum(estimate_tokens(t["content"]) for t in session.turns)
+        if len(session.turns) <= self.max_turns and session.tokens <= self.max_history_tokens:
+            return
+
+        # Whole exchanges, so the buffer always starts with a student turn
+        overflow = []
+        keep = max(2, len(session.turns) // 2 // 2 * 2)
+        while len(session.turns) > keep or (session.tokens > self.max_history_tokens and len(session.turns) > 2):
+            turn = session.turns.popleft()
+            session.tokens -= estimate_tokens(turn["content"])
+            overflow.append(turn)
+        self._compact(session, overflow)
+
+    def _compact(self, session: TutorSession, turns: List[Dict[str, str]]) -> None:
+        self.compactions += 1
+        if not session.queued:
+            session.summary_base = session.digest
+        session.digest = extractive_digest(session.digest, turns, self.digest_max_chars)
+        if self.summarizer is None:
+            return
+        session.queued.extend(turns)
+        # The call in flight picks these turns up when it returns
+        if not session.summarizing:
+            session.summarizing = True
+            task = asyncio.ensure_future(self._summarize(session))
+            self._pending.add(task)
+            task.add_done_callback(self._pending.discard)
+
+    async def _summarize(self, session: TutorSession) -> None:
+        try:
+            while session.queued:
+                turns, session.queued = session.queued, []
+                try:
+                    summary = (await self.summarizer(session.summary_base, turns)).strip()[:self.digest_max_chars]
+                except Exception as e:
+                    logger.warning("Session summarization failed, keeping extractive digest: %s", e)
+                    session.queued = []
+                    return
+                if not summary:
+                    session.queued = []
+                    return
+                self.summaries += 1
+                session.summary_base = summary
+                # Otherwise turns compacted meanwhile are folded into this summary on the next pass
+                if not session.queued:
+                    session.digest = summary
+        finally:
+            session.summarizing = False
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "sessions": len(self._sessions),
+            "max_sessions": self.max_sessions,
+            "max_turns": self.max_turns,
+            "max_history_tokens": self.max_history_tokens,
+            "idle_ttl_seconds": self.idle_ttl_seconds,
+            "created": self.created,
+            "evicted": self.evicted,
+            "expired": self.expired,
+            "compactions": self.compactions,
+            "model_summaries": self.summaries,
+            "pending_summaries": len(self._pending),
+        }